@@ -1,4 +1,14 @@
-from .time_analytics import TimeAnalytics
-from .charts import ChartGenerator
+import importlib
+from .time_analytics import TimeAnalytics, AsyncTimeAnalytics
+from .chart_cache import ChartCache
+from .rollups import EventRollups
 
-__all__ = ['TimeAnalytics', 'ChartGenerator']
\ No newline at end of file
+__all__ = ['TimeAnalytics', 'AsyncTimeAnalytics', 'ChartGenerator', 'ChartCache', 'ChartRenderPool', 'EventRollups']
+
+# Chart rendering pulls in matplotlib and numpy, so it is only imported on first use
+_LAZY = {'ChartGenerator': '.charts', 'ChartRenderPool': '.render_pool'}
+
+def __getattr__(name):
+    if name in _LAZY:
+        return getattr(importlib.import_module(_LAZY[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
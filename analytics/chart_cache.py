@@ -0,0 +1,72 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from threading import Lock, get_ident
+
+class ChartCache:
+    """Rendered chart PNGs keyed by a fingerprint of the chart type and its input data.
+
+    Keeps up to `max_bytes` of PNGs in memory, evicting least recently used
+    ones first. With a `directory`, charts are also written to disk so they
+    survive restarts and can be shared between worker processes.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def fingerprint(chart_type, data):
+        payload = json.dumps([chart_type, data], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.png')
+
+    def get(self, key):
+        with self._lock:
+            png = self._entries.get(key)
+            if png is not None:
+                self._entries.move_to_end(key)
+                return png
+
+        if self.directory and os.path.exists(self._path(key)):
+            with open(self._path(key), 'rb') as f:
+                png = f.read()
+            self._store(key, png)
+            return png
+        return None
+
+    def put(self, key, png):
+        self._store(key, png)
+        if self.directory:
+            # Write-then-rename so concurrent readers never see a partial file
+            tmp_path = f'{self._path(key)}.{os.getpid()}.{get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(png)
+            os.replace(tmp_path, self._path(key))
+
+    def _store(self, key, png):
+        with self._lock:
+            if key in self._entries:
+                self._size -= len(self._entries.pop(key))
+            self._entries[key] = png
+            self._size += len(png)
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def get_or_render(self, chart_type, data, render):
+        """Return (key, png), calling render(chart_type, data) only on a cache miss"""
+        key = self.fingerprint(chart_type, data)
+        png = self.get(key)
+        if png is None:
+            png = render(chart_type, data)
+            self.put(key, png)
+        return key, png
@@ -1,88 +1,168 @@
 import base64
 import io
-import matplotlib.pyplot as plt
+import threading
+from abc import ABC, abstractmethod
+from matplotlib import cm
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 import matplotlib.dates as mdates
 from datetime import datetime
 import numpy as np
 
-class ChartGenerator:
-    @staticmethod
-    def create_time_distribution_chart(data):
-        """Create a pie chart for time distribution"""
+class ChartTemplate(ABC):
+    """A figure built once and re-rendered with new data.
+
+    Uses the object-oriented Figure/FigureCanvasAgg API instead of pyplot's
+    global state. A template is not safe to share between threads; use
+    template_for() to get the current thread's instance.
+    """
+    figsize = (8, 6)
+
+    def __init__(self):
+        self.figure = Figure(figsize=self.figsize)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_subplot()
+        self.build()
+
+    def build(self):
+        """Create the axes decorations and artists that stay the same across renders"""
+
+    @abstractmethod
+    def update(self, data):
+        """Point the artists at new data"""
+
+    def render(self, data):
+        self.update(data)
+        buf = io.BytesIO()
+        self.figure.savefig(buf, format='png', bbox_inches='tight')
+        return buf.getvalue()
+
+class DistributionChart(ChartTemplate):
+    figsize = (8, 8)
+
+    def update(self, data):
+        # The number of wedges varies, so the pie is redrawn on the reused axes
         labels = [item['_id'].capitalize() for item in data]
         sizes = [item['total_hours'] for item in data]
-        
-        plt.figure(figsize=(8, 8))
-        plt.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=90)
-        plt.axis('equal')
-        plt.title('Time Distribution by Category')
-        
-        # Save to buffer
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', bbox_inches='tight')
-        buf.seek(0)
-        plt.close()
-        
-        return base64.b64encode(buf.getvalue()).decode('utf-8')
-    
-    @staticmethod
-    def create_productivity_trend_chart(trends):
-        """Create a line chart for productivity trends"""
-        dates = [datetime.strptime(t['date'], '%Y-%m-%d') for t in trends]
+
+        self.ax.clear()
+        self.ax.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=90)
+        self.ax.axis('equal')
+        self.ax.set_title('Time Distribution by Category')
+
+class TrendChart(ChartTemplate):
+    figsize = (10, 6)
+
+    def build(self):
+        self.line, = self.ax.plot([], [], marker='o', linewidth=2, markersize=8)
+        self.fill = None
+        self.labels = []
+
+        self.ax.xaxis.set_major_formatter(mdates.DateFormatter('%b %d'))
+        self.ax.xaxis.set_major_locator(mdates.DayLocator())
+        self.ax.set_title('Productivity Trends (Last 7 Days)')
+        self.ax.set_ylabel('Productive Hours')
+        self.ax.grid(True, alpha=0.3)
+
+    def update(self, trends):
+        dates = mdates.date2num([datetime.strptime(t['date'], '%Y-%m-%d') for t in trends])
         hours = [t['productive_hours'] for t in trends]
         day_names = [t['day_name'] for t in trends]
-        
-        plt.figure(figsize=(10, 6))
-        plt.plot(dates, hours, marker='o', linewidth=2, markersize=8)
-        plt.fill_between(dates, hours, alpha=0.3)
-        
-        plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%b %d'))
-        plt.gca().xaxis.set_major_locator(mdates.DayLocator())
-        plt.gcf().autofmt_xdate()
-        
-        plt.title('Productivity Trends (Last 7 Days)')
-        plt.ylabel('Productive Hours')
-        plt.grid(True, alpha=0.3)
-        
-        # Add day names as labels
-        for i, (date, hour, day) in enumerate(zip(dates, hours, day_names)):
-            plt.annotate(day, (date, hour), textcoords="offset points", 
-                        xytext=(0,10), ha='center', fontsize=8)
-        
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', bbox_inches='tight')
-        buf.seek(0)
-        plt.close()
-        
-        return base64.b64encode(buf.getvalue()).decode('utf-8')
-    
-    @staticmethod
-    def create_peak_hours_chart(peak_hours):
-        """Create a bar chart for peak hours"""
+
+        self.line.set_data(dates, hours)
+
+        # Fill and day labels depend on the number of points, so they are replaced
+        if self.fill is not None:
+            self.fill.remove()
+        for label in self.labels:
+            label.remove()
+        self.fill = self.ax.fill_between(dates, hours, alpha=0.3, facecolor=self.line.get_color())
+        self.labels = [
+            self.ax.annotate(day, (date, hour), textcoords="offset points",
+                             xytext=(0, 10), ha='center', fontsize=8)
+            for date, hour, day in zip(dates, hours, day_names)
+        ]
+
+        self.ax.relim()
+        self.ax.autoscale_view()
+        self.figure.autofmt_xdate()
+
+class PeakHoursChart(ChartTemplate):
+    figsize = (12, 6)
+
+    def build(self):
         hours = [f"{h:02d}:00" for h in range(24)]
+        self.bars = self.ax.bar(hours, np.zeros(24), alpha=0.7)
+
+        self.ax.set_title('Peak Productivity Hours')
+        self.ax.set_xlabel('Hour of Day')
+        self.ax.set_ylabel('Total Work Hours')
+        self.ax.tick_params(axis='x', labelrotation=45)
+        self.ax.grid(True, alpha=0.3)
+
+    def update(self, peak_hours):
         values = [data['hours'] for data in peak_hours]
-        
-        plt.figure(figsize=(12, 6))
-        bars = plt.bar(hours, values, alpha=0.7)
-        
+
         # Color the bars based on value - handle division by zero
         max_val = max(values) if values else 1
-        
-        # Use a safe division that returns 0 when dividing by 0
-        for bar, val in zip(bars, values):
+
+        for bar, val in zip(self.bars, values):
             normalized_val = val / max_val if max_val > 0 else 0
+            bar.set_height(val)
             bar.set_alpha(0.3 + 0.7 * normalized_val)
-            bar.set_color(plt.cm.viridis(normalized_val))
-        
-        plt.title('Peak Productivity Hours')
-        plt.xlabel('Hour of Day')
-        plt.ylabel('Total Work Hours')
-        plt.xticks(rotation=45)
-        plt.grid(True, alpha=0.3)
-        
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', bbox_inches='tight')
-        buf.seek(0)
-        plt.close()
-        
-        return base64.b64encode(buf.getvalue()).decode('utf-8')
\ No newline at end of file
+            bar.set_color(cm.viridis(normalized_val))
+
+        self.ax.relim()
+        self.ax.autoscale_view()
+
+_templates = threading.local()
+
+def template_for(template_cls):
+    """Return the calling thread's instance of a chart template, building it on first use"""
+    templates = getattr(_templates, 'by_class', None)
+    if templates is None:
+        templates = _templates.by_class = {}
+    if template_cls not in templates:
+        templates[template_cls] = template_cls()
+    return templates[template_cls]
+
+class ChartGenerator:
+    @staticmethod
+    def render(chart_type, data):
+        """Render a chart type ('distribution', 'trends' or 'peak_hours') as PNG bytes"""
+        renderers = {
+            'distribution': ChartGenerator.time_distribution_png,
+            'trends': ChartGenerator.productivity_trend_png,
+            'peak_hours': ChartGenerator.peak_hours_png,
+        }
+        return renderers[chart_type](data)
+
+    @staticmethod
+    def create_time_distribution_chart(data):
+        """Create a base64 encoded pie chart for time distribution"""
+        return base64.b64encode(ChartGenerator.time_distribution_png(data)).decode('utf-8')
+
+    @staticmethod
+    def create_productivity_trend_chart(trends):
+        """Create a base64 encoded line chart for productivity trends"""
+        return base64.b64encode(ChartGenerator.productivity_trend_png(trends)).decode('utf-8')
+
+    @staticmethod
+    def create_peak_hours_chart(peak_hours):
+        """Create a base64 encoded bar chart for peak hours"""
+        return base64.b64encode(ChartGenerator.peak_hours_png(peak_hours)).decode('utf-8')
+
+    @staticmethod
+    def time_distribution_png(data):
+        """Create a pie chart for time distribution"""
+        return template_for(DistributionChart).render(data)
+
+    @staticmethod
+    def productivity_trend_png(trends):
+        """Create a line chart for productivity trends"""
+        return template_for(TrendChart).render(trends)
+
+    @staticmethod
+    def peak_hours_png(peak_hours):
+        """Create a bar chart for peak hours"""
+        return template_for(PeakHoursChart).render(peak_hours)
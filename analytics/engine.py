@@ -0,0 +1,186 @@
+from datetime import datetime, timedelta
+import numpy as np
+
+HOUR = 3600
+
+# Only the columns the engine needs leave the server
+EVENT_COLUMNS = {'_id': 0, 'start_time': 1, 'end_time': 1, 'event_type': 1}
+
+# date.toordinal() of 1970-01-01
+EPOCH_ORDINAL = 719163
+
+def _seconds(moment):
+    """Whole seconds since 1970-01-01 on the naive clock of `moment`"""
+    return ((moment.toordinal() - EPOCH_ORDINAL) * 86400
+            + moment.hour * 3600 + moment.minute * 60 + moment.second)
+
+class EventColumns:
+    """Start, end and type of many events as NumPy arrays.
+
+    Times are whole seconds on the same naive clock as the stored datetimes;
+    types are indexes into `categories`.
+    """
+    __slots__ = ('starts', 'ends', 'types', 'categories')
+
+    def __init__(self, starts, ends, types, categories):
+        self.starts = starts
+        self.ends = ends
+        self.types = types
+        self.categories = categories
+
+    def __len__(self):
+        return len(self.starts)
+
+    @classmethod
+    def from_docs(cls, docs):
+        # Converting datetimes by hand is several times faster than np.array(..., 'datetime64[s]')
+        starts, ends, types = [], [], []
+        codes = {}
+        for doc in docs:
+            starts.append(_seconds(doc['start_time']))
+            ends.append(_seconds(doc['end_time']))
+            types.append(codes.setdefault(doc.get('event_type') or 'other', len(codes)))
+        return cls(np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64),
+                   np.array(types, dtype=np.intp), list(codes))
+
+    @staticmethod
+    def _query(user_id, window_start, window_end):
+        return {'user_id': user_id, 'end_time': {'$gt': window_start}, 'start_time': {'$lt': window_end}}
+
+    @classmethod
+    def load(cls, collection, user_id, window_start, window_end):
+        """Columns of the user's events overlapping [window_start, window_end), in one projected pass"""
+        docs = collection.find(cls._query(user_id, window_start, window_end), EVENT_COLUMNS).batch_size(10000)
+        return cls.from_docs(docs)
+
+    @classmethod
+    async def fetch_async(cls, collection, user_id, window_start, window_end):
+        """The documents load() reads, from an async collection; pass them to from_docs()"""
+        cursor = collection.find(cls._query(user_id, window_start, window_end), EVENT_COLUMNS).batch_size(10000)
+        return await cursor.to_list()
+
+    def of_types(self, types):
+        """Mask of the events whose type is one of `types`"""
+        codes = [i for i, category in enumerate(self.categories) if category in types]
+        return np.isin(self.types, codes)
+
+def hourly_seconds(columns, window_start, window_end, mask=None):
+    """Busy seconds in each hour of [window_start, window_end), which must start on the hour.
+
+    Events spanning several hours are split across them: each event adds its
+    partial first and last hours directly, and +1/-1 markers around its full
+    hours, whose running sum counts the events covering each full hour.
+    """
+    origin = _seconds(window_start)
+    hours = -(-int(_seconds(window_end) - origin) // HOUR)
+    starts, ends = columns.starts, columns.ends
+    if mask is not None:
+        starts, ends = starts[mask], ends[mask]
+
+    # Relative to the window and clipped to it
+    starts = np.clip(starts - origin, 0, hours * HOUR)
+    ends = np.clip(ends - origin, 0, hours * HOUR)
+    keep = ends > starts
+    starts, ends = starts[keep], ends[keep]
+
+    first = starts // HOUR
+    last = (ends - 1) // HOUR
+    single = first == last
+    # bincount() of no events returns integers, which the float sums below cannot be added to
+    seconds = np.bincount(first[single], weights=(ends - starts)[single], minlength=hours).astype(float)
+
+    multi = ~single
+    first, last = first[multi], last[multi]
+    seconds += np.bincount(first, weights=(first + 1) * HOUR - starts[multi], minlength=hours)
+    seconds += np.bincount(last, weights=ends[multi] - last * HOUR, minlength=hours)
+    markers = np.bincount(first + 1, minlength=hours + 1) - np.bincount(last, minlength=hours + 1)
+    seconds += np.cumsum(markers)[:hours] * HOUR
+    return seconds
+
+def week_hour_heatmap(hourly, window_start):
+    """7x24 average busy hours per (weekday, hour of day) from whole days of hourly seconds"""
+    days = len(hourly) // 24
+    by_day = hourly[:days * 24].reshape(days, 24)
+    weekdays = (window_start.weekday() + np.arange(days)) % 7
+    totals = np.zeros((7, 24))
+    np.add.at(totals, weekdays, by_day)
+    occurrences = np.bincount(weekdays, minlength=7)
+    return totals / np.maximum(occurrences, 1)[:, None] / HOUR
+
+def daily_hours(hourly):
+    """Busy hours per day from whole days of hourly seconds"""
+    days = len(hourly) // 24
+    return hourly[:days * 24].reshape(days, 24).sum(axis=1) / HOUR
+
+def rolling_mean(values, window):
+    """Trailing mean over `window` values; the first few average over what is available"""
+    totals = np.cumsum(np.concatenate(([0.0], values)))
+    counts = np.minimum(np.arange(1, len(values) + 1), window)
+    return (totals[1:] - totals[np.arange(len(values)) + 1 - counts]) / counts
+
+def monthly_totals(values, window_start):
+    """(months, per-month sums, index of each month's last day) of daily values starting at window_start"""
+    months = (np.datetime64(window_start, 'D') + np.arange(len(values))).astype('datetime64[M]')
+    keys, index, counts = np.unique(months, return_inverse=True, return_counts=True)
+    return keys, np.bincount(index, weights=values, minlength=len(keys)), np.cumsum(counts) - 1
+
+def duration_percentiles(columns, percentiles=(50, 90)):
+    """Per category: number of events, total hours and duration percentiles (in hours)"""
+    durations = (columns.ends - columns.starts) / HOUR
+    results = []
+    for code, category in sorted(enumerate(columns.categories), key=lambda item: item[1]):
+        selected = durations[columns.types == code]
+        if not len(selected):
+            continue
+        row = {'category': category, 'events': int(len(selected)), 'total_hours': round(float(selected.sum()), 2)}
+        for percentile, value in zip(percentiles, np.percentile(selected, percentiles)):
+            row[f'p{percentile}_hours'] = round(float(value), 2)
+        results.append(row)
+    return results
+
+def report_window(years, now=None):
+    """[start, end) of a report over the last `years` years, ending with the current day"""
+    now = now or datetime.now()
+    window_end = datetime(now.year, now.month, now.day) + timedelta(days=1)
+    return window_end - timedelta(days=365 * years), window_end
+
+def trend_report(collection, user_id, years=1, now=None, productive_types=('work', 'health', 'learning'),
+                 rolling=(7, 30)):
+    """Heatmap, daily productive hours with rolling averages and category percentiles over `years` years.
+
+    Recurring events count once, at their stored start, as in the rest of
+    the analytics.
+    """
+    window_start, window_end = report_window(years, now)
+    columns = EventColumns.load(collection, user_id, window_start, window_end)
+    return build_report(columns, window_start, window_end, productive_types, rolling)
+
+def build_report(columns, window_start, window_end, productive_types=('work', 'health', 'learning'),
+                 rolling=(7, 30)):
+    """The trend_report() of already loaded columns"""
+    busy = hourly_seconds(columns, window_start, window_end)
+    productive = daily_hours(hourly_seconds(columns, window_start, window_end, columns.of_types(productive_types)))
+    days = len(productive)
+    daily = {
+        'dates': [(window_start + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days)],
+        'productive_hours': np.round(productive, 2).tolist(),
+    }
+    averages = {window: rolling_mean(productive, window) for window in rolling}
+    for window, values in averages.items():
+        daily[f'rolling_{window}'] = np.round(values, 2).tolist()
+
+    # Each month's rolling averages are as of its last day in the window
+    months, totals, month_ends = monthly_totals(productive, window_start)
+    monthly = [{'month': str(month), 'productive_hours': round(float(total), 2),
+                **{f'rolling_{window}': round(float(values[end]), 2) for window, values in averages.items()}}
+               for month, total, end in zip(months, totals, month_ends)]
+
+    return {
+        'start': window_start.strftime('%Y-%m-%d'),
+        'end': (window_end - timedelta(days=1)).strftime('%Y-%m-%d'),
+        'events': len(columns),
+        'heatmap': np.round(week_hour_heatmap(busy, window_start), 3).tolist(),
+        'daily': daily,
+        'monthly': monthly,
+        'categories': duration_percentiles(columns),
+    }
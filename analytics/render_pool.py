@@ -0,0 +1,74 @@
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+from .chart_cache import ChartCache
+from .charts import ChartGenerator, DistributionChart, TrendChart, PeakHoursChart, template_for
+
+logger = logging.getLogger(__name__)
+
+def _warm_worker():
+    """Build every chart template once so the first real render pays no setup cost"""
+    for template_cls in (DistributionChart, TrendChart, PeakHoursChart):
+        template_for(template_cls)
+
+def _noop():
+    pass
+
+class ChartRenderPool:
+    """Renders charts in a pool of warm worker processes, filling a ChartCache.
+
+    submit() starts a render in the background; render() waits for it (or
+    starts one) for at most `timeout` seconds and falls back to rendering in
+    the calling thread if the pool is slow or broken.
+    """
+
+    def __init__(self, cache, processes, timeout=10):
+        self.cache = cache
+        self.timeout = timeout
+        # spawn: forking a process that holds MongoClient threads is not safe
+        self.executor = ProcessPoolExecutor(max_workers=processes, initializer=_warm_worker,
+                                            mp_context=multiprocessing.get_context('spawn'))
+        self._pending = {}
+        self._lock = Lock()
+        # Start every worker now rather than on the first dashboard request
+        for _ in range(processes):
+            self.executor.submit(_noop)
+
+    def _store(self, key, future):
+        with self._lock:
+            self._pending.pop(key, None)
+        if not future.cancelled() and future.exception() is None:
+            self.cache.put(key, future.result())
+
+    def submit(self, chart_type, data):
+        """Start rendering a chart unless it is cached or already in flight; returns its key"""
+        key = ChartCache.fingerprint(chart_type, data)
+        if self.cache.get(key) is not None:
+            return key
+        with self._lock:
+            if key in self._pending:
+                return key
+            try:
+                future = self.executor.submit(ChartGenerator.render, chart_type, data)
+            except RuntimeError as e:  # BrokenProcessPool or shut down
+                logger.warning("Chart pool unavailable: %s", e)
+                return key
+            self._pending[key] = future
+        future.add_done_callback(lambda f: self._store(key, f))
+        return key
+
+    def render(self, chart_type, data):
+        """Return PNG bytes, preferring the pool and falling back to a serial render"""
+        key = self.submit(chart_type, data)
+        with self._lock:
+            future = self._pending.get(key)
+        if future is not None:
+            try:
+                return future.result(timeout=self.timeout)
+            except Exception as e:
+                logger.warning("Pooled render of %s chart failed (%r), rendering serially", chart_type, e)
+        return self.cache.get(key) or ChartGenerator.render(chart_type, data)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,130 @@
+from datetime import timedelta
+from pymongo import UpdateOne
+
+class EventRollups:
+    """Per-user duration totals and counts, pre-aggregated by hour and event type.
+
+    Each bucket document covers one hour, so daily and hourly views are just
+    ranges over it. An event's duration is split across the hours it spans,
+    while it is counted once, in the hour it starts. Documents with
+    `bucket: None` hold the all-time totals per event type. Durations are
+    kept in whole seconds so repeated $inc deltas never drift.
+    """
+
+    def __init__(self, mongo):
+        self.mongo = mongo
+
+    @property
+    def collection(self):
+        return self.mongo.db.event_rollups
+
+    @staticmethod
+    def bucket_of(start_time):
+        return start_time.replace(minute=0, second=0, microsecond=0)
+
+    @classmethod
+    def hour_slices(cls, start_time, end_time):
+        """(bucket, whole seconds) for each hour that [start_time, end_time) covers"""
+        bucket = cls.bucket_of(start_time)
+        if end_time <= start_time:
+            return [(bucket, 0)]
+        slices = []
+        while bucket < end_time:
+            next_bucket = bucket + timedelta(hours=1)
+            slices.append((bucket, int((min(end_time, next_bucket) - max(start_time, bucket)).total_seconds())))
+            bucket = next_bucket
+        return slices
+
+    @classmethod
+    def _add_deltas(cls, deltas, user_id, event_type, start_time, end_time):
+        """Add an event's seconds per hour, its count at its start hour, and both to its totals"""
+        total = 0
+        for bucket, seconds in cls.hour_slices(start_time, end_time):
+            deltas.setdefault((user_id, event_type, bucket), [0, 0])[0] += seconds
+            total += seconds
+        deltas[(user_id, event_type, cls.bucket_of(start_time))][1] += 1
+        delta = deltas.setdefault((user_id, event_type, None), [0, 0])
+        delta[0] += total
+        delta[1] += 1
+
+    def _apply(self, events, sign):
+        """Apply +/- deltas for events, merged per bucket into one bulk write"""
+        deltas = {}
+        for event in events:
+            self._add_deltas(deltas, event.user_id, event.event_type, event.start_time, event.end_time)
+        if not deltas:
+            return
+
+        self.collection.bulk_write([
+            UpdateOne({'user_id': user_id, 'event_type': event_type, 'bucket': bucket},
+                      {'$inc': {'seconds': sign * seconds, 'count': sign * count}}, upsert=True)
+            for (user_id, event_type, bucket), (seconds, count) in deltas.items()
+        ], ordered=False)
+        if sign < 0:
+            # Drop buckets emptied by this removal; hours an event only runs
+            # into keep a zero count but still hold seconds
+            self.collection.delete_many({
+                '$or': [{'user_id': user_id, 'event_type': event_type, 'bucket': bucket}
+                        for user_id, event_type, bucket in deltas],
+                'count': {'$lte': 0},
+                'seconds': {'$lte': 0}
+            })
+
+    def add(self, event):
+        self._apply([event], 1)
+
+    def add_many(self, events):
+        self._apply(events, 1)
+
+    def remove(self, event):
+        self._apply([event], -1)
+
+    def replace(self, old_event, new_event):
+        self.remove(old_event)
+        self.add(new_event)
+
+    def rebuild(self, user_id=None, batch_size=1000):
+        """Recompute rollups from raw events, for one user or everyone. Returns the number of documents written.
+
+        Events are streamed in (user_id, start_time) order, so an hour bucket
+        is complete, and written, once the stream has moved past it; only the
+        buckets still reachable by running events are held in memory.
+        """
+        match = {} if user_id is None else {'user_id': user_id}
+        self.collection.delete_many(match)
+
+        cursor = self.mongo.db.events.find(
+            match, {'_id': 0, 'user_id': 1, 'event_type': 1, 'start_time': 1, 'end_time': 1}
+        ).sort([('user_id', 1), ('start_time', 1)]).batch_size(batch_size)
+
+        pending = {}
+        batch = []
+        written = 0
+
+        def flush(before=None):
+            nonlocal batch, written
+            done = [key for key in pending if before is None or (key[2] is not None and key[2] < before)]
+            for key in done:
+                seconds, count = pending.pop(key)
+                batch.append({'user_id': key[0], 'event_type': key[1], 'bucket': key[2],
+                              'seconds': seconds, 'count': count})
+                if len(batch) >= batch_size:
+                    self.collection.insert_many(batch, ordered=False)
+                    written += len(batch)
+                    batch = []
+
+        current_user, current_hour = object(), None
+        for doc in cursor:
+            user, hour = doc.get('user_id'), self.bucket_of(doc['start_time'])
+            if user != current_user:
+                flush()
+            elif hour > current_hour:
+                flush(hour)
+            current_user, current_hour = user, hour
+            self._add_deltas(pending, user, doc.get('event_type'), doc['start_time'], doc['end_time'])
+
+        flush()
+        if batch:
+            self.collection.insert_many(batch, ordered=False)
+            written += len(batch)
+        return written
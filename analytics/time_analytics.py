@@ -1,113 +1,194 @@
+import asyncio
 from datetime import datetime, timedelta
-from collections import defaultdict
 from flask_pymongo import PyMongo
-import statistics
+from .rollups import EventRollups
 
 class TimeAnalytics:
+    PRODUCTIVE_TYPES = ['work', 'health', 'learning']
+    CATEGORIES = ['work', 'personal', 'health', 'other']
+
     def __init__(self, mongo):
         self.mongo = mongo
-    
-    def get_time_distribution(self, user_id, days=30):
-        """Get time distribution by event type for the specified period"""
+
+    @staticmethod
+    def _pipeline(user_id, stages, match=None):
+        """Stages over the user's hourly rollups (see EventRollups), with durations in hours"""
+        return [
+            {'$match': {'user_id': user_id, **(match or {})}},
+            {'$project': {'event_type': 1, 'bucket': 1, 'count': 1, 'hours': {'$divide': ['$seconds', 3600]}}}
+        ] + stages
+
+    @staticmethod
+    def since_match(since):
+        """The all-time totals and the hourly rollups from `since` on"""
+        return {'$or': [{'bucket': None}, {'bucket': {'$gte': since}}]}
+
+    def _aggregate(self, user_id, stages, match=None):
+        return list(self.mongo.db.event_rollups.aggregate(self._pipeline(user_id, stages, match)))
+
+    def _facets(self, user_id, facets, since):
+        """Run several facets in a single aggregation round trip.
+
+        Stages inside $facet cannot use an index, so the rollups are first
+        narrowed to those from `since` on (and the all-time totals) by the
+        (user_id, bucket) index.
+        """
+        results = self._aggregate(user_id, [{'$facet': facets}], self.since_match(since))
+        return results[0] if results else {name: [] for name in facets}
+
+    @staticmethod
+    def _window(days):
         end_date = datetime.now()
-        start_date = end_date - timedelta(days=days)
-        
-        pipeline = [
-            {
-                '$match': {
-                    'user_id': user_id,
-                    'start_time': {'$gte': start_date, '$lte': end_date}
-                }
-            },
-            {
-                '$group': {
-                    '_id': '$event_type',
-                    'total_hours': {'$sum': {
-                        '$divide': [
-                            {'$subtract': ['$end_time', '$start_time']},
-                            3600000  # Convert milliseconds to hours
-                        ]
-                    }},
-                    'event_count': {'$sum': 1}
-                }
-            },
-            {
-                '$sort': {'total_hours': -1}
-            }
+        return {'$gte': EventRollups.bucket_of(end_date - timedelta(days=days)), '$lte': end_date}
+
+    @staticmethod
+    def _trend_days(days):
+        today = datetime.now()
+        return [today - timedelta(days=i) for i in reversed(range(days))]
+
+    def _dashboard_since(self, days, trend_days):
+        """Start of the widest window the dashboard looks at"""
+        first_day = datetime.combine(self._trend_days(trend_days)[0], datetime.min.time())
+        return min(self._window(days)['$gte'], first_day)
+
+    # Stages for each metric, usable on their own or as a $facet; _format_*
+    # turns the handful of grouped rows into the shape the templates expect
+
+    def _distribution_facet(self, days):
+        return [
+            {'$match': {'bucket': self._window(days)}},
+            {'$group': {'_id': '$event_type', 'total_hours': {'$sum': '$hours'}, 'event_count': {'$sum': '$count'}}},
+            {'$sort': {'total_hours': -1}}
+        ]
+
+    def _trends_facet(self, days):
+        first_day = datetime.combine(self._trend_days(days)[0], datetime.min.time())
+        last_day = datetime.combine(datetime.now(), datetime.max.time())
+        return [
+            {'$match': {'bucket': {'$gte': first_day, '$lte': last_day},
+                        'event_type': {'$in': self.PRODUCTIVE_TYPES}}},
+            {'$group': {'_id': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$bucket'}},
+                        'productive_hours': {'$sum': '$hours'}}}
+        ]
+
+    def _format_trends(self, rows, days):
+        hours_by_date = {row['_id']: row['productive_hours'] for row in rows}
+        return [{
+            'date': date.strftime('%Y-%m-%d'),
+            'productive_hours': round(hours_by_date.get(date.strftime('%Y-%m-%d'), 0), 2),
+            'day_name': date.strftime('%A')
+        } for date in self._trend_days(days)]
+
+    def _peak_hours_facet(self, days):
+        return [
+            {'$match': {'bucket': self._window(days), 'event_type': 'work'}},
+            {'$group': {'_id': {'$hour': '$bucket'}, 'hours': {'$sum': '$hours'}}}
+        ]
+
+    @staticmethod
+    def _format_peak_hours(rows):
+        hour_distribution = {row['_id']: row['hours'] for row in rows}
+        return [{'hour': h, 'hours': hour_distribution.get(h, 0)} for h in range(24)]
+
+    def _efficiency_facet(self):
+        return [
+            # All-time totals documents
+            {'$match': {'bucket': None, 'event_type': {'$in': self.CATEGORIES}}},
+            {'$project': {'_id': '$event_type', 'avg_duration': {'$divide': ['$hours', '$count']},
+                          'total_events': '$count'}}
         ]
-        
-        results = list(self.mongo.db.events.aggregate(pipeline))
-        return results
-    
+
+    def _format_efficiency(self, rows):
+        by_category = {row['_id']: row for row in rows}
+        return [{
+            'category': category,
+            'avg_duration': round(by_category[category]['avg_duration'], 2),
+            'total_events': by_category[category]['total_events']
+        } for category in self.CATEGORIES if category in by_category]
+
+    def get_dashboard(self, user_id, days=30, trend_days=7):
+        """Get distribution, trends, peak hours and category efficiency in one round trip"""
+        results = self._facets(user_id, {
+            'time_distribution': self._distribution_facet(days),
+            'productivity_trends': self._trends_facet(trend_days),
+            'peak_hours': self._peak_hours_facet(days),
+            'category_efficiency': self._efficiency_facet()
+        }, self._dashboard_since(days, trend_days))
+        return {
+            'time_distribution': results['time_distribution'],
+            'productivity_trends': self._format_trends(results['productivity_trends'], trend_days),
+            'peak_hours': self._format_peak_hours(results['peak_hours']),
+            'category_efficiency': self._format_efficiency(results['category_efficiency'])
+        }
+
+    def get_time_distribution(self, user_id, days=30):
+        """Get time distribution by event type for the specified period"""
+        return self._aggregate(user_id, self._distribution_facet(days))
+
     def get_productivity_trends(self, user_id, days=7):
         """Get daily productivity trends"""
-        trends = []
-        for i in range(days):
-            date = datetime.now() - timedelta(days=i)
-            start_of_day = datetime.combine(date, datetime.min.time())
-            end_of_day = datetime.combine(date, datetime.max.time())
-            
-            productive_events = list(self.mongo.db.events.find({
-                'user_id': user_id,
-                'start_time': {'$gte': start_of_day, '$lte': end_of_day},
-                'event_type': {'$in': ['work', 'health', 'learning']}
-            }))
-            
-            productive_hours = sum(
-                (event['end_time'] - event['start_time']).total_seconds() / 3600
-                for event in productive_events
-            )
-            
-            trends.append({
-                'date': date.strftime('%Y-%m-%d'),
-                'productive_hours': round(productive_hours, 2),
-                'day_name': date.strftime('%A')
-            })
-        
-        return list(reversed(trends))
-    
+        rows = self._aggregate(user_id, self._trends_facet(days))
+        return self._format_trends(rows, days)
+
     def get_peak_hours(self, user_id, days=30):
         """Identify peak productivity hours"""
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=days)
-        
-        events = list(self.mongo.db.events.find({
-            'user_id': user_id,
-            'start_time': {'$gte': start_date, '$lte': end_date},
-            'event_type': 'work'
-        }))
-        
-        hour_distribution = defaultdict(int)
-        for event in events:
-            hour = event['start_time'].hour
-            duration = (event['end_time'] - event['start_time']).total_seconds() / 3600
-            hour_distribution[hour] += duration
-        
-        # Convert to list and sort
-        peak_hours = [{'hour': h, 'hours': hour_distribution[h]} for h in range(24)]
-        return peak_hours
-    
+        rows = self._aggregate(user_id, self._peak_hours_facet(days))
+        return self._format_peak_hours(rows)
+
     def get_category_efficiency(self, user_id):
         """Calculate efficiency metrics by category"""
-        categories = ['work', 'personal', 'health', 'other']
-        efficiency_data = []
-        
-        for category in categories:
-            events = list(self.mongo.db.events.find({
-                'user_id': user_id,
-                'event_type': category
-            }))
-            
-            if events:
-                avg_duration = statistics.mean(
-                    (e['end_time'] - e['start_time']).total_seconds() / 3600 
-                    for e in events
-                )
-                total_events = len(events)
-                efficiency_data.append({
-                    'category': category,
-                    'avg_duration': round(avg_duration, 2),
-                    'total_events': total_events
-                })
-        
-        return efficiency_data
\ No newline at end of file
+        rows = self._aggregate(user_id, self._efficiency_facet())
+        return self._format_efficiency(rows)
+
+    def get_trend_report(self, user_id, years=1):
+        """Week x hour heatmap, rolling daily averages and duration percentiles over 1-5 years of raw events"""
+        # NumPy is only imported once a report is asked for
+        from .engine import trend_report
+        return trend_report(self.mongo.db.events, user_id, years, productive_types=self.PRODUCTIVE_TYPES)
+
+class AsyncTimeAnalytics(TimeAnalytics):
+    """TimeAnalytics over an async database (see async_data.py).
+
+    The dashboard runs its four aggregations concurrently instead of as one
+    $facet, so the server can work on them in parallel.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    async def _aggregate(self, user_id, stages, match=None):
+        cursor = await self.db.event_rollups.aggregate(self._pipeline(user_id, stages, match))
+        return await cursor.to_list()
+
+    async def get_dashboard(self, user_id, days=30, trend_days=7):
+        distribution, trends, peak_hours, efficiency = await asyncio.gather(
+            self._aggregate(user_id, self._distribution_facet(days)),
+            self._aggregate(user_id, self._trends_facet(trend_days)),
+            self._aggregate(user_id, self._peak_hours_facet(days)),
+            self._aggregate(user_id, self._efficiency_facet()))
+        return {
+            'time_distribution': distribution,
+            'productivity_trends': self._format_trends(trends, trend_days),
+            'peak_hours': self._format_peak_hours(peak_hours),
+            'category_efficiency': self._format_efficiency(efficiency)
+        }
+
+    async def get_time_distribution(self, user_id, days=30):
+        return await self._aggregate(user_id, self._distribution_facet(days))
+
+    async def get_productivity_trends(self, user_id, days=7):
+        return self._format_trends(await self._aggregate(user_id, self._trends_facet(days)), days)
+
+    async def get_peak_hours(self, user_id, days=30):
+        return self._format_peak_hours(await self._aggregate(user_id, self._peak_hours_facet(days)))
+
+    async def get_category_efficiency(self, user_id):
+        return self._format_efficiency(await self._aggregate(user_id, self._efficiency_facet()))
+
+    async def get_trend_report(self, user_id, years=1):
+        from .engine import EventColumns, build_report, report_window
+        window_start, window_end = report_window(years)
+        docs = await EventColumns.fetch_async(self.db.events, user_id, window_start, window_end)
+        # Building the report is CPU-bound, so it runs off the event loop
+        return await asyncio.to_thread(lambda: build_report(EventColumns.from_docs(docs), window_start, window_end,
+                                                            self.PRODUCTIVE_TYPES))
@@ -1,149 +1,466 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for
-from flask_mail import Mail, Message
+from flask import Flask, render_template, request, jsonify, redirect, url_for, abort, make_response, stream_with_context, g
+from flask_mail import Mail
 from datetime import datetime, timedelta
 from dateutil import rrule
-from models import Event, JSONEncoder
+from models import Event, JSONEncoder, GRID_FIELDS, DETAIL_FIELDS, naive_local, series_end
 from config import Config
+from recurrence import FREQUENCIES, RecurrenceCache, expand_events
+from calendar_grid import (DAY, MONTH, SERIES_COUNT_FIELDS, week_grid, month_grid, year_grid, load_grid, fetch_grid,
+                           build_grid, series_query, count_occurrences)
+from pagination import KEYSET_SORT, after_cursor, decode_cursor, encode_cursor, keyset_page
+from conflicts import ConflictDetector
+from view_cache import ViewCache, MemoryBackend, MongoBackend, bucket_start
+from indexes import ensure_indexes, check_query_plans, check_shard_targeting, shard_collections
+from mail_queue import MailQueue
+from notifications import EmailTemplate, DigestQueue
+from reminders import ReminderScheduler
+from ical import iter_ics, import_ics
+import instrumentation
+from instrumentation import MongoCommandListener, stage, render_metrics
+from async_data import AsyncData
+import auth
+from auth import LEGACY_USER, UserStore, current_user_id, login_user, logout_user, safe_next
+import click
 from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+import asyncio
+import io
 import json
 import os
-from analytics import TimeAnalytics, ChartGenerator
-import matplotlib
-matplotlib.use('Agg')  # Use non-interactive backend
+import secrets
+import threading
+# matplotlib/numpy are only loaded by the chart routes (see analytics/__init__.py)
+from analytics import TimeAnalytics, AsyncTimeAnalytics, ChartCache, EventRollups
 
 app = Flask(__name__)
 app.config.from_object(Config)
 app.json_encoder = JSONEncoder
+if not app.config['SECRET_KEY']:
+    # Anyone who knows the key can sign a session for any user id, so there is no default one
+    if not (app.debug or app.testing or __name__ == '__main__'):
+        raise RuntimeError("SECRET_KEY is not set; set it to a long random value (see README)")
+    app.config['SECRET_KEY'] = secrets.token_hex(32)
+    app.logger.warning("SECRET_KEY is not set: using a random key, so logins end when the server restarts")
 
 # Initialize MongoDB
 from flask_pymongo import PyMongo
-mongo = PyMongo(app)
+mongo_listener = MongoCommandListener(app.config['SLOW_QUERY_MS'])
+mongo = PyMongo(app, event_listeners=[mongo_listener])
+
+# Optional asyncio client for the calendar and analytics views (see async_data.py)
+async_data = AsyncData(app.config['MONGO_URI'], event_listeners=[mongo_listener]) if app.config['ASYNC_DATA'] else None
+
+# Per-route request, stage and Mongo timings, served at /metrics
+instrumentation.init_app(app, server_timing=app.config['SERVER_TIMING'])
+
+# Accounts; every other page needs a logged-in user, whose id scopes all of its data
+users = UserStore(mongo)
+auth.init_app(app, public_endpoints={'login', 'register', 'api_login', 'static', 'metrics'})
 
 # Initialize Flask-Mail
 mail = Mail(app)
 
+# Notifications are queued in MongoDB and sent by a background thread
+mail_queue = MailQueue(app, mail, mongo,
+                       batch_size=app.config['MAIL_QUEUE_BATCH_SIZE'],
+                       max_attempts=app.config['MAIL_QUEUE_MAX_ATTEMPTS'],
+                       base_delay=app.config['MAIL_QUEUE_RETRY_DELAY'])
+
+# Notification emails: the template is rendered once per variant, and with
+# MAIL_DIGEST_MINUTES set, event changes are sent as one digest per window
+email_template = EmailTemplate(app, 'email_template.html')
+digests = None
+if app.config['MAIL_DIGEST_MINUTES']:
+    digests = DigestQueue(app, mongo, mail_queue, app.config['MAIL_DIGEST_MINUTES'],
+                          max_changes=app.config['MAIL_DIGEST_MAX_CHANGES'])
+    mail_queue.before_batch.append(digests.flush)
+
+# Reminder emails ahead of upcoming events and occurrences
+reminder_scheduler = ReminderScheduler(app, mongo, mail_queue,
+                                       lambda event, action: build_event_notification(event, action),
+                                       lead_minutes=app.config['REMINDER_LEAD_MINUTES'])
+
+# Expanded recurring series, shared by the calendar views
+recurrence_cache = RecurrenceCache()
+
+# Overlap checks on save and free-slot search
+conflict_detector = ConflictDetector(mongo, app.config['CONFLICT_HORIZON_DAYS'], app.config['CONFLICT_CACHE_USERS'])
+
+# Rendered calendar pages, invalidated by every event write
+VIEW_CACHE_BACKENDS = {
+    'memory': lambda: MemoryBackend(app.config['VIEW_CACHE_MAX_BYTES']),
+    'mongo': lambda: MongoBackend(mongo),
+    'none': lambda: None,
+}
+view_cache_backend = VIEW_CACHE_BACKENDS[app.config['VIEW_CACHE_BACKEND']]()
+view_cache = ViewCache(view_cache_backend, app.config['VIEW_CACHE_TTL']) if view_cache_backend else None
+
+# Pre-aggregated analytics, kept in step with every event write
+rollups = EventRollups(mongo)
+
+# Rendered chart PNGs, keyed by a fingerprint of their data
+chart_cache = ChartCache(app.config['CHART_CACHE_MAX_BYTES'], app.config['CHART_CACHE_DIR'])
+
+# Data behind each chart served by analytics_chart
+CHART_DATA = {
+    'distribution': lambda analytics, user_id: analytics.get_time_distribution(user_id),
+    'trends': lambda analytics, user_id: analytics.get_productivity_trends(user_id),
+    'peak_hours': lambda analytics, user_id: analytics.get_peak_hours(user_id),
+}
+
+# Optional pool of warm chart-rendering processes, started on first use
+render_pool = None
+render_pool_lock = threading.Lock()
+
+def get_render_pool():
+    global render_pool
+    if app.config['CHART_RENDER_PROCESSES'] <= 0:
+        return None
+    with render_pool_lock:
+        if render_pool is None:
+            from analytics import ChartRenderPool
+            render_pool = ChartRenderPool(chart_cache, app.config['CHART_RENDER_PROCESSES'],
+                                          app.config['CHART_RENDER_TIMEOUT'])
+    return render_pool
+
+def chart_url(chart_type, data):
+    """Versioned URL of a chart, so browsers only refetch it when its data changes"""
+    return url_for('analytics_chart', chart_type=chart_type, v=ChartCache.fingerprint(chart_type, data))
+
+def events_page_queries(user_id, window_start, window_end, cursor=None):
+    """Filters for a page's one-off events after the cursor and the recurring series that can reach it"""
+    one_off = {'user_id': user_id, 'start_time': {'$gte': window_start, '$lt': window_end},
+               'repeat': {'$nin': list(FREQUENCIES)}}
+    if cursor is not None:
+        one_off = after_cursor(one_off, cursor)
+    return one_off, series_query(user_id, window_start, window_end)
+
+def merge_events_page(docs, series_docs, hidden, window_start, window_end, limit, cursor=None):
+    events = [Event.from_doc(doc) for doc in docs]
+    with stage('expand'):
+        events.extend(expand_events((Event.from_doc(doc) for doc in series_docs), window_start, window_end,
+                                    recurrence_cache))
+        events.sort(key=lambda event: (event.start_time, event._id))
+        return (*keyset_page(events, limit, cursor), hidden)
+
+def find_events_page(user_id, window_start, window_end, limit, max_events, cursor=None, fields=DETAIL_FIELDS):
+    """One page of the occurrences in [window_start, window_end), ordered by (start_time, _id).
+
+    Returns (events, next page cursor or None, hidden). One-off events are
+    fetched with a keyset query, so a page never loads more than limit + 1
+    of them; up to `max_events` recurring series are expanded into the
+    window and merged in, and the occurrences of any others are only
+    counted in `hidden`, as load_grid() does.
+    """
+    one_off, series = events_page_queries(user_id, window_start, window_end, cursor)
+    docs = mongo.db.events.find(one_off, fields).sort(KEYSET_SORT).limit(limit + 1)
+    series_docs = list(mongo.db.events.find(series, fields).sort(KEYSET_SORT).limit(max_events))
+    hidden = 0
+    if len(series_docs) == max_events:
+        others = mongo.db.events.find(series, SERIES_COUNT_FIELDS).sort(KEYSET_SORT).skip(max_events)
+        hidden = count_occurrences(others, window_start, window_end)
+    return merge_events_page(docs, series_docs, hidden, window_start, window_end, limit, cursor)
+
+async def fetch_events_page(db, one_off, series, window_start, window_end, limit, max_events, fields):
+    docs, series_docs = await asyncio.gather(
+        db.events.find(one_off, fields).sort(KEYSET_SORT).limit(limit + 1).to_list(),
+        db.events.find(series, fields).sort(KEYSET_SORT).limit(max_events).to_list())
+    hidden = 0
+    if len(series_docs) == max_events:
+        async for doc in db.events.find(series, SERIES_COUNT_FIELDS).sort(KEYSET_SORT).skip(max_events):
+            hidden += count_occurrences((doc,), window_start, window_end)
+    return docs, series_docs, hidden
+
+def events_page(user_id, window_start, window_end, limit, cursor=None, fields=DETAIL_FIELDS):
+    """find_events_page(), with both queries run concurrently when the async data layer is enabled"""
+    max_events = app.config['VIEW_MAX_EVENTS']
+    if async_data is None:
+        return find_events_page(user_id, window_start, window_end, limit, max_events, cursor, fields)
+    one_off, series = events_page_queries(user_id, window_start, window_end, cursor)
+    fetched = async_data.run_sync(fetch_events_page(async_data.db, one_off, series, window_start, window_end,
+                                                  limit, max_events, fields))
+    return merge_events_page(*fetched, window_start, window_end, limit, cursor)
+
+def grid_events(user_id, window_start, window_end, cell_format, cell_limit):
+    """Events of a calendar grid capped per cell, and the number hidden in each cell"""
+    if async_data is None:
+        with stage('grid'):
+            return load_grid(mongo.db.events, user_id, window_start, window_end, cell_format, cell_limit,
+                             app.config['VIEW_MAX_EVENTS'], GRID_FIELDS)
+    # Only the queries run on the shared event loop; building the grid stays in this request's thread
+    docs = async_data.run_sync(fetch_grid(async_data.db.events, user_id, window_start, window_end,
+                                          cell_format, cell_limit, app.config['VIEW_MAX_EVENTS'], GRID_FIELDS))
+    with stage('grid'):
+        return build_grid(*docs, window_start, window_end, cell_format, cell_limit)
+
+@app.cli.command('ensure-indexes')
+@click.option('--check', is_flag=True, help='Also explain() registered query shapes and fail on COLLSCAN.')
+def ensure_indexes_command(check):
+    """Create and verify MongoDB indexes"""
+    ensure_indexes(mongo.db)
+    click.echo('Indexes verified.')
+    if check:
+        check_query_plans(mongo.db)
+        check_shard_targeting()
+        click.echo('All registered query shapes use an index and target one user.')
+
+@app.cli.command('shard-collections')
+def shard_collections_command():
+    """Shard the per-user collections on a hashed user_id (connect MONGO_URI to mongos)"""
+    shard_collections(mongo.db)
+    click.echo('Sharded events, event_rollups and view_cache on user_id.')
+
+@app.cli.command('rebuild-rollups')
+@click.option('--user', 'user_id', default=None, help='Only rebuild rollups for this user.')
+def rebuild_rollups_command(user_id):
+    """Backfill or rebuild analytics rollups from raw events"""
+    written = rollups.rebuild(user_id)
+    click.echo(f'Wrote {written} rollup documents.')
+
+@app.cli.command('set-series-ends')
+def set_series_ends_command():
+    """Store series_end on recurring events saved before it existed"""
+    updates = []
+    # Only imported rules can have a COUNT or UNTIL; every other series never ends
+    for doc in mongo.db.events.find({'rrule': {'$ne': None}, 'series_end': None},
+                                    {'start_time': 1, 'repeat': 1, 'rrule': 1}):
+        end = series_end(doc['start_time'], doc.get('repeat'), doc['rrule'])
+        if end is not None:
+            updates.append(UpdateOne({'_id': doc['_id']}, {'$set': {'series_end': end}}))
+    if updates:
+        mongo.db.events.bulk_write(updates, ordered=False)
+    click.echo(f'Set series_end on {len(updates)} events.')
+
+@app.cli.command('set-next-occurrences')
+def set_next_occurrences_command():
+    """Store next_occurrence_at on events saved before it existed"""
+    # The reminder scheduler moves each one on from its start time
+    updates = [UpdateOne({'_id': doc['_id']}, {'$set': {'next_occurrence_at': doc['start_time']}})
+               for doc in mongo.db.events.find({'next_occurrence_at': {'$exists': False}}, {'start_time': 1})]
+    if updates:
+        mongo.db.events.bulk_write(updates, ordered=False)
+    click.echo(f'Set next_occurrence_at on {len(updates)} events.')
+
+def user_id_of(username):
+    user = users.find(username)
+    if user is None:
+        raise click.ClickException(f"No user named {username!r}")
+    return user['_id']
+
+@app.cli.command('create-user')
+@click.argument('username')
+@click.option('--email', default=None, help='Address for event notifications and reminders.')
+@click.password_option()
+def create_user_command(username, email, password):
+    """Create an account"""
+    try:
+        user = users.create(username, password, email)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Created user {user['username']} ({user['_id']}).")
+
+@app.cli.command('adopt-events')
+@click.argument('username')
+def adopt_events_command(username):
+    """Give the events created before accounts existed to a user"""
+    user_id = user_id_of(username)
+    # Changes the shard key of the events, so run it before sharding them
+    moved = mongo.db.events.update_many({'user_id': LEGACY_USER}, {'$set': {'user_id': user_id}}).modified_count
+    rollups.rebuild(LEGACY_USER)
+    written = rollups.rebuild(user_id)
+    if view_cache is not None:
+        view_cache.invalidate_user(user_id)  # only reaches other processes with the mongo backend
+    click.echo(f'Moved {moved} events to {username}; wrote {written} rollup documents.')
+
+@app.cli.command('import-ics')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--user', 'username', required=True, help='Username of the owner of the imported events.')
+def import_ics_command(path, username):
+    """Import the events of an iCalendar (.ics) file"""
+    user_id = user_id_of(username)
+    with open(path, encoding='utf-8', errors='replace', newline='') as f:
+        summary = import_ics(f, user_id, mongo.db.events, rollups, app.config['ICS_IMPORT_BATCH_SIZE'])
+    if summary['imported'] and view_cache is not None:
+        view_cache.invalidate_user(user_id)  # only reaches other processes with the mongo backend
+    for warning in summary['warnings']:
+        click.echo(f"Warning: event {warning['event']}: {warning['warning']}")
+    for error in summary['errors']:
+        click.echo(f"Skipped event {error['event']}: {error['error']}")
+    click.echo(f"Imported {summary['imported']} events.")
+
+@app.cli.command('send-mail')
+def send_mail_command():
+    """Deliver all queued notification emails that are due"""
+    processed = mail_queue.drain()
+    click.echo(f'Processed {processed} queued emails.')
+
+@app.cli.command('run-reminders')
+def run_reminders_command():
+    """Run the reminder scheduler and mail delivery in the foreground"""
+    mail_queue.start()
+    reminder_scheduler.start()
+    click.echo('Sending reminders, press Ctrl+C to stop.')
+    try:
+        while True:
+            threading.Event().wait(3600)
+    except KeyboardInterrupt:
+        reminder_scheduler.stop()
+        mail_queue.stop()
+
 # Make timedelta available in templates
 @app.context_processor
 def utility_processor():
     return dict(timedelta=timedelta, datetime=datetime)
 
 # Routes
+@app.route('/login', methods=['GET', 'POST'])
+def login():
+    error = None
+    if request.method == 'POST':
+        user = users.authenticate(request.form.get('username'), request.form.get('password'))
+        if user is not None:
+            login_user(user)
+            return redirect(safe_next(request.args.get('next')))
+        error = 'Invalid username or password.'
+    return render_template('login.html', error=error)
+
+@app.route('/register', methods=['GET', 'POST'])
+def register():
+    error = None
+    if request.method == 'POST':
+        try:
+            user = users.create(request.form.get('username'), request.form.get('password'),
+                                request.form.get('email'))
+        except ValueError as e:
+            error = str(e)
+        else:
+            login_user(user)
+            return redirect(url_for('index'))
+    return render_template('register.html', error=error)
+
+@app.route('/logout', methods=['POST'])
+def logout():
+    logout_user()
+    return redirect(url_for('login'))
+
 @app.route('/')
 def index():
     # Get upcoming events for the home page
     now = datetime.now()
-    future_events = list(mongo.db.events.find({
-        'start_time': {'$gte': now},
-        'user_id': 'current_user'  # In a real app, you'd use session/user auth
-    }).sort('start_time', 1).limit(5))
+    future_events = mongo.db.events.find({
+        'user_id': current_user_id(),
+        'start_time': {'$gte': now}
+    }, DETAIL_FIELDS).sort('start_time', 1).limit(5)
     
     # Convert to Event objects
-    events = [Event.from_dict(event) for event in future_events]
+    events = [Event.from_doc(event) for event in future_events]
     
     return render_template('index.html', events=events)
 
+def selected_period(view):
+    """Start of the `view` period containing ?date= (default: today)"""
+    date_str = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
+    return bucket_start(view, datetime.strptime(date_str, '%Y-%m-%d'))
+
+def cached_view(view, period_start, render):
+    """Serve a calendar page from the view cache, answering conditional GETs with 304"""
+    if view_cache is None:
+        return render()
+    
+    slot, token, entry = view_cache.lookup(current_user_id(), view, period_start)
+    if entry is not None:
+        etag, body = entry['etag'], entry['body']
+    else:
+        body = render()
+        etag = view_cache.store(slot, token, body)
+    
+    response = make_response('', 304) if request.if_none_match.contains(etag) else make_response(body)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def invalidate_views(user_id, events):
+    conflict_detector.invalidate(user_id)
+    if view_cache is not None:
+        view_cache.invalidate(user_id, events)
+
 @app.route('/daily')
 def daily_view():
-    date_str = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
-    selected_date = datetime.strptime(date_str, '%Y-%m-%d')
-    
-    start_of_day = datetime.combine(selected_date, datetime.min.time())
-    end_of_day = datetime.combine(selected_date, datetime.max.time())
-    
-    events = list(mongo.db.events.find({
-        'start_time': {'$gte': start_of_day, '$lte': end_of_day},
-        'user_id': 'current_user'
-    }).sort('start_time', 1))
-    
-    events = [Event.from_dict(event) for event in events]
-    return render_template('daily.html', events=events, selected_date=selected_date)
+    selected_date = selected_period('day')
+    cursor = None
+    if request.args.get('after'):
+        try:
+            cursor = decode_cursor(request.args['after'])
+        except ValueError:
+            abort(400)
+    
+    def render():
+        end_of_day = selected_date + timedelta(days=1)
+        events, next_cursor, hidden = events_page(current_user_id(), selected_date, end_of_day,
+                                                  app.config['DAY_PAGE_SIZE'], cursor)
+        return render_template('daily.html', events=events, selected_date=selected_date,
+                               next_cursor=next_cursor, paged=cursor is not None, hidden=hidden)
+    
+    # Only first pages are cached; later ones are reached by following a link
+    if cursor is not None:
+        return render()
+    return cached_view('day', selected_date, render)
 
 @app.route('/weekly')
 def weekly_view():
-    date_str = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
-    selected_date = datetime.strptime(date_str, '%Y-%m-%d')
-    
-    start_of_week = selected_date - timedelta(days=selected_date.weekday())
-    end_of_week = start_of_week + timedelta(days=6)
-    
-    events = list(mongo.db.events.find({
-        'start_time': {'$gte': start_of_week, '$lte': end_of_week},
-        'user_id': 'current_user'
-    }).sort('start_time', 1))
+    # Pages are cached per period, so every date of a week renders from its Monday
+    selected_date = start_of_week = selected_period('week')
     
-    events = [Event.from_dict(event) for event in events]
+    def render():
+        end_of_week = start_of_week + timedelta(days=7)
+        events, more = grid_events(current_user_id(), start_of_week, end_of_week, DAY, app.config['WEEK_CELL_LIMIT'])
+        with stage('grid'):
+            days = week_grid(start_of_week, events, more)
+        return render_template('weekly.html', days=days, selected_date=selected_date)
     
-    # Group events by day
-    days = []
-    for i in range(7):
-        day = start_of_week + timedelta(days=i)
-        day_events = [e for e in events if e.start_time.date() == day.date()]
-        days.append((day, day_events))
-    
-    return render_template('weekly.html', days=days, selected_date=selected_date)
+    return cached_view('week', start_of_week, render)
 
 @app.route('/monthly')
 def monthly_view():
-    date_str = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
-    selected_date = datetime.strptime(date_str, '%Y-%m-%d')
-    
+    selected_date = start_of_month = selected_period('month')
     year, month = selected_date.year, selected_date.month
-    start_of_month = datetime(year, month, 1)
-    
-    if month == 12:
-        end_of_month = datetime(year+1, 1, 1) - timedelta(days=1)
-    else:
-        end_of_month = datetime(year, month+1, 1) - timedelta(days=1)
-    
-    events = list(mongo.db.events.find({
-        'start_time': {'$gte': start_of_month, '$lte': end_of_month},
-        'user_id': 'current_user'
-    }).sort('start_time', 1))
-    
-    events = [Event.from_dict(event) for event in events]
     
-    # Create calendar grid
-    first_weekday = start_of_month.weekday()
-    days_in_month = (end_of_month - start_of_month).days + 1
-    
-    calendar = []
-    week = [None] * first_weekday
-    
-    for day in range(1, days_in_month + 1):
-        current_date = datetime(year, month, day)
-        day_events = [e for e in events if e.start_time.date() == current_date.date()]
-        week.append((current_date, day_events))
+    def render():
+        if month == 12:
+            end_of_month = datetime(year+1, 1, 1)
+        else:
+            end_of_month = datetime(year, month+1, 1)
         
-        if len(week) == 7:
-            calendar.append(week)
-            week = []
+        events, more = grid_events(current_user_id(), start_of_month, end_of_month, DAY, app.config['MONTH_CELL_LIMIT'])
+        with stage('grid'):
+            calendar = month_grid(year, month, events, more)
+        return render_template('monthly.html', calendar=calendar, selected_date=selected_date)
     
-    if week:
-        week.extend([None] * (7 - len(week)))
-        calendar.append(week)
-    
-    return render_template('monthly.html', calendar=calendar, selected_date=selected_date)
+    return cached_view('month', start_of_month, render)
 
 @app.route('/yearly')
 def yearly_view():
-    date_str = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
-    selected_date = datetime.strptime(date_str, '%Y-%m-%d')
+    selected_date = selected_period('year')
     year = selected_date.year
     
-    events = list(mongo.db.events.find({
-        'start_time': {'$gte': datetime(year, 1, 1), '$lte': datetime(year, 12, 31, 23, 59, 59)},
-        'user_id': 'current_user'
-    }).sort('start_time', 1))
+    def render():
+        events, more = grid_events(current_user_id(), datetime(year, 1, 1), datetime(year + 1, 1, 1),
+                                   MONTH, app.config['YEAR_CELL_LIMIT'])
+        with stage('grid'):
+            months = year_grid(year, events, more)
+        return render_template('yearly.html', months=months, year=year, selected_date=selected_date)
     
-    events = [Event.from_dict(event) for event in events]
-    
-    # Group events by month
-    months = []
-    for month in range(1, 13):
-        month_events = [e for e in events if e.start_time.month == month]
-        months.append((month, month_events))
-    
-    return render_template('yearly.html', months=months, year=year, selected_date=selected_date)
+    return cached_view('year', selected_date, render)
+
+def find_own_event(event_id):
+    """The logged-in user's event with this id, or None"""
+    try:
+        return mongo.db.events.find_one({'_id': ObjectId(event_id), 'user_id': current_user_id()})
+    except InvalidId:
+        return None
 
 @app.route('/event/new', methods=['GET', 'POST'])
 def new_event():
@@ -155,8 +472,17 @@ def new_event():
         event_type = request.form.get('event_type')
         repeat = request.form.get('repeat')
         
-        event = Event(title, description, start_time, end_time, event_type, repeat, 'current_user')
+        event = Event(title, description, start_time, end_time, event_type, repeat, current_user_id())
+        
+        # Show overlapping events first; submitting again with "save anyway" keeps them
+        if request.form.get('ignore_conflicts') != 'on':
+            conflicts = conflict_detector.conflicts(event)
+            if conflicts:
+                return render_template('event_form.html', event=event, creating=True, conflicts=conflicts)
+        
         mongo.db.events.insert_one(event.to_dict())
+        rollups.add(event)
+        invalidate_views(event.user_id, [event])
         
         # Send email notification if enabled
         if request.form.get('send_email') == 'on':
@@ -168,21 +494,32 @@ def new_event():
 
 @app.route('/event/<event_id>/edit', methods=['GET', 'POST'])
 def edit_event(event_id):
-    event_data = mongo.db.events.find_one({'_id': ObjectId(event_id)})
+    event_data = find_own_event(event_id)
     if not event_data:
         return "Event not found", 404
     
     event = Event.from_dict(event_data)
     
     if request.method == 'POST':
+        previous = Event.from_dict(event_data)
         event.title = request.form.get('title')
         event.description = request.form.get('description')
         event.start_time = datetime.fromisoformat(request.form.get('start_time'))
         event.end_time = datetime.fromisoformat(request.form.get('end_time'))
         event.event_type = request.form.get('event_type')
         event.repeat = request.form.get('repeat')
+        if event.repeat != previous.repeat:
+            event.rrule = None  # an imported rule no longer matches the chosen repeat
         
-        mongo.db.events.update_one({'_id': ObjectId(event_id)}, {'$set': event.to_dict()})
+        if request.form.get('ignore_conflicts') != 'on':
+            conflicts = conflict_detector.conflicts(event)
+            if conflicts:
+                return render_template('event_form.html', event=event, conflicts=conflicts)
+        
+        mongo.db.events.update_one({'_id': event._id, 'user_id': event.user_id}, {'$set': event.to_dict()})
+        recurrence_cache.invalidate(event._id)
+        rollups.replace(previous, event)
+        invalidate_views(event.user_id, [previous, event])
         
         # Send email notification if enabled
         if request.form.get('send_email') == 'on':
@@ -194,10 +531,13 @@ def edit_event(event_id):
 
 @app.route('/event/<event_id>/delete', methods=['POST'])
 def delete_event(event_id):
-    event_data = mongo.db.events.find_one({'_id': ObjectId(event_id)})
+    event_data = find_own_event(event_id)
     if event_data:
         event = Event.from_dict(event_data)
-        mongo.db.events.delete_one({'_id': ObjectId(event_id)})
+        mongo.db.events.delete_one({'_id': event._id, 'user_id': event.user_id})
+        recurrence_cache.invalidate(event._id)
+        rollups.remove(event)
+        invalidate_views(event.user_id, [event])
         
         # Send email notification if enabled
         if request.form.get('send_email') == 'on':
@@ -207,6 +547,9 @@ def delete_event(event_id):
 
 @app.route('/email-settings', methods=['GET', 'POST'])
 def email_settings():
+    # SMTP settings are shared by every account
+    if g.username not in app.config['ADMIN_USERNAMES']:
+        abort(403)
     if request.method == 'POST':
         # Save email settings (in a real app, you'd store these in database)
         app.config['MAIL_SERVER'] = request.form.get('mail_server')
@@ -230,86 +573,357 @@ def email_settings():
     
     return render_template('email_settings.html', email_config=email_config)
 
+def run_analytics(method, *args):
+    """Call a TimeAnalytics method, through AsyncTimeAnalytics when the async data layer is enabled"""
+    if async_data is None:
+        return getattr(TimeAnalytics(mongo), method)(*args)
+    return async_data.run_sync(getattr(AsyncTimeAnalytics(async_data.db), method)(*args))
+
 @app.route('/analytics/dashboard')
 def analytics_dashboard():
-    time_analytics = TimeAnalytics(mongo)
-    chart_gen = ChartGenerator()
-    
-    user_id = 'current_user'  # In real app, use session/user auth
-    
-    # Get analytics data
-    time_distribution = time_analytics.get_time_distribution(user_id)
-    productivity_trends = time_analytics.get_productivity_trends(user_id)
-    peak_hours = time_analytics.get_peak_hours(user_id)
-    category_efficiency = time_analytics.get_category_efficiency(user_id)
-    
-    # Generate charts
-    distribution_chart = chart_gen.create_time_distribution_chart(time_distribution)
-    trends_chart = chart_gen.create_productivity_trend_chart(productivity_trends)
-    peak_hours_chart = chart_gen.create_peak_hours_chart(peak_hours)
-    
+    user_id = current_user_id()
+    
+    # One $facet aggregation, or four concurrent ones on the async data layer
+    dashboard = run_analytics('get_dashboard', user_id)
+    time_distribution = dashboard['time_distribution']
+    productivity_trends = dashboard['productivity_trends']
+    peak_hours = dashboard['peak_hours']
+    category_efficiency = dashboard['category_efficiency']
+    
+    # Start rendering all charts in parallel so they are cached by the time the browser asks
+    pool = get_render_pool()
+    if pool:
+        pool.submit('distribution', time_distribution)
+        pool.submit('trends', productivity_trends)
+        pool.submit('peak_hours', peak_hours)
+    
+    # Charts are served separately by analytics_chart and cached by the browser
     return render_template('analytics/dashboard.html',
                          time_distribution=time_distribution,
                          productivity_trends=productivity_trends,
                          peak_hours=peak_hours,
                          category_efficiency=category_efficiency,
-                         distribution_chart=distribution_chart,
-                         trends_chart=trends_chart,
-                         peak_hours_chart=peak_hours_chart)
+                         distribution_chart_url=chart_url('distribution', time_distribution),
+                         trends_chart_url=chart_url('trends', productivity_trends),
+                         peak_hours_chart_url=chart_url('peak_hours', peak_hours))
+
+@app.route('/analytics/chart/<chart_type>.png')
+def analytics_chart(chart_type):
+    if chart_type not in CHART_DATA:
+        abort(404)
+    
+    data = CHART_DATA[chart_type](TimeAnalytics(mongo), current_user_id())
+    key = ChartCache.fingerprint(chart_type, data)
+    
+    # Unchanged data: the browser's copy is still valid, skip rendering entirely
+    if request.if_none_match.contains(key):
+        response = make_response('', 304)
+    else:
+        from analytics import ChartGenerator
+        pool = get_render_pool()
+        renderer = pool.render if pool else ChartGenerator.render
+        with stage('chart'):
+            _, png = chart_cache.get_or_render(chart_type, data, renderer)
+        response = make_response(png)
+        response.mimetype = 'image/png'
+    
+    response.set_etag(key)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    if request.args.get('v') == key:
+        # Versioned URLs never change content
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = 31536000
+    return response
 
 @app.route('/analytics/time-distribution')
 def time_distribution():
     time_analytics = TimeAnalytics(mongo)
-    user_id = 'current_user'
+    user_id = current_user_id()
     
     time_distribution = time_analytics.get_time_distribution(user_id)
-    chart_data = ChartGenerator.create_time_distribution_chart(time_distribution)
     
     return render_template('analytics/time_distribution.html',
                          time_distribution=time_distribution,
-                         chart_data=chart_data)
+                         chart_url=chart_url('distribution', time_distribution))
 
 @app.route('/analytics/productivity-trends')
 def productivity_trends():
     time_analytics = TimeAnalytics(mongo)
-    user_id = 'current_user'
+    user_id = current_user_id()
     
     trends = time_analytics.get_productivity_trends(user_id)
-    chart_data = ChartGenerator.create_productivity_trend_chart(trends)
     
     return render_template('analytics/productivity_trends.html',
                          trends=trends,
-                         chart_data=chart_data)
+                         chart_url=chart_url('trends', trends))
+
+def report_years():
+    years = request.args.get('years', 1, type=int)
+    return max(1, min(years, app.config['REPORT_MAX_YEARS']))
+
+@app.route('/analytics/report')
+def analytics_report():
+    years = report_years()
+    with stage('report'):
+        report = run_analytics('get_trend_report', current_user_id(), years)
+    max_heat = max(max(row) for row in report['heatmap']) or 1
+    return render_template('analytics/report.html', report=report, years=years,
+                           max_years=app.config['REPORT_MAX_YEARS'], max_heat=max_heat,
+                           weekdays=['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'])
+
+# JSON API
+
+def json_response(data, status=200):
+    return app.response_class(json.dumps(data, cls=JSONEncoder), status=status, mimetype='application/json')
+
+def api_error(message, status=400):
+    return json_response({'error': message}, status)
+
+def api_window_filter(user_id):
+    """Filter on user_id and the optional ISO 8601 ?start=/&end= bounds of start_time"""
+    query = {'user_id': user_id}
+    bounds = {}
+    for arg, op in (('start', '$gte'), ('end', '$lt')):
+        if request.args.get(arg):
+            bounds[op] = naive_local(datetime.fromisoformat(request.args[arg]))
+    if bounds:
+        query['start_time'] = bounds
+    return query
+
+def api_event_or_404(event_id, user_id):
+    try:
+        event_data = mongo.db.events.find_one({'_id': ObjectId(event_id), 'user_id': user_id})
+    except InvalidId:
+        event_data = None
+    if not event_data:
+        abort(api_error('event not found', 404))
+    return Event.from_dict(event_data)
+
+def conflicts_json(conflicts):
+    return [{'_id': other._id, 'title': other.title, 'start_time': other.start_time,
+             'end_time': other.end_time} for other in conflicts]
+
+@app.route('/api/login', methods=['POST'])
+def api_login():
+    """Log in with {"username", "password"}; the session cookie then authenticates the API"""
+    payload = request.get_json(silent=True) or {}
+    user = users.authenticate(payload.get('username'), payload.get('password'))
+    if user is None:
+        return api_error('invalid username or password', 401)
+    login_user(user)
+    return json_response({'user_id': user['_id'], 'username': user['username']})
+
+@app.route('/api/events', methods=['GET'])
+def api_list_events():
+    try:
+        query = api_window_filter(current_user_id())
+    except ValueError as e:
+        return api_error(str(e))
+    
+    if request.args.get('after'):
+        try:
+            query = after_cursor(query, decode_cursor(request.args['after']))
+        except ValueError as e:
+            return api_error(str(e))
+    
+    limit = request.args.get('limit', app.config['API_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config['API_PAGE_SIZE']))
+    # One extra document tells whether there is a next page
+    events = list(mongo.db.events.find(query).sort(KEYSET_SORT).limit(limit + 1))
+    next_cursor = None
+    if len(events) > limit:
+        events = events[:limit]
+        next_cursor = encode_cursor(events[-1]['start_time'], events[-1]['_id'])
+    return json_response({'events': events, 'next': next_cursor})
+
+@app.route('/api/events', methods=['POST'])
+def api_create_event():
+    try:
+        event = Event.from_json(request.get_json(silent=True), current_user_id())
+    except ValueError as e:
+        return api_error(str(e))
+    
+    mongo.db.events.insert_one(event.to_dict())
+    rollups.add(event)
+    invalidate_views(event.user_id, [event])
+    return json_response({**event.to_dict(), 'conflicts': conflicts_json(conflict_detector.conflicts(event))}, 201)
+
+@app.route('/api/events/<event_id>', methods=['GET'])
+def api_get_event(event_id):
+    return json_response(api_event_or_404(event_id, current_user_id()).to_dict())
+
+@app.route('/api/events/<event_id>', methods=['PUT', 'PATCH'])
+def api_update_event(event_id):
+    previous = api_event_or_404(event_id, current_user_id())
+    payload = request.get_json(silent=True)
+    if request.method == 'PATCH' and isinstance(payload, dict):
+        merged = {**previous.to_dict(), **payload}
+        if 'repeat' in payload and 'rrule' not in payload:
+            merged['rrule'] = None
+        payload = merged
+    
+    try:
+        event = Event.from_json(payload, previous.user_id, _id=previous._id)
+    except ValueError as e:
+        return api_error(str(e))
+    
+    mongo.db.events.update_one({'_id': event._id, 'user_id': event.user_id}, {'$set': event.to_dict()})
+    recurrence_cache.invalidate(event._id)
+    rollups.replace(previous, event)
+    invalidate_views(event.user_id, [previous, event])
+    return json_response({**event.to_dict(), 'conflicts': conflicts_json(conflict_detector.conflicts(event))})
+
+@app.route('/api/events/<event_id>', methods=['DELETE'])
+def api_delete_event(event_id):
+    event = api_event_or_404(event_id, current_user_id())
+    mongo.db.events.delete_one({'_id': event._id, 'user_id': event.user_id})
+    recurrence_cache.invalidate(event._id)
+    rollups.remove(event)
+    invalidate_views(event.user_id, [event])
+    return '', 204
+
+@app.route('/api/events/bulk', methods=['POST'])
+def api_bulk_create_events():
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict):
+        payload = payload.get('events')
+    if not isinstance(payload, list):
+        return api_error("expected a JSON array of events or {\"events\": [...]}")
+    if len(payload) > app.config['API_BULK_MAX_EVENTS']:
+        return api_error(f"at most {app.config['API_BULK_MAX_EVENTS']} events per request", 413)
+    
+    user_id = current_user_id()
+    events, indexes, errors = [], [], []
+    for i, item in enumerate(payload):
+        try:
+            events.append(Event.from_json(item, user_id))
+            indexes.append(i)
+        except ValueError as e:
+            errors.append({'index': i, 'error': str(e)})
+    
+    failed = set()
+    if events:
+        try:
+            # Unordered: one bad document does not stop the rest of the batch
+            mongo.db.events.insert_many([event.to_dict() for event in events], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details['writeErrors']:
+                failed.add(error['index'])
+                errors.append({'index': indexes[error['index']], 'error': error['errmsg']})
+    
+    inserted = [event for i, event in enumerate(events) if i not in failed]
+    rollups.add_many(inserted)
+    invalidate_views(user_id, inserted)
+    errors.sort(key=lambda error: error['index'])
+    return json_response({'inserted': len(inserted), 'errors': errors}, 201 if inserted else 400)
+
+@app.route('/api/free-slot')
+def api_free_slot():
+    duration = request.args.get('duration', type=int)
+    if not duration or duration <= 0:
+        return api_error("duration must be a positive number of minutes")
+    try:
+        after = naive_local(datetime.fromisoformat(request.args['after'])) if 'after' in request.args else datetime.now()
+    except ValueError:
+        return api_error("after must be an ISO 8601 datetime")
+    within_days = request.args.get('within_days', app.config['CONFLICT_HORIZON_DAYS'], type=int)
+    within_days = max(1, min(within_days, app.config['CONFLICT_HORIZON_DAYS']))
+    
+    start = conflict_detector.next_free_slot(current_user_id(), timedelta(minutes=duration), after,
+                                             timedelta(days=within_days))
+    if start is None:
+        return api_error(f"no free slot of {duration} minutes in the next {within_days} days", 404)
+    return json_response({'start_time': start, 'end_time': start + timedelta(minutes=duration)})
+
+@app.route('/api/events/import', methods=['POST'])
+def api_import_events():
+    # Either a multipart upload named "file" or a raw text/calendar body
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+    lines = io.TextIOWrapper(stream, encoding='utf-8', errors='replace', newline='')
+    user_id = current_user_id()
+    summary = import_ics(lines, user_id, mongo.db.events, rollups, app.config['ICS_IMPORT_BATCH_SIZE'])
+    if summary['imported']:
+        conflict_detector.invalidate(user_id)
+        if view_cache is not None:
+            view_cache.invalidate_user(user_id)
+    return json_response(summary, 201 if summary['imported'] else 400)
+
+@app.route('/api/analytics/report')
+def api_analytics_report():
+    with stage('report'):
+        report = run_analytics('get_trend_report', current_user_id(), report_years())
+    return json_response(report)
+
+@app.route('/api/events/export')
+def api_export_events():
+    try:
+        query = api_window_filter(current_user_id())
+    except ValueError as e:
+        return api_error(str(e))
+    
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'ics'):
+        return api_error("format must be 'ndjson' or 'ics'")
+    
+    # Documents are streamed straight from the cursor, never collected into a list
+    cursor = mongo.db.events.find(query).sort('start_time', 1).batch_size(1000)
+    if export_format == 'ics':
+        body = iter_ics(cursor)
+        mimetype, filename = 'text/calendar', 'events.ics'
+    else:
+        body = (json.dumps(doc, cls=JSONEncoder) + '\n' for doc in cursor)
+        mimetype, filename = 'application/x-ndjson', 'events.ndjson'
+    
+    response = app.response_class(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+@app.route('/metrics')
+def metrics():
+    response = make_response(render_metrics())
+    response.mimetype = 'text/plain'
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
+def notification_recipients(user_id):
+    """Addresses that get the emails about a user's events: the account's email, if it has one"""
+    if user_id == LEGACY_USER:
+        return [app.config['MAIL_DEFAULT_SENDER']]
+    email = users.email_of(user_id)
+    return [email] if email else []
+
+def build_event_notification(event, action):
+    """Return (subject, recipients, html) of the email for an event action, or None if nobody gets it"""
+    recipients = notification_recipients(event.user_id)
+    if not recipients:
+        return None
+    subject = f"Event {action.capitalize()}: {event.title}"
+    return subject, recipients, email_template.render(event, action)
 
 def send_event_notification(event, action):
     try:
-        subject = f"Event {action.capitalize()}: {event.title}"
-        
-        # Generate a calendar image URL based on the event date
-        event_month = event.start_time.strftime('%B')
-        event_day = event.start_time.strftime('%d')
-        calendar_image_url = f"https://via.placeholder.com/600x200/f3f4f6/6366f1?text={event_month}+{event_day}+Calendar"
-        
-        # Create HTML email content
-        html_body = render_template(
-            'email_template.html', 
-            event=event, 
-            action=action,
-            app_name="TimeFlow Scheduler",
-            timetable_image=calendar_image_url
-        )
-        
-        msg = Message(
-            subject=subject,
-            recipients=[app.config['MAIL_DEFAULT_SENDER']],
-            html=html_body
-        )
-        
-        mail.send(msg)
+        if digests is not None:
+            recipients = notification_recipients(event.user_id)
+            if not recipients:
+                return False
+            digests.add(recipients, event, action)
+        else:
+            message = build_event_notification(event, action)
+            if message is None:
+                return False
+            mail_queue.enqueue(*message)
         return True
     except Exception as e:
-        print(f"Failed to send email: {e}")
+        print(f"Failed to queue email: {e}")
         return False
 
 if __name__ == '__main__':
+    if app.config['MONGO_ENSURE_INDEXES']:
+        ensure_indexes(mongo.db)
+    # Resume deliveries left over from a previous run
+    mail_queue.start()
+    if app.config['REMINDERS_ENABLED']:
+        reminder_scheduler.start()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,51 @@
+import asyncio
+import threading
+from pymongo import AsyncMongoClient
+
+class AsyncData:
+    """An AsyncMongoClient on its own event loop thread, shared by every request.
+
+    An async client belongs to the loop it first runs on, so it lives on one
+    long-running loop, and the views stay synchronous and block on
+    coroutines submitted to it with run_sync(). Sync views skip the
+    event-loop-per-request bridge Flask puts around async ones, while the
+    process keeps a single connection pool and a request can still run its
+    independent queries concurrently. Coroutines run in a copy of the
+    caller's context, so request metrics still see the request.
+    """
+
+    def __init__(self, uri, **client_kwargs):
+        self.uri = uri
+        self.client_kwargs = client_kwargs
+        self.client = None
+        self._loop = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='async-data', daemon=True).start()
+                self.client = asyncio.run_coroutine_threadsafe(self._connect(), loop).result()
+                self._loop = loop
+        return self._loop
+
+    async def _connect(self):
+        return AsyncMongoClient(self.uri, **self.client_kwargs)
+
+    @property
+    def db(self):
+        if self._loop is None:
+            self._start()
+        return self.client.get_default_database()
+
+    def run_sync(self, coro):
+        """Run a coroutine on the client's loop and block until it is done"""
+        loop = self._loop or self._start()
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    def close(self):
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self.client.close(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = self.client = None
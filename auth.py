@@ -0,0 +1,110 @@
+import re
+import uuid
+from datetime import datetime
+from urllib.parse import urlsplit
+from flask import g, jsonify, redirect, request, session, url_for
+from pymongo.errors import DuplicateKeyError
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Owner of every event created before accounts existed; `flask adopt-events` hands them to a real user
+LEGACY_USER = 'current_user'
+
+USERNAME = re.compile(r'^[a-z0-9_.-]{3,64}$')
+# ASCII control characters and spaces; browsers drop them from a URL, so '/\t/host' means '//host'
+URL_IGNORED = re.compile(r'[\x00-\x20\x7f]')
+MIN_PASSWORD_LENGTH = 8
+
+class UserStore:
+    """Accounts in the `users` collection.
+
+    A user's id is a random string picked at sign-up. It is the user_id of
+    every event, rollup and cache entry the user owns, so it never changes;
+    the username is only used to log in.
+    """
+
+    def __init__(self, mongo):
+        self.mongo = mongo
+
+    @property
+    def collection(self):
+        return self.mongo.db.users
+
+    @staticmethod
+    def normalize(username):
+        return (username or '').strip().lower()
+
+    def create(self, username, password, email=None):
+        """Insert a new account and return its document; raises ValueError if the input is not acceptable"""
+        username = self.normalize(username)
+        if not USERNAME.match(username):
+            raise ValueError("username must be 3-64 letters, digits, '.', '_' or '-'")
+        if len(password or '') < MIN_PASSWORD_LENGTH:
+            raise ValueError(f"password must be at least {MIN_PASSWORD_LENGTH} characters")
+        user = {
+            '_id': uuid.uuid4().hex,
+            'username': username,
+            'password_hash': generate_password_hash(password),
+            'email': (email or '').strip() or None,
+            'created_at': datetime.now()
+        }
+        try:
+            self.collection.insert_one(user)
+        except DuplicateKeyError:
+            raise ValueError("that username is taken")
+        return user
+
+    def find(self, username):
+        return self.collection.find_one({'username': self.normalize(username)})
+
+    def authenticate(self, username, password):
+        """The account matching the credentials, or None"""
+        user = self.find(username)
+        if user is None or not check_password_hash(user['password_hash'], password or ''):
+            return None
+        return user
+
+    def email_of(self, user_id):
+        user = self.collection.find_one({'_id': user_id}, {'email': 1})
+        return user.get('email') if user else None
+
+def login_user(user):
+    # A fresh session on login, so an id planted before it is never reused
+    session.clear()
+    session.permanent = True
+    session['user_id'] = user['_id']
+    session['username'] = user['username']
+
+def logout_user():
+    session.clear()
+
+def current_user_id():
+    """Id of the user logged in for this request"""
+    return g.user_id
+
+def safe_next(target):
+    """`target` if it is a path on this site, else the home page"""
+    target = URL_IGNORED.sub('', target or '')
+    # Browsers read a backslash as a slash, so '/\host' is another site like '//host'
+    parts = urlsplit(target.replace('\\', '/'))
+    if not parts.scheme and not parts.netloc and parts.path.startswith('/') and not parts.path.startswith('//'):
+        return target
+    return url_for('index')
+
+def init_app(app, public_endpoints=()):
+    """Require a logged-in user for every endpoint of `app` except `public_endpoints`.
+
+    The signed session cookie carries the user id, so no database lookup is
+    needed per request. Pages redirect to the login form; the JSON API
+    answers 401.
+    """
+
+    def load_user():
+        g.user_id = session.get('user_id')
+        g.username = session.get('username')
+        if g.user_id is None and request.endpoint not in public_endpoints:
+            if request.path.startswith('/api/'):
+                return jsonify({'error': 'login required'}), 401
+            return redirect(url_for('login', next=request.full_path.rstrip('?')))
+
+    app.before_request(load_user)
+    app.context_processor(lambda: {'current_username': g.get('username')})
@@ -0,0 +1,79 @@
+"""Benchmark the NumPy trend report engine against plain Python loops.
+
+Generates --events events spread over --years years, loads them into
+EventColumns from plain dicts (as a projected cursor would return them) and
+times the week x hour heatmap, rolling averages and per-category
+percentiles. The same heatmap is also built with a Python loop that splits
+every event hour by hour, and both are checked to agree.
+
+Usage: python benchmarks/bench_analytics_engine.py [--events 200000] [--years 5]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from analytics.engine import (EventColumns, hourly_seconds, week_hour_heatmap, daily_hours, rolling_mean,
+                              duration_percentiles)
+
+TYPES = ['work', 'personal', 'health', 'other']
+
+def generate_docs(count, window_start, days):
+    rng = random.Random(42)
+    docs = []
+    for _ in range(count):
+        start = window_start + timedelta(minutes=rng.randrange(0, days * 24 * 60, 15))
+        docs.append({'start_time': start, 'end_time': start + timedelta(minutes=rng.choice([15, 30, 60, 90, 240])),
+                     'event_type': rng.choice(TYPES)})
+    return docs
+
+def python_heatmap(docs, window_start, window_end):
+    totals = [[0.0] * 24 for _ in range(7)]
+    for doc in docs:
+        start, end = max(doc['start_time'], window_start), min(doc['end_time'], window_end)
+        while start < end:
+            next_hour = start.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+            totals[start.weekday()][start.hour] += (min(end, next_hour) - start).total_seconds()
+            start = next_hour
+    days = (window_end - window_start).days
+    counts = [sum(1 for i in range(days) if (window_start + timedelta(days=i)).weekday() == w) for w in range(7)]
+    return [[seconds / counts[w] / 3600 for seconds in row] for w, row in enumerate(totals)]
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return (time.perf_counter() - start) * 1000, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=200000)
+    parser.add_argument('--years', type=int, default=5)
+    args = parser.parse_args()
+
+    window_end = datetime(2026, 1, 1)
+    days = 365 * args.years
+    window_start = window_end - timedelta(days=days)
+    docs = generate_docs(args.events, window_start, days)
+
+    ms, columns = timed(lambda: EventColumns.from_docs(docs))
+    print(f'load columns   {len(columns):>8} events  {ms:8.1f} ms')
+    ms, hourly = timed(lambda: hourly_seconds(columns, window_start, window_end))
+    print(f'hourly split   {len(hourly):>8} hours   {ms:8.1f} ms')
+    ms, heatmap = timed(lambda: week_hour_heatmap(hourly, window_start))
+    print(f'week x hour heatmap              {ms:8.1f} ms')
+    ms, _ = timed(lambda: [rolling_mean(daily_hours(hourly), window) for window in (7, 30)])
+    print(f'daily + rolling averages         {ms:8.1f} ms')
+    ms, _ = timed(lambda: duration_percentiles(columns))
+    print(f'category p50/p90                 {ms:8.1f} ms')
+
+    ms, expected = timed(lambda: python_heatmap(docs, window_start, window_end))
+    print(f'python loop heatmap              {ms:8.1f} ms')
+    assert np.allclose(heatmap, expected)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+"""Load-test the calendar and analytics views with and without the async data layer.
+
+Seeds --events events, checks that every route renders the same page
+through both paths, then has --users concurrent users request the calendar
+and dashboard routes for --seconds seconds, first through the blocking
+PyMongo path and then with ASYNC_DATA's shared async client. Reports
+requests per second and latency percentiles for each. The view cache is
+disabled so every request reaches the database.
+
+With --mongo-uri it runs against that database (a scratch database, dropped
+afterwards) with a real AsyncMongoClient. Without it, both paths share one
+in-memory mongomock database (pip install mongomock); the async path then
+goes through MockAsyncClient, which runs each mongomock call in a worker
+thread the way the async driver waits on the network. Those numbers are
+only comparable with other mongomock runs.
+
+Usage: python benchmarks/bench_async.py [--mongo-uri URI] [--events 20000] [--users 1 8 32] [--seconds 10]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_data import AsyncData
+
+ROUTES = ['/daily?date={day}', '/weekly?date={day}', '/monthly?date={day}', '/yearly?date={day}',
+          '/analytics/dashboard']
+TYPES = ['work', 'personal', 'health', 'other']
+USER = 'bench-user'
+
+class MockAsyncCursor:
+    """The AsyncCursor methods the app uses, over a mongomock cursor"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def sort(self, *args, **kwargs):
+        self._cursor = self._cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, count):
+        self._cursor = self._cursor.limit(count)
+        return self
+
+    def skip(self, count):
+        self._cursor = self._cursor.skip(count)
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    async def to_list(self, length=None):
+        return await asyncio.to_thread(list, self._cursor)
+
+    async def __aiter__(self):
+        for doc in await self.to_list():
+            yield doc
+
+class MockAsyncCollection:
+    def __init__(self, collection):
+        self._collection = collection
+
+    def find(self, *args, **kwargs):
+        return MockAsyncCursor(self._collection.find(*args, **kwargs))
+
+    async def aggregate(self, pipeline, **kwargs):
+        docs = await asyncio.to_thread(lambda: list(self._collection.aggregate(pipeline, **kwargs)))
+        return MockAsyncCursor(docs)
+
+class MockAsyncDatabase:
+    def __init__(self, db):
+        self._db = db
+
+    def __getattr__(self, name):
+        return MockAsyncCollection(self._db[name])
+
+    __getitem__ = __getattr__
+
+class MockAsyncClient:
+    """Stands in for AsyncMongoClient over a mongomock database"""
+
+    def __init__(self, db):
+        self._db = db
+
+    def get_default_database(self):
+        return MockAsyncDatabase(self._db)
+
+    async def close(self):
+        pass
+
+class MockAsyncData(AsyncData):
+    """AsyncData, with its own loop thread, whose client is a MockAsyncClient"""
+
+    def __init__(self, db):
+        super().__init__(None)
+        self._db = db
+
+    async def _connect(self):
+        return MockAsyncClient(self._db)
+
+def use_mongomock(appmod):
+    """Point the app at an in-memory mongomock database; returns it"""
+    import mongomock
+    from bench_routes import use_mongomock as use_monitored_mongomock
+
+    # mongomock adds _id to the projection it is given, which races when threads share one (e.g. GRID_FIELDS)
+    find = mongomock.Collection.find
+    def find_with_own_projection(self, filter=None, projection=None, *args, **kwargs):
+        return find(self, filter, dict(projection) if projection else projection, *args, **kwargs)
+    mongomock.Collection.find = find_with_own_projection
+
+    db = use_monitored_mongomock(appmod)
+    # Command monitoring would only slow down the sync path
+    appmod.mongo.db = db
+    return db
+
+def seed(db, count):
+    rng = random.Random(42)
+    first = datetime.now() - timedelta(days=365)
+    docs = []
+    for i in range(count):
+        start = first + timedelta(minutes=rng.randrange(0, 365 * 24 * 60, 15))
+        docs.append({'title': f'Event {i}', 'description': '', 'start_time': start,
+                     'end_time': start + timedelta(minutes=rng.choice([30, 60, 90])),
+                     'event_type': rng.choice(TYPES), 'repeat': rng.choice([''] * 49 + ['weekly']),
+                     'user_id': USER})
+    db.events.insert_many(docs)
+
+def load(app, users, seconds):
+    """Run `users` concurrent clients for `seconds`; returns the sorted request latencies in ms"""
+    deadline = time.perf_counter() + seconds
+    latencies = []
+    errors = []
+
+    def user(seed):
+        rng = random.Random(seed)
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = USER
+        while time.perf_counter() < deadline:
+            day = (datetime.now() - timedelta(days=rng.randrange(365))).strftime('%Y-%m-%d')
+            start = time.perf_counter()
+            response = client.get(rng.choice(ROUTES).format(day=day))
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                errors.append(response.status_code)
+
+    threads = [threading.Thread(target=user, args=(i,)) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise SystemExit(f'{len(errors)} failed requests, e.g. HTTP {errors[0]}')
+    return sorted(latencies)
+
+def check_parity(appmod, async_data):
+    """Names of the routes whose page differs between the sync and async paths"""
+    day = datetime.now().strftime('%Y-%m-%d')
+    client = appmod.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = USER
+    differ = []
+    for route in ROUTES:
+        pages = []
+        for data in (None, async_data):
+            appmod.async_data = data
+            response = client.get(route.format(day=day))
+            pages.append((response.status_code, response.data))
+        if pages[0] != pages[1] or pages[0][0] != 200:
+            differ.append(route.split('?')[0])
+    return differ
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mongo-uri', help='scratch database on a running mongod (default: mongomock)')
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--users', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    # Config is read when app is imported
+    os.environ['MONGO_URI'] = args.mongo_uri or 'mongodb://localhost:27017/timetable_bench'
+    os.environ.setdefault('SECRET_KEY', 'benchmark')  # only signs the benchmark's own test client sessions
+    os.environ['MONGO_ENSURE_INDEXES'] = 'false'
+    os.environ['VIEW_CACHE_BACKEND'] = 'none'
+    import app as appmod
+    from indexes import ensure_indexes
+
+    if args.mongo_uri:
+        db = appmod.mongo.db
+        db.client.drop_database(db.name)
+        ensure_indexes(db)
+        async_data = AsyncData(args.mongo_uri)
+    else:
+        db = use_mongomock(appmod)
+        async_data = MockAsyncData(db)
+    try:
+        seed(db, args.events)
+        appmod.rollups.rebuild()
+
+        differ = check_parity(appmod, async_data)
+        print('sync and async pages match' if not differ else f'pages differ: {", ".join(differ)}')
+        print(f'{"mode":<6} {"users":>5} {"requests":>9} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+        for users in args.users:
+            for mode, data in (('sync', None), ('async', async_data)):
+                appmod.async_data = data
+                latencies = load(appmod.app, users, args.seconds)
+                print(f'{mode:<6} {users:>5} {len(latencies):>9} {len(latencies) / args.seconds:>8.1f} '
+                      f'{percentile(latencies, 50):>8.1f} {percentile(latencies, 95):>8.1f} '
+                      f'{percentile(latencies, 99):>8.1f}')
+        async_data.close()
+        if differ:
+            raise SystemExit(1)
+    finally:
+        if args.mongo_uri:
+            db.client.drop_database(db.name)
+
+if __name__ == '__main__':
+    main()
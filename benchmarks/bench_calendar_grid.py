@@ -0,0 +1,98 @@
+"""Benchmark calendar grid building: per-day rescans vs single-pass bucketing.
+
+Events are spread over one year; the weekly/monthly grids receive only the
+events inside their window, as the views do.
+
+Usage: python benchmarks/bench_calendar_grid.py [--sizes 10000 100000 1000000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Event
+from calendar_grid import week_grid, month_grid, year_grid
+
+YEAR = 2024
+
+def legacy_week_grid(start_of_week, events):
+    days = []
+    for i in range(7):
+        day = start_of_week + timedelta(days=i)
+        day_events = [e for e in events if e.start_time.date() == day.date()]
+        days.append((day, day_events))
+    return days
+
+def legacy_month_grid(year, month, events):
+    start_of_month = datetime(year, month, 1)
+    end_of_month = (datetime(year + month // 12, month % 12 + 1, 1) - timedelta(days=1))
+    first_weekday = start_of_month.weekday()
+    days_in_month = (end_of_month - start_of_month).days + 1
+
+    grid = []
+    week = [None] * first_weekday
+    for day in range(1, days_in_month + 1):
+        current_date = datetime(year, month, day)
+        day_events = [e for e in events if e.start_time.date() == current_date.date()]
+        week.append((current_date, day_events))
+        if len(week) == 7:
+            grid.append(week)
+            week = []
+    if week:
+        week.extend([None] * (7 - len(week)))
+        grid.append(week)
+    return grid
+
+def legacy_year_grid(events):
+    return [(month, [e for e in events if e.start_time.month == month]) for month in range(1, 13)]
+
+def build_events(count):
+    rng = random.Random(count)
+    start = datetime(YEAR, 1, 1)
+    minutes_in_year = 366 * 24 * 60
+    events = []
+    for _ in range(count):
+        begin = start + timedelta(minutes=rng.randrange(minutes_in_year))
+        events.append(Event('Event', '', begin, begin + timedelta(minutes=45), 'work', None, 'bench'))
+    events.sort(key=lambda e: e.start_time)
+    return events
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    args = parser.parse_args()
+
+    week_start = datetime(YEAR, 6, 3)
+    month_start, month_end = datetime(YEAR, 6, 1), datetime(YEAR, 7, 1)
+
+    print(f"{'events':>9} {'view':>7} {'events in view':>15} {'legacy ms':>11} {'bucketed ms':>12} {'speedup':>8}")
+    for size in args.sizes:
+        events = build_events(size)
+        week_events = [e for e in events if week_start <= e.start_time < week_start + timedelta(days=7)]
+        month_events = [e for e in events if month_start <= e.start_time < month_end]
+
+        cases = [
+            ('weekly', len(week_events),
+             lambda: legacy_week_grid(week_start, week_events), lambda: week_grid(week_start, week_events)),
+            ('monthly', len(month_events),
+             lambda: legacy_month_grid(YEAR, 6, month_events), lambda: month_grid(YEAR, 6, month_events)),
+            ('yearly', len(events),
+             lambda: legacy_year_grid(events), lambda: year_grid(YEAR, events)),
+        ]
+        for view, in_view, legacy, bucketed in cases:
+            legacy_ms, bucketed_ms = timed(legacy), timed(bucketed)
+            print(f"{size:>9} {view:>7} {in_view:>15} {legacy_ms:>11.2f} {bucketed_ms:>12.2f} "
+                  f"{legacy_ms / bucketed_ms:>7.1f}x")
+        del events, week_events, month_events
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Benchmark dashboard chart rendering throughput under concurrent threads.
+
+Each "dashboard" renders the distribution, trend and peak-hours charts.
+Usage: python benchmarks/bench_charts.py [--threads 1 4 16] [--dashboards 48]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analytics.charts import ChartGenerator
+
+def sample_data(seed):
+    rng = random.Random(seed)
+    today = datetime.now()
+    days = [today - timedelta(days=i) for i in reversed(range(7))]
+    return {
+        'distribution': [{'_id': t, 'total_hours': rng.uniform(1, 40)}
+                         for t in ('work', 'personal', 'health', 'other')],
+        'trends': [{'date': d.strftime('%Y-%m-%d'), 'productive_hours': round(rng.uniform(0, 8), 2),
+                    'day_name': d.strftime('%A')} for d in days],
+        'peak_hours': [{'hour': h, 'hours': rng.uniform(0, 10) if 8 <= h < 19 else 0} for h in range(24)],
+    }
+
+def render_dashboard(data):
+    return sum(len(ChartGenerator.render(chart_type, series)) for chart_type, series in data.items())
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--dashboards', type=int, default=48)
+    args = parser.parse_args()
+
+    datasets = [sample_data(i) for i in range(args.dashboards)]
+
+    print(f"{'threads':>7} {'dashboards':>10} {'seconds':>8} {'dashboards/s':>13} {'ms/dashboard':>13}")
+    for threads in args.threads:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            # Warm every worker's figure templates before timing
+            list(pool.map(render_dashboard, datasets[:threads]))
+            start = time.perf_counter()
+            list(pool.map(render_dashboard, datasets))
+            elapsed = time.perf_counter() - start
+        print(f"{threads:>7} {args.dashboards:>10} {elapsed:>8.2f} {args.dashboards / elapsed:>13.2f} "
+              f"{elapsed * 1000 / args.dashboards:>13.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Benchmark conflict detection and free-slot search over a busy calendar.
+
+Expands --series daily series plus --events one-off events into a window of
+--days days (well over 100k occurrences by default), indexes them in an
+IntervalTree and compares overlap queries against a linear scan. The Mongo
+query in front of this is an index range scan and is not measured here.
+
+Everything happens between 08:00 and 18:00, except for a late event on
+--busy-nights of the nights, so free-slot searches from random times have
+to skip busy days and nights before they find a gap; every slot found is
+checked against a sweep over the sorted occurrences.
+
+Usage: python benchmarks/bench_conflicts.py [--series 1000] [--events 50000] [--days 90] [--busy-nights 0.7]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Event
+from conflicts import IntervalTree, overlapping_occurrences
+
+# Working hours, in minutes after midnight
+DAY_START, DAY_END = 8 * 60, 18 * 60
+
+def build_events(series, events, days, window_start, busy_nights):
+    rng = random.Random(42)
+    first = window_start - timedelta(days=365 * 3)
+    built = []
+    for i in range(series):
+        start = first + timedelta(minutes=rng.randrange(DAY_START, DAY_END - 30, 15))
+        built.append(Event(f'Series {i}', '', start, start + timedelta(minutes=30), 'work', 'daily', 'bench'))
+    for i in range(events):
+        duration = rng.choice([15, 30, 60, 120])
+        start = (window_start + timedelta(days=rng.randrange(days))
+                 + timedelta(minutes=rng.randrange(DAY_START, DAY_END - duration + 1, 15)))
+        built.append(Event(f'Event {i}', '', start, start + timedelta(minutes=duration), 'personal', '', 'bench'))
+    for day in range(days):
+        if rng.random() < busy_nights:
+            start = window_start + timedelta(days=day, hours=rng.choice([21, 22, 23]))
+            built.append(Event(f'Night {day}', '', start, start + timedelta(hours=1), 'personal', '', 'bench'))
+    return built
+
+def swept_free_slot(occurrences, duration, after, before):
+    """Reference free_slot(): walk the occurrences by start time, pushing the candidate past each overlap"""
+    candidate = after
+    for item in occurrences:
+        if candidate + duration > before or item.start_time >= candidate + duration:
+            break
+        if item.end_time > candidate:
+            candidate = item.end_time
+    return candidate if candidate + duration <= before else None
+
+def timed(fn, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--series', type=int, default=1000)
+    parser.add_argument('--events', type=int, default=50000)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--busy-nights', type=float, default=0.7, help='share of nights with a late event')
+    args = parser.parse_args()
+
+    window_start = datetime(2026, 1, 1)
+    window_end = window_start + timedelta(days=args.days)
+    events = build_events(args.series, args.events, args.days, window_start, args.busy_nights)
+
+    ms, occurrences = timed(lambda: list(overlapping_occurrences(events, window_start, window_end)))
+    print(f'expand  {len(occurrences):>8} occurrences  {ms:8.1f} ms')
+    ms, tree = timed(lambda: IntervalTree(occurrences))
+    print(f'build   interval tree          {ms:8.1f} ms')
+
+    rng = random.Random(7)
+    probes = []
+    for _ in range(args.queries):
+        start = window_start + timedelta(minutes=rng.randrange(0, args.days * 24 * 60, 15))
+        probes.append((start, start + timedelta(minutes=60)))
+
+    ms, _ = timed(lambda: [tree.overlapping(start, end) for start, end in probes])
+    print(f'overlap tree         {ms / args.queries * 1000:9.1f} us/query')
+    scan = lambda start, end: [o for o in occurrences if o.start_time < end and o.end_time > start]
+    sample = probes[:max(1, args.queries // 100)]
+    ms, _ = timed(lambda: [scan(start, end) for start, end in sample])
+    print(f'overlap linear scan  {ms / len(sample) * 1000:9.1f} us/query')
+
+    # Same answers both ways
+    for start, end in sample:
+        key = lambda o: (o._id, o.start_time)
+        assert sorted(map(key, tree.overlapping(start, end))) == sorted(map(key, scan(start, end)))
+
+    ms, _ = timed(tree.busy_blocks)
+    print(f'busy blocks (first use)        {ms:8.1f} ms')
+    by_start = sorted(occurrences, key=lambda o: o.start_time)
+    afters = [start for start, _ in probes[:20]]
+    # Night gaps are 18:00-21:00 and after the late event, or 14 hours on a quiet night
+    for minutes in (30, 120, 240, 600, 900):
+        duration = timedelta(minutes=minutes)
+        ms, slots = timed(lambda: [tree.free_slot(duration, after, window_end) for after in afters], repeat=10)
+        for after, slot in zip(afters, slots):
+            assert slot == swept_free_slot(by_start, duration, after, window_end), (minutes, after, slot)
+            assert slot is None or not tree.overlapping(slot, slot + duration)
+        found = [slot - after for after, slot in zip(afters, slots) if slot is not None]
+        wait = max(found) if found else None
+        print(f'free slot {minutes:>3} min   {ms / len(afters) * 1000:9.1f} us  '
+              f'found {len(found)}/{len(afters)}, longest wait {wait}')
+
+if __name__ == '__main__':
+    main()
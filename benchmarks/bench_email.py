@@ -0,0 +1,77 @@
+"""Benchmark notification email rendering.
+
+Renders --events notification emails with a full Jinja render_template()
+call each, as build_event_notification() used to, and with the cached
+EmailTemplate, which only fills in the event fields. Then renders one
+digest of the same changes. Nothing here talks to MongoDB or a mail server.
+
+Usage: python benchmarks/bench_email.py [--events 5000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Flask, render_template
+import instrumentation
+from models import Event
+from notifications import EmailTemplate, coalesce, event_fields
+
+ACTIONS = ('created', 'updated', 'deleted', 'reminder')
+
+def make_events(count):
+    rng = random.Random(0)
+    start = datetime(2026, 1, 1, 8)
+    events = []
+    for i in range(count):
+        begin = start + timedelta(minutes=30 * rng.randrange(20000))
+        events.append(Event(f'Event {i} <{rng.choice("abc")}>', rng.choice(['', f'Notes for event {i} & co.']),
+                            begin, begin + timedelta(minutes=30 * rng.randint(1, 6)),
+                            rng.choice(['work', 'personal', 'health', 'other']),
+                            rng.choice([None, 'daily', 'weekly']), 'bench'))
+    return events
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=5000)
+    args = parser.parse_args()
+
+    app = Flask(__name__, template_folder=os.path.join(ROOT, 'templates'))
+    instrumentation.init_app(app)
+    events = make_events(args.events)
+    actions = [ACTIONS[i % len(ACTIONS)] for i in range(len(events))]
+
+    with app.app_context():
+        start = time.perf_counter()
+        full = [render_template('email_template.html', action=action, **event_fields(event))
+                for event, action in zip(events, actions)]
+        full_seconds = time.perf_counter() - start
+
+        template = EmailTemplate(app)
+        start = time.perf_counter()
+        cached = [template.render(event, action) for event, action in zip(events, actions)]
+        cached_seconds = time.perf_counter() - start
+        assert cached == full
+
+        changes = [{'event_id': event._id, 'action': action, 'title': event.title,
+                    'event_type': event.event_type, 'start_time': event.start_time,
+                    'end_time': event.end_time, 'repeat': event.repeat}
+                   for event, action in zip(events, actions) if action != 'reminder']
+        start = time.perf_counter()
+        digest = render_template('email_digest.html', changes=coalesce(changes[-100:]),
+                                 omitted=max(0, len(changes) - 100), since=datetime.now())
+        digest_seconds = time.perf_counter() - start
+
+    print(f'full render_template  {full_seconds / len(events) * 1e6:8.1f} us/email')
+    print(f'cached EmailTemplate  {cached_seconds / len(events) * 1e6:8.1f} us/email '
+          f'({full_seconds / cached_seconds:.1f}x faster)')
+    print(f'digest of {len(changes)} changes (last 100 shown): 1 email, {digest_seconds * 1000:.1f} ms, '
+          f'{len(digest) / 1024:.0f} KiB (vs {sum(map(len, full)) / 1024:.0f} KiB as single emails)')
+
+if __name__ == '__main__':
+    main()
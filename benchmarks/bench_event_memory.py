@@ -0,0 +1,116 @@
+"""Benchmark the per-event memory footprint of a calendar view.
+
+Compares the old path (full documents wrapped by a __dict__-based Event via
+from_dict) with the current one (GRID_FIELDS projection and the __slots__
+Event via from_doc). Documents are round-tripped through BSON so they look
+exactly like what PyMongo returns.
+
+Usage: python benchmarks/bench_event_memory.py [--events 100000] [--description-bytes 200]
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bson
+from bson import ObjectId
+from models import Event, GRID_FIELDS
+
+class DictEvent:
+    """The Event model as it was before __slots__"""
+
+    def __init__(self, title, description, start_time, end_time,
+                 event_type, repeat=None, user_id=None, _id=None):
+        self.title = title
+        self.description = description
+        self.start_time = start_time
+        self.end_time = end_time
+        self.event_type = event_type
+        self.repeat = repeat
+        self.user_id = user_id
+        self._id = _id or ObjectId()
+
+    @staticmethod
+    def from_dict(data):
+        _id = data.get('_id')
+        if _id and not isinstance(_id, ObjectId):
+            _id = ObjectId(_id)
+        return DictEvent(
+            title=data.get('title'),
+            description=data.get('description'),
+            start_time=data.get('start_time'),
+            end_time=data.get('end_time'),
+            event_type=data.get('event_type'),
+            repeat=data.get('repeat'),
+            user_id=data.get('user_id'),
+            _id=_id
+        )
+
+def encoded_docs(count, description_bytes):
+    first = datetime(2026, 1, 1, 8)
+    docs = []
+    for i in range(count):
+        start = first + timedelta(minutes=53 * i)
+        docs.append(bson.encode({
+            '_id': ObjectId(),
+            'title': f'Event {i}',
+            'description': 'x' * description_bytes,
+            'start_time': start,
+            'end_time': start + timedelta(hours=1),
+            'event_type': 'work',
+            'repeat': '',
+            'user_id': 'current_user',
+            'rrule': None,
+        }))
+    return docs
+
+def project(raw, fields):
+    """Apply a projection up front, as the server would before sending the documents"""
+    doc = bson.decode(raw)
+    return bson.encode({key: value for key, value in doc.items() if key == '_id' or key in fields})
+
+def measure(build):
+    """Return (bytes retained by the result, seconds to build it)"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return retained, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--description-bytes', type=int, default=200)
+    args = parser.parse_args()
+
+    raw = encoded_docs(args.events, args.description_bytes)
+    projected = [project(doc, GRID_FIELDS) for doc in raw]
+    cases = [
+        ('full docs + dict Event', lambda: [DictEvent.from_dict(bson.decode(doc)) for doc in raw]),
+        ('full docs + slots Event', lambda: [Event.from_doc(bson.decode(doc)) for doc in raw]),
+        ('projected + slots Event', lambda: [Event.from_doc(bson.decode(doc)) for doc in projected]),
+    ]
+    print(f'{args.events} events, {args.description_bytes}-byte descriptions')
+    for name, build in cases:
+        retained, elapsed = measure(build)
+        print(f'  {name:<26} {retained / args.events:7.0f} bytes/event  {elapsed * 1000:8.1f} ms')
+
+    # Constructor cost alone, on documents that are already decoded
+    docs = [bson.decode(doc) for doc in raw[:10000]]
+    for name, build in (('DictEvent.from_dict', lambda: [DictEvent.from_dict(doc) for doc in docs]),
+                        ('Event.from_doc', lambda: [Event.from_doc(doc) for doc in docs])):
+        start = time.perf_counter()
+        build()
+        print(f'  {name:<26} {(time.perf_counter() - start) / len(docs) * 1e9:7.0f} ns/event')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Benchmark .ics export and streaming import throughput.
+
+Writes --events synthetic events (a mix of one-off events, simple repeats and
+richer RRULEs) to a temporary .ics file with iter_ics, then imports the file
+with import_ics. Without --mongo-uri the batches go to a sink that only counts
+them, which isolates parsing and mapping; with it they are inserted into a
+scratch collection that is dropped afterwards. Peak memory of the import is
+measured in a separate tracemalloc run.
+
+Usage: python benchmarks/bench_ical.py [--events 100000] [--batch-size 1000] [--mongo-uri URI]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from ical import iter_ics, import_ics
+
+RULES = [None, None, None, 'daily', 'weekly', 'FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,WE,FR',
+         'FREQ=MONTHLY;BYDAY=-1FR;COUNT=12']
+TYPES = ['work', 'personal', 'health', 'other']
+
+def generate_docs(count):
+    first = datetime(2020, 1, 1, 8)
+    for i in range(count):
+        start = first + timedelta(minutes=37 * i)
+        rule = RULES[i % len(RULES)]
+        yield {
+            '_id': ObjectId(),
+            'title': f'Event {i}, imported',
+            'description': 'Line one\nLine two; with punctuation' if i % 3 == 0 else '',
+            'start_time': start,
+            'end_time': start + timedelta(minutes=45),
+            'event_type': TYPES[i % len(TYPES)],
+            'repeat': rule if rule and '=' not in rule else '',
+            'rrule': rule if rule and '=' in rule else None,
+        }
+
+class CountingSink:
+    """Stands in for a collection when only parse/map throughput is measured"""
+
+    def __init__(self):
+        self.count = 0
+
+    def insert_many(self, docs, ordered=True):
+        self.count += len(docs)
+
+def run_import(path, collection, batch_size):
+    with open(path, encoding='utf-8', newline='') as f:
+        return import_ics(f, 'bench', collection, batch_size=batch_size)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--mongo-uri', default=None, help='Insert into a scratch collection of this MongoDB.')
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.ics')
+    try:
+        start = time.perf_counter()
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+            for chunk in iter_ics(generate_docs(args.events)):
+                f.write(chunk)
+        elapsed = time.perf_counter() - start
+        size_mb = os.path.getsize(path) / 1e6
+        print(f'export  {args.events:>7} events  {elapsed:6.2f} s  {args.events / elapsed:9.0f} events/s'
+              f'  ({size_mb:.1f} MB)')
+
+        collection, client = CountingSink(), None
+        if args.mongo_uri:
+            from pymongo import MongoClient
+            client = MongoClient(args.mongo_uri)
+            collection = client.get_database('timetable_bench').ical_import
+            collection.drop()
+
+        start = time.perf_counter()
+        summary = run_import(path, collection, args.batch_size)
+        elapsed = time.perf_counter() - start
+        target = 'mongodb' if client else 'sink'
+        print(f'import  {summary["imported"]:>7} events  {elapsed:6.2f} s  '
+              f'{summary["imported"] / elapsed:9.0f} events/s  (into {target}, '
+              f'{len(summary["errors"])} errors, {len(summary["warnings"])} warnings)')
+
+        tracemalloc.start()
+        run_import(path, CountingSink(), args.batch_size)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'import peak memory {peak / 1e6:.1f} MB for a {size_mb:.1f} MB file '
+              f'(batch size {args.batch_size})')
+
+        if client:
+            collection.drop()
+            client.close()
+    finally:
+        os.remove(path)
+
+if __name__ == '__main__':
+    main()
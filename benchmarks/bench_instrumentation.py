@@ -0,0 +1,65 @@
+"""Benchmark the per-request cost of instrumentation.py.
+
+Times the pieces the instrumentation adds to every request: the
+before/after request hooks, a stage() block and the MongoDB command
+listener. Nothing here talks to MongoDB; the command events are synthetic.
+Then times /metrics rendering once --routes routes have recorded data.
+
+Usage: python benchmarks/bench_instrumentation.py [--requests 20000] [--commands 5] [--routes 30]
+"""
+import argparse
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+import instrumentation
+from instrumentation import MongoCommandListener, render_metrics, stage
+
+def build_app(routes, instrumented):
+    app = Flask(__name__)
+    if instrumented:
+        instrumentation.init_app(app)
+    for i in range(routes):
+        app.add_url_rule(f'/route{i}', f'route{i}', lambda: '')
+    return app
+
+def run(app, listener, requests, commands, routes, instrumented):
+    command = {'find': 'events', 'filter': {'user_id': 'u', 'start_time': {'$gte': 1, '$lt': 2}}}
+    start = time.perf_counter()
+    for i in range(requests):
+        with app.test_request_context(f'/route{i % routes}'):
+            app.preprocess_request()
+            if instrumented:
+                for request_id in range(commands):
+                    listener.started(SimpleNamespace(connection_id=1, request_id=request_id, command=command))
+                    listener.succeeded(SimpleNamespace(connection_id=1, request_id=request_id,
+                                                       command_name='find', duration_micros=800))
+                with stage('grid'):
+                    pass
+            app.process_response(app.response_class(''))
+    return (time.perf_counter() - start) / requests * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--commands', type=int, default=5)
+    parser.add_argument('--routes', type=int, default=30)
+    args = parser.parse_args()
+
+    listener = MongoCommandListener(slow_query_ms=100)
+    baseline = run(build_app(args.routes, False), listener, args.requests, args.commands, args.routes, False)
+    instrumented = run(build_app(args.routes, True), listener, args.requests, args.commands, args.routes, True)
+    print(f'plain request                  {baseline:8.1f} us/request')
+    print(f'with hooks, stage, {args.commands} commands   {instrumented:8.1f} us/request')
+    print(f'instrumentation overhead       {instrumented - baseline:8.1f} us/request')
+
+    start = time.perf_counter()
+    body = render_metrics()
+    print(f'/metrics render {len(body.splitlines()):>6} lines  {(time.perf_counter() - start) * 1000:8.1f} ms')
+
+if __name__ == '__main__':
+    main()
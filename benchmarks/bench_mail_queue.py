@@ -0,0 +1,129 @@
+"""Drain the mail queue through a local stand-in SMTP server.
+
+Starts an aiosmtpd server (pip install aiosmtpd) on --port, queues
+--messages emails with MailQueue and delivers them with drain(). Every
+--bounce-every'th email goes to an address the server refuses, so it is
+retried (with no backoff delay here) until it is marked failed. Before the
+server starts, one batch is processed against the closed port to check
+that a refused connection puts the whole batch back on the queue.
+
+Reports messages per second, the number of SMTP connections used and the
+final status of every queued email, and exits non-zero if anything was
+lost, duplicated or delivered to the wrong recipient.
+
+Without --mongo-uri the queue lives in mongomock (pip install mongomock);
+with it, in a scratch database that is dropped before and after.
+
+Usage: python benchmarks/bench_mail_queue.py [--messages 200] [--batch-size 50] [--bounce-every 10]
+                                             [--max-attempts 3] [--port 8025] [--mongo-uri URI]
+"""
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask_mail import Mail
+from mail_queue import MailQueue
+
+class Recorder:
+    """aiosmtpd handler that keeps every delivered message and refuses bounce@ addresses"""
+
+    def __init__(self):
+        self.delivered = []
+        self.connections = set()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith('bounce'):
+            return '550 No such user'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.connections.add(session.peer)
+        self.delivered.extend(envelope.rcpt_tos)
+        return '250 Message accepted for delivery'
+
+def recipient(i, bounce_every):
+    if bounce_every and i % bounce_every == bounce_every - 1:
+        return f'bounce{i}@example.com'
+    return f'user{i}@example.com'
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--bounce-every', type=int, default=10)
+    parser.add_argument('--max-attempts', type=int, default=3)
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--mongo-uri', help='scratch database on a running mongod (default: mongomock)')
+    args = parser.parse_args()
+
+    from aiosmtpd.controller import Controller
+
+    app = Flask(__name__)
+    app.config.update(MAIL_SERVER='localhost', MAIL_PORT=args.port, MAIL_USE_TLS=False, MAIL_USE_SSL=False,
+                      MAIL_DEFAULT_SENDER='timetable@example.com')
+    if args.mongo_uri:
+        from pymongo import MongoClient
+        db = MongoClient(args.mongo_uri).get_default_database()
+        db.client.drop_database(db.name)
+    else:
+        import mongomock
+        db = mongomock.MongoClient().get_database('timetable_bench')
+    queue = MailQueue(app, Mail(app), SimpleNamespace(db=db), batch_size=args.batch_size,
+                      max_attempts=args.max_attempts, base_delay=0)
+
+    try:
+        expected = [recipient(i, args.bounce_every) for i in range(args.messages)]
+        # Inserted like enqueue_many() does, without starting the worker thread, which would race with drain()
+        now = datetime.now()
+        queue.collection.insert_many([{
+            'subject': f'Message {i}', 'recipients': [address], 'html': f'<p>Message {i}</p>',
+            'status': 'pending', 'attempts': 0, 'next_attempt_at': now, 'created_at': now
+        } for i, address in enumerate(expected)])
+
+        # Nothing listens on the port yet
+        claimed = queue.process_batch()
+        requeued = queue.collection.count_documents({'status': 'pending', 'attempts': 1})
+        print(f'server down: {claimed} claimed, {requeued} back on the queue')
+        problems = [] if requeued == claimed == min(args.batch_size, args.messages) else ['refused connection']
+
+        recorder = Recorder()
+        controller = Controller(recorder, hostname='localhost', port=args.port)
+        controller.start()
+        try:
+            start = time.perf_counter()
+            processed = queue.drain()
+            seconds = time.perf_counter() - start
+        finally:
+            controller.stop()
+
+        statuses = Counter(doc['status'] for doc in queue.collection.find({}, {'status': 1}))
+        good = [address for address in expected if not address.startswith('bounce')]
+        bounced = len(expected) - len(good)
+        sent = statuses['sent']
+        print(f'delivered {sent} of {len(expected)} emails in {seconds:.2f} s '
+              f'({sent / seconds:.0f}/s) over {len(recorder.connections)} SMTP connections, '
+              f'{processed} claims including retries')
+        print('final status: ' + ', '.join(f'{status} {count}' for status, count in sorted(statuses.items())))
+
+        if sorted(recorder.delivered) != sorted(good):
+            problems.append('delivered recipients differ from the queued ones')
+        if statuses != Counter({'sent': len(good), 'failed': bounced} if bounced else {'sent': len(good)}):
+            problems.append('unexpected final statuses')
+        if queue.collection.count_documents({'status': 'failed', 'attempts': {'$ne': args.max_attempts}}):
+            problems.append('failed emails were not retried max_attempts times')
+        if problems:
+            raise SystemExit('FAILED: ' + '; '.join(problems))
+    finally:
+        if args.mongo_uri:
+            db.client.drop_database(db.name)
+
+if __name__ == '__main__':
+    main()
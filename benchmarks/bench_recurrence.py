@@ -0,0 +1,58 @@
+"""Benchmark recurrence expansion for a yearly view over many long-lived daily series.
+
+Uncached expansion builds every occurrence; cached expansion returns the
+tuples built by the first one. With --rrule the series carry an imported
+RFC 5545 rule (e.g. 'FREQ=WEEKLY;BYDAY=MO,WE,FR') instead of repeating daily.
+
+Usage: python benchmarks/bench_recurrence.py [--events 300] [--age-years 10] [--rrule RULE]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Event
+from recurrence import RecurrenceCache, expand_events
+
+def build_series(count, age_years, rule=None):
+    first = datetime.now().replace(microsecond=0) - timedelta(days=365 * age_years)
+    return [
+        Event(f'Series {i}', '', first + timedelta(minutes=i), first + timedelta(minutes=i + 30),
+              'work', rule.split(';')[0][5:].lower() if rule else 'daily', 'bench', rrule=rule)
+        for i in range(count)
+    ]
+
+def timed(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=300)
+    parser.add_argument('--age-years', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--rrule', help='imported rule of every series (default: repeat daily)')
+    args = parser.parse_args()
+
+    events = build_series(args.events, args.age_years, args.rrule)
+    year = datetime.now().year
+    window = (datetime(year, 1, 1), datetime(year + 1, 1, 1))
+    cache = RecurrenceCache()
+
+    cold_ms, occurrences = timed(lambda: expand_events(events, *window), args.repeat)
+    expand_events(events, *window, cache=cache)
+    warm_ms, _ = timed(lambda: expand_events(events, *window, cache=cache), args.repeat)
+
+    print(f"{args.events} {args.rrule or 'daily'} series, {args.age_years} years old, {len(occurrences)} occurrences in {year}")
+    print(f"  uncached expansion: {cold_ms:8.2f} ms")
+    print(f"  cached expansion:   {warm_ms:8.2f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+"""End-to-end benchmark of every route through Flask's test client.
+
+Seeds synthetic calendars (see loadgen.py), then requests each route
+--requests times and reports per route the p50/p95/p99 latency, the peak
+memory allocated while handling one request and the MongoDB commands per
+request, all as the first synthetic user. Memory is traced in a second pass
+of --memory-requests requests, so tracemalloc does not slow down the timed
+pass. Reads run before writes; deletes remove events seeded for them.
+
+With --mongo-uri it runs against that database (dropped before and after;
+indexes are created as in production). Without it, everything runs in
+memory on mongomock (pip install mongomock): the numbers are only
+comparable with other mongomock runs. Each mongomock collection call is
+reported to the app's command listener as the one command pymongo would
+start it with; getMore batches of large results are not counted, so a real
+server can report more commands for the same route.
+
+--set KEY=VALUE overrides app config (e.g. VIEW_CACHE_BACKEND=none), --json
+saves the results and --baseline compares p95 latency and command counts
+with a saved run, for CI.
+
+Usage: python benchmarks/bench_routes.py [--mongo-uri URI] [--users 5] [--events-per-user 1000]
+                                         [--recurring 0.05] [--types work=4,personal=3,health=2,other=1]
+                                         [--requests 20] [--memory-requests 3] [--routes daily api/events ...]
+                                         [--set KEY=VALUE ...] [--json out.json] [--baseline old.json]
+"""
+import argparse
+import inspect
+import itertools
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import loadgen
+
+SCRATCH_URI = 'mongodb://localhost:27017/timetable_bench'
+
+# mongomock collection methods and the command pymongo would send for each
+COMMANDS = {
+    'find': 'find', 'find_one': 'find', 'aggregate': 'aggregate', 'count_documents': 'aggregate',
+    'distinct': 'distinct', 'insert_one': 'insert', 'insert_many': 'insert', 'update_one': 'update',
+    'update_many': 'update', 'replace_one': 'update', 'bulk_write': 'update', 'delete_one': 'delete',
+    'delete_many': 'delete', 'find_one_and_update': 'findAndModify', 'find_one_and_delete': 'findAndModify',
+}
+
+class MonitoredCollection:
+    """A mongomock collection that reports each call to a pymongo CommandListener"""
+
+    def __init__(self, collection, listener, request_ids):
+        self._collection = collection
+        self._listener = listener
+        self._request_ids = request_ids
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        command = COMMANDS.get(name)
+        if command is None:
+            return attribute
+
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return attribute(*args, **kwargs)
+            finally:
+                self._listener.succeeded(SimpleNamespace(
+                    command_name=command, connection_id=0, request_id=next(self._request_ids),
+                    duration_micros=int((time.perf_counter() - start) * 1e6)))
+        return call
+
+class MonitoredDatabase:
+    def __init__(self, db, listener):
+        self._db = db
+        self._listener = listener
+        self._request_ids = itertools.count()
+
+    def __getitem__(self, name):
+        return MonitoredCollection(self._db[name], self._listener, self._request_ids)
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name in ('name', 'client', 'command', 'list_collection_names'):
+            return getattr(self._db, name)
+        return self[name]
+
+def use_mongomock(appmod):
+    import mongomock
+    from mongomock.collection import BulkOperationBuilder
+
+    # mongomock's bulk builder predates the `sort` argument newer pymongo passes with UpdateOne/ReplaceOne
+    for name in ('add_update', 'add_replace'):
+        method = getattr(BulkOperationBuilder, name)
+        if 'sort' not in inspect.signature(method).parameters:
+            def without_sort(self, *args, _method=method, sort=None, **kwargs):
+                return _method(self, *args, **kwargs)
+            setattr(BulkOperationBuilder, name, without_sort)
+
+    raw = mongomock.MongoClient().get_database('timetable_bench')
+    appmod.mongo.db = MonitoredDatabase(raw, appmod.mongo_listener)
+    return raw
+
+ICS_TEMPLATE = """BEGIN:VEVENT
+UID:bench-{i}-{n}@timetable
+SUMMARY:Imported {i}
+DTSTART:{start:%Y%m%dT%H%M%S}
+DTEND:{end:%Y%m%dT%H%M%S}
+END:VEVENT
+"""
+
+def ics_body(i, count=10):
+    start = datetime.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=30)
+    events = ''.join(ICS_TEMPLATE.format(i=i, n=n, start=start + timedelta(hours=n),
+                                         end=start + timedelta(hours=n, minutes=45)) for n in range(count))
+    return 'BEGIN:VCALENDAR\nVERSION:2.0\n' + events + 'END:VCALENDAR\n'
+
+def event_json(i):
+    start = datetime.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=3, hours=i % 48)
+    return {'title': f'Bench {i}', 'start_time': start.isoformat(),
+            'end_time': (start + timedelta(minutes=45)).isoformat(), 'event_type': 'work'}
+
+def event_form(i):
+    data = event_json(i)
+    return {**data, 'description': '', 'repeat': '', 'ignore_conflicts': 'on'}
+
+def scenarios(ids, victims):
+    """(name, request factory) of every route; a factory maps the request number to test client open() kwargs"""
+    today = datetime.now()
+    day = today.strftime('%Y-%m-%d')
+    month = {'start': (today - timedelta(days=30)).isoformat(), 'end': today.isoformat()}
+    query = '&'.join(f'{key}={value}' for key, value in month.items())
+    event_id = lambda i: ids[i % len(ids)]
+
+    reads = [
+        ('/', lambda i: {'path': '/'}),
+        ('/daily', lambda i: {'path': f'/daily?date={day}'}),
+        ('/weekly', lambda i: {'path': f'/weekly?date={day}'}),
+        ('/monthly', lambda i: {'path': f'/monthly?date={day}'}),
+        ('/yearly', lambda i: {'path': f'/yearly?date={day}'}),
+        ('/analytics/dashboard', lambda i: {'path': '/analytics/dashboard'}),
+        ('/analytics/time-distribution', lambda i: {'path': '/analytics/time-distribution'}),
+        ('/analytics/productivity-trends', lambda i: {'path': '/analytics/productivity-trends'}),
+        ('/analytics/chart/distribution.png', lambda i: {'path': '/analytics/chart/distribution.png'}),
+        ('/analytics/chart/trends.png', lambda i: {'path': '/analytics/chart/trends.png'}),
+        ('/analytics/chart/peak_hours.png', lambda i: {'path': '/analytics/chart/peak_hours.png'}),
+        ('/analytics/report', lambda i: {'path': '/analytics/report'}),
+        ('/api/analytics/report', lambda i: {'path': '/api/analytics/report'}),
+        ('/api/events', lambda i: {'path': f'/api/events?{query}'}),
+        ('/api/events/<event_id>', lambda i: {'path': f'/api/events/{event_id(i)}'}),
+        ('/api/events/export', lambda i: {'path': f'/api/events/export?{query}'}),
+        ('/api/events/export?format=ics', lambda i: {'path': f'/api/events/export?{query}&format=ics'}),
+        ('/api/free-slot', lambda i: {'path': '/api/free-slot?duration=60'}),
+        ('/event/new', lambda i: {'path': '/event/new'}),
+        ('/event/<event_id>/edit', lambda i: {'path': f'/event/{event_id(i)}/edit'}),
+        ('/email-settings', lambda i: {'path': '/email-settings'}),
+        ('/metrics', lambda i: {'path': '/metrics'}),
+        ('/login', lambda i: {'path': '/login'}),
+        ('/static/<path:filename>', lambda i: {'path': '/static/css/main.css'}),
+    ]
+    writes = [
+        ('POST /event/new', lambda i: {'path': '/event/new', 'method': 'POST', 'data': event_form(i)}),
+        ('POST /event/<event_id>/edit', lambda i: {'path': f'/event/{event_id(i)}/edit', 'method': 'POST',
+                                                   'data': event_form(i)}),
+        ('POST /api/events', lambda i: {'path': '/api/events', 'method': 'POST', 'json': event_json(i)}),
+        ('PATCH /api/events/<event_id>', lambda i: {'path': f'/api/events/{event_id(i)}', 'method': 'PATCH',
+                                                    'json': {'title': f'Patched {i}'}}),
+        ('POST /api/events/bulk', lambda i: {'path': '/api/events/bulk', 'method': 'POST',
+                                             'json': [event_json(i * 10 + n) for n in range(10)]}),
+        ('POST /api/events/import', lambda i: {'path': '/api/events/import', 'method': 'POST',
+                                               'data': ics_body(i), 'content_type': 'text/calendar'}),
+        ('POST /event/<event_id>/delete', lambda i: {'path': f'/event/{victims[0].pop()}/delete',
+                                                     'method': 'POST'}),
+        ('DELETE /api/events/<event_id>', lambda i: {'path': f'/api/events/{victims[1].pop()}',
+                                                     'method': 'DELETE'}),
+    ]
+    return reads + writes
+
+def route_commands(instrumentation):
+    """MongoDB commands counted so far for requests (not background work)"""
+    with instrumentation.MONGO_COMMANDS._lock:
+        return sum(value for labels, value in instrumentation.MONGO_COMMANDS._values.items()
+                   if labels[0] != instrumentation.BACKGROUND)
+
+def request(client, kwargs):
+    response = client.open(**kwargs)
+    response.get_data()
+    response.close()
+    return response.status_code
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def run(client, instrumentation, routes, requests, memory_requests):
+    results = {}
+    for name, factory in routes:
+        latencies, commands, errors = [], [], 0
+        for i in range(requests):
+            before = route_commands(instrumentation)
+            start = time.perf_counter()
+            status = request(client, factory(i))
+            latencies.append((time.perf_counter() - start) * 1000)
+            commands.append(route_commands(instrumentation) - before)
+            errors += status >= 400
+
+        tracemalloc.start()
+        peak = 0
+        for i in range(requests, requests + memory_requests):
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            errors += request(client, factory(i)) >= 400
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - baseline)
+        tracemalloc.stop()
+
+        latencies.sort()
+        results[name] = {
+            'requests': requests, 'errors': errors,
+            'p50_ms': round(percentile(latencies, 50), 2), 'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2), 'peak_kib': round(peak / 1024, 1),
+            'commands': round(sum(commands) / len(commands), 2), 'max_commands': max(commands),
+        }
+    return results
+
+def report(results, baseline=None):
+    header = f'{"route":<34} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"peak KiB":>9} {"cmds":>6} {"err":>4}'
+    if baseline:
+        header += f' {"p95 vs base":>11} {"cmds vs base":>12}'
+    print(header)
+    for name, row in results.items():
+        line = (f'{name:<34} {row["p50_ms"]:>8.1f} {row["p95_ms"]:>8.1f} {row["p99_ms"]:>8.1f} '
+                f'{row["peak_kib"]:>9.0f} {row["commands"]:>6g} {row["errors"]:>4}')
+        old = (baseline or {}).get(name)
+        if old:
+            line += f' {row["p95_ms"] / max(old["p95_ms"], 0.01):>10.2f}x {row["commands"] - old["commands"]:>+12g}'
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mongo-uri', help='scratch database on a running mongod (default: mongomock)')
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--events-per-user', type=int, default=1000)
+    parser.add_argument('--recurring', type=float, default=0.05)
+    parser.add_argument('--types', default=loadgen.DEFAULT_TYPES)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--memory-requests', type=int, default=3)
+    parser.add_argument('--routes', nargs='+', help='only routes whose name contains one of these')
+    parser.add_argument('--set', dest='overrides', action='append', default=[], metavar='KEY=VALUE')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='results of an earlier run (--json) to compare with')
+    args = parser.parse_args()
+
+    # Config is read when app is imported
+    os.environ['MONGO_URI'] = args.mongo_uri or SCRATCH_URI
+    os.environ.setdefault('SECRET_KEY', 'benchmark')  # only signs the benchmark's own test client sessions
+    os.environ['MONGO_ENSURE_INDEXES'] = 'false'
+    user_id = loadgen.user_ids(1)[0]
+    os.environ['ADMIN_USERNAMES'] = user_id  # for /email-settings
+    for override in args.overrides:
+        key, _, value = override.partition('=')
+        os.environ[key] = value
+    import app as appmod
+    import instrumentation
+    from indexes import ensure_indexes
+
+    if args.mongo_uri:
+        raw = appmod.mongo.db
+        raw.client.drop_database(raw.name)
+        ensure_indexes(raw)
+    else:
+        raw = use_mongomock(appmod)
+
+    try:
+        start = time.perf_counter()
+        inserted = loadgen.seed(raw, args.users, args.events_per_user, args.recurring,
+                                loadgen.parse_types(args.types), args.days)
+        appmod.rollups.rebuild()
+        print(f'Seeded {inserted} events for {args.users} users in {time.perf_counter() - start:.1f} s')
+
+        # Events to show and edit, and separate ones for the delete routes to remove
+        ids = [doc['_id'] for doc in raw.events.find({'user_id': user_id, 'repeat': None}, {'_id': 1})
+               .limit(200)]
+        count = args.requests + args.memory_requests
+        victims = loadgen.generate_events(user_id, 2 * count, random.Random(1), days=30, recurring=0)
+        raw.events.insert_many([event.to_dict() for event in victims])
+        appmod.rollups.add_many(victims)
+        victim_ids = [str(event._id) for event in victims]
+
+        routes = scenarios(ids, [victim_ids[:count], victim_ids[count:]])
+        if args.routes:
+            routes = [(name, factory) for name, factory in routes if any(part in name for part in args.routes)]
+
+        client = appmod.app.test_client()
+        loadgen.login(client, user_id)
+        results = run(client, instrumentation, routes, args.requests, args.memory_requests)
+        baseline = None
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)['routes']
+        report(results, baseline)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump({'config': {key: value for key, value in vars(args).items()
+                                      if key not in ('json', 'baseline')},
+                           'routes': results}, f, indent=2)
+    finally:
+        if args.mongo_uri:
+            raw.client.drop_database(raw.name)
+
+if __name__ == '__main__':
+    main()
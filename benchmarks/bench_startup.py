@@ -0,0 +1,57 @@
+"""Report app import time with python -X importtime and guard against regressions.
+
+Fails (exit 1) if importing app takes longer than --max-ms or loads any of the
+modules that must stay lazy (matplotlib, numpy by default).
+Usage: python benchmarks/bench_startup.py [--runs 5] [--top 15] [--max-ms 1500]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def import_times():
+    """Import app in a fresh interpreter; return {module: (self_us, cumulative_us)}"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                            cwd=ROOT, capture_output=True, text=True, check=True,
+                            env={'SECRET_KEY': 'benchmark', **os.environ})
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        times[module.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--max-ms', type=float, default=1500)
+    parser.add_argument('--forbid', nargs='*', default=['matplotlib', 'numpy'])
+    args = parser.parse_args()
+
+    runs = [import_times() for _ in range(args.runs)]
+    # Best of N runs smooths out disk cache and scheduler noise
+    best = min(runs, key=lambda times: times['app'][1])
+    total_ms = best['app'][1] / 1000
+
+    print(f"import app: {total_ms:.1f} ms (best of {args.runs})")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    top_level = {name: t for name, t in best.items() if '.' not in name}
+    for name, (self_us, cumulative_us) in sorted(top_level.items(), key=lambda i: -i[1][1])[:args.top]:
+        print(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>9.1f}  {name}")
+
+    failures = []
+    loaded = sorted(m for m in args.forbid if m in best)
+    if loaded:
+        failures.append(f"eagerly imported: {', '.join(loaded)}")
+    if total_ms > args.max_ms:
+        failures.append(f"import took {total_ms:.1f} ms, limit is {args.max_ms:.0f} ms")
+    if failures:
+        print("FAIL: " + "; ".join(failures))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
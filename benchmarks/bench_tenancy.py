@@ -0,0 +1,163 @@
+"""Benchmark per-user latency as the number of users grows.
+
+Seeds --events-per-user synthetic events (see loadgen.py) for 1 user, then
+adds users step by step up to --max-users (1, 10, 100, ... by default).
+After each step, --sample users spread over the whole population log in
+and request each route --requests times. Reports the p50/p95 latency per
+route and step, and the p95 relative to the first step: since every query
+leads with the user's id, it should stay flat however many other users
+there are.
+
+Latency depends on the machine, so each step also explain()s every
+per-user query shape registered in indexes.py for the sampled users and
+reports the index keys and documents a query examined and returned, on
+average, and the documents examined per document returned. That ratio
+stays near 1 when the user_id-led indexes keep other users' data out of
+the scan; it should not grow with the number of users at all. Before the first step it
+runs the checks of `flask ensure-indexes --check`: every per-user shape
+targets one user_id (so a cluster sharded on user_id sends it to one
+shard), and each step fails if a shape falls back to a collection scan.
+
+Needs a running mongod: --mongo-uri is a scratch database, dropped before
+and after; indexes are created as in production and the view cache is
+disabled so every request reaches the database.
+
+Usage: python benchmarks/bench_tenancy.py [--mongo-uri mongodb://localhost:27017/timetable_bench]
+                                          [--max-users 100000] [--events-per-user 20] [--days 90]
+                                          [--sample 10] [--requests 5]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import loadgen
+
+def routes():
+    today = datetime.now()
+    day = today.strftime('%Y-%m-%d')
+    month = f"start={(today - timedelta(days=30)).isoformat()}&end={today.isoformat()}"
+    return [
+        ('/daily', f'/daily?date={day}'),
+        ('/weekly', f'/weekly?date={day}'),
+        ('/monthly', f'/monthly?date={day}'),
+        ('/analytics/dashboard', '/analytics/dashboard'),
+        ('/api/events', f'/api/events?{month}'),
+        ('/api/analytics/report', '/api/analytics/report'),
+    ]
+
+def steps(max_users):
+    total = 1
+    while total < max_users:
+        yield total
+        total *= 10
+    yield max_users
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def sampled_users(users, sample):
+    """`sample` user ids spread evenly over the first `users`"""
+    stride = max(1, users // sample)
+    return [loadgen.user_ids(1, i)[0] for i in range(0, users, stride)][:sample]
+
+def for_user(value, user_id):
+    """A registered query shape's filter with EXPLAIN_USER replaced by `user_id`"""
+    from indexes import EXPLAIN_USER
+    if isinstance(value, dict):
+        return {key: for_user(item, user_id) for key, item in value.items()}
+    if isinstance(value, list):
+        return [for_user(item, user_id) for item in value]
+    return user_id if value == EXPLAIN_USER else value
+
+def examined(db, users, sample):
+    """{shape: (keys examined, docs examined, docs returned)} of the per-user shapes, averaged over users"""
+    from indexes import CROSS_USER_SHAPES, QUERY_SHAPES, SHARD_KEYS
+    sampled = sampled_users(users, sample)
+    results = {}
+    for name, (collection, make_filter, sort) in QUERY_SHAPES.items():
+        if collection not in SHARD_KEYS or name in CROSS_USER_SHAPES:
+            continue
+        totals = [0, 0, 0]
+        for user_id in sampled:
+            cursor = db[collection].find(for_user(make_filter(), user_id))
+            if sort:
+                cursor = cursor.sort(sort)
+            stats = cursor.explain()['executionStats']
+            for i, key in enumerate(('totalKeysExamined', 'totalDocsExamined', 'nReturned')):
+                totals[i] += stats[key]
+        results[name] = tuple(total / len(sampled) for total in totals)
+    return results
+
+def measure(app, users, sample, requests):
+    """{route: sorted latencies in ms} over `sample` users spread evenly over the first `users`"""
+    latencies = {name: [] for name, _ in routes()}
+    for user_id in sampled_users(users, sample):
+        client = app.test_client()
+        loadgen.login(client, user_id)
+        for name, path in routes():
+            # The first request warms up templates and connections and is not counted
+            for attempt in range(requests + 1):
+                start = time.perf_counter()
+                response = client.get(path)
+                if attempt:
+                    latencies[name].append((time.perf_counter() - start) * 1000)
+                if response.status_code != 200:
+                    raise SystemExit(f'{name} as {user_id}: HTTP {response.status_code}')
+    return {name: sorted(values) for name, values in latencies.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mongo-uri', default='mongodb://localhost:27017/timetable_bench')
+    parser.add_argument('--max-users', type=int, default=100000)
+    parser.add_argument('--events-per-user', type=int, default=20)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--sample', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=5)
+    args = parser.parse_args()
+
+    # Config is read when app is imported
+    os.environ['MONGO_URI'] = args.mongo_uri
+    os.environ.setdefault('SECRET_KEY', 'benchmark')  # only signs the benchmark's own test client sessions
+    os.environ['MONGO_ENSURE_INDEXES'] = 'false'
+    os.environ['VIEW_CACHE_BACKEND'] = 'none'
+    import app as appmod
+    from indexes import check_query_plans, check_shard_targeting, ensure_indexes
+
+    db = appmod.mongo.db
+    db.client.drop_database(db.name)
+    try:
+        ensure_indexes(db)
+        check_shard_targeting()
+        print('# every per-user query shape targets one user_id')
+        seeded = 0
+        first = None
+        for total in steps(args.max_users):
+            start = time.perf_counter()
+            loadgen.seed(db, total - seeded, args.events_per_user, days=args.days, first_user=seeded,
+                         rollups=appmod.rollups)
+            print(f'# seeded users {seeded}-{total - 1} in {time.perf_counter() - start:.1f} s')
+            seeded = total
+            check_query_plans(db)
+
+            results = measure(appmod.app, total, args.sample, args.requests)
+            first = first or results
+            print(f'{"users":>8} {"route":<24} {"p50 ms":>8} {"p95 ms":>8} {"p95 vs 1 user":>14}')
+            for name, values in results.items():
+                p95 = percentile(values, 95)
+                print(f'{total:>8} {name:<24} {percentile(values, 50):>8.1f} {p95:>8.1f} '
+                      f'{p95 / percentile(first[name], 95):>13.2f}x')
+
+            print(f'{"users":>8} {"query shape":<24} {"keys":>8} {"docs":>8} {"returned":>8} {"docs/returned":>14}')
+            for name, (keys, docs, returned) in examined(db, total, args.sample).items():
+                print(f'{total:>8} {name:<24} {keys:>8.1f} {docs:>8.1f} {returned:>8.1f} '
+                      f'{docs / max(1, returned):>14.2f}')
+    finally:
+        db.client.drop_database(db.name)
+
+if __name__ == '__main__':
+    main()
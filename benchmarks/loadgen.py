@@ -0,0 +1,139 @@
+"""Synthetic calendars for the benchmarks.
+
+Generates events shaped like real schedules: work on weekday office hours,
+health in the early morning, personal events in the evening, durations in
+quarter hours, and a share of recurring series (some with an imported
+RRULE). Events are spread over the last --days days and the next two
+weeks. Users are named user-000000, user-000001 and so on; benchmarks act
+as one by putting its id in the session (see login()).
+Run on its own, it seeds a database and rebuilds its rollups.
+
+Usage: python benchmarks/loadgen.py [--mongo-uri mongodb://localhost:27017/timetable_bench] [--users 10]
+                                    [--events-per-user 2000] [--recurring 0.05]
+                                    [--types work=4,personal=3,health=2,other=1] [--days 365]
+"""
+import argparse
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Event
+
+DEFAULT_TYPES = 'work=4,personal=3,health=2,other=1'
+
+# Hours an event of each type may start at; work is on weekdays only
+START_HOURS = {
+    'work': range(8, 18),
+    'health': range(6, 9),
+    'personal': range(17, 22),
+}
+OTHER_HOURS = range(8, 21)
+
+# (repeat, weight, imported rules used for part of the series)
+RECURRENCE = [
+    ('daily', 2, ['FREQ=DAILY;COUNT=30']),
+    ('weekly', 5, ['FREQ=WEEKLY;BYDAY=MO,WE,FR', 'FREQ=WEEKLY;INTERVAL=2']),
+    ('monthly', 2, ['FREQ=MONTHLY;BYMONTHDAY=1,15']),
+    ('yearly', 1, []),
+]
+DAYS_AHEAD = 14
+
+def parse_types(text):
+    """'work=4,personal=3' -> {'work': 4.0, 'personal': 3.0}"""
+    weights = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+def user_ids(users, first=0):
+    return [f'user-{i:06d}' for i in range(first, first + users)]
+
+def login(client, user_id):
+    """Make a Flask test client act as `user_id`, as if it had logged in"""
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+        session['username'] = user_id
+
+def generate_events(user_id, count, rng, now=None, days=365, recurring=0.05, types=None):
+    """`count` Event objects of one user"""
+    types = types or parse_types(DEFAULT_TYPES)
+    names, weights = list(types), list(types.values())
+    repeats = [repeat for repeat, _, _ in RECURRENCE]
+    repeat_weights = [weight for _, weight, _ in RECURRENCE]
+    rules = {repeat: options for repeat, _, options in RECURRENCE}
+    today = datetime(*(now or datetime.now()).timetuple()[:3])
+
+    events = []
+    for i in range(count):
+        event_type = rng.choices(names, weights)[0]
+        day = today + timedelta(days=rng.randrange(-days, DAYS_AHEAD))
+        if event_type == 'work':
+            while day.weekday() >= 5:
+                day -= timedelta(days=1)
+        start = day + timedelta(hours=rng.choice(START_HOURS.get(event_type, OTHER_HOURS)),
+                                minutes=rng.choice((0, 15, 30, 45)))
+        end = start + timedelta(minutes=15 * rng.choice((2, 2, 3, 4, 4, 6, 8)))
+
+        repeat, rule = None, None
+        if rng.random() < recurring:
+            repeat = rng.choices(repeats, repeat_weights)[0]
+            if rules[repeat] and rng.random() < 0.3:
+                rule = rng.choice(rules[repeat])
+        events.append(Event(f'{event_type.capitalize()} {i}', rng.choice(('', '', f'Notes for {event_type} {i}')),
+                            start, end, event_type, repeat, user_id, rrule=rule))
+    return events
+
+def seed(db, users=10, events_per_user=2000, recurring=0.05, types=None, days=365, seed=42, batch_size=10000,
+         first_user=0, rollups=None):
+    """Insert synthetic events of users first_user... into db.events; returns the number inserted.
+
+    With `rollups` (an EventRollups), each batch is also added to the rollups.
+    """
+    rng = random.Random(seed + first_user)
+    now = datetime.now()
+    batch = []
+    inserted = 0
+
+    def flush():
+        db.events.insert_many([event.to_dict() for event in batch], ordered=False)
+        if rollups is not None:
+            rollups.add_many(batch)
+        return len(batch)
+
+    for user_id in user_ids(users, first_user):
+        for event in generate_events(user_id, events_per_user, rng, now, days, recurring, types):
+            batch.append(event)
+            if len(batch) >= batch_size:
+                inserted += flush()
+                batch = []
+    if batch:
+        inserted += flush()
+    return inserted
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mongo-uri', default='mongodb://localhost:27017/timetable_bench')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--events-per-user', type=int, default=2000)
+    parser.add_argument('--recurring', type=float, default=0.05)
+    parser.add_argument('--types', default=DEFAULT_TYPES)
+    parser.add_argument('--days', type=int, default=365)
+    args = parser.parse_args()
+
+    os.environ['MONGO_URI'] = args.mongo_uri
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    import app as appmod
+    from indexes import ensure_indexes
+
+    db = appmod.mongo.db
+    ensure_indexes(db)
+    inserted = seed(db, args.users, args.events_per_user, args.recurring, parse_types(args.types), args.days)
+    written = appmod.rollups.rebuild()
+    print(f'Inserted {inserted} events for {args.users} users into {db.name}; wrote {written} rollups.')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+import asyncio
+import calendar
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from models import Event
+from pagination import KEYSET_SORT
+from recurrence import FREQUENCIES, occurrence, occurrence_starts
+
+# Grid cells are keyed by their start formatted with one of these; the same
+# format strings work in Python's strftime and Mongo's $dateToString
+DAY = '%Y-%m-%d'
+MONTH = '%Y-%m'
+
+def bucket_by_date(events):
+    """Group events by calendar date in a single pass, keeping their order"""
+    buckets = defaultdict(list)
+    for event in events:
+        buckets[event.start_time.date()].append(event)
+    return buckets
+
+def week_grid(start_of_week, events, more=None):
+    """List of (day, events, hidden count) for the 7 days starting at start_of_week"""
+    buckets = bucket_by_date(events)
+    more = more or {}
+    days = []
+    for i in range(7):
+        day = start_of_week + timedelta(days=i)
+        days.append((day, buckets.get(day.date(), []), more.get(day.strftime(DAY), 0)))
+    return days
+
+def month_grid(year, month, events, more=None):
+    """Weeks (Monday first) of (date, events, hidden count) cells, padded with None outside the month"""
+    buckets = bucket_by_date(events)
+    more = more or {}
+    first_weekday, days_in_month = calendar.monthrange(year, month)
+
+    grid = []
+    week = [None] * first_weekday
+
+    for day in range(1, days_in_month + 1):
+        current_date = datetime(year, month, day)
+        week.append((current_date, buckets.get(current_date.date(), []), more.get(current_date.strftime(DAY), 0)))
+
+        if len(week) == 7:
+            grid.append(week)
+            week = []
+
+    if week:
+        week.extend([None] * (7 - len(week)))
+        grid.append(week)
+
+    return grid
+
+def year_grid(year, events, more=None):
+    """List of (month, events, hidden count) for months 1-12"""
+    buckets = defaultdict(list)
+    for event in events:
+        buckets[event.start_time.month].append(event)
+    more = more or {}
+    return [(month, buckets.get(month, []), more.get(datetime(year, month, 1).strftime(MONTH), 0))
+            for month in range(1, 13)]
+
+def _cell_bounds(cell, cell_format):
+    start = datetime.strptime(cell, cell_format)
+    if cell_format == MONTH:
+        return start, (start + timedelta(days=32)).replace(day=1)
+    return start, start + timedelta(days=1)
+
+def series_query(user_id, window_start, window_end):
+    """Filter for the recurring series that can reach the window.
+
+    Series that ended before it are left out, so they are neither expanded
+    nor counted against a view's cap on loaded series.
+    """
+    return {'user_id': user_id, 'repeat': {'$in': list(FREQUENCIES)}, 'start_time': {'$lt': window_end},
+            '$or': [{'series_end': None}, {'series_end': {'$gte': window_start}}]}
+
+def _grid_queries(user_id, window_start, window_end):
+    """Filters for the one-off events starting in the window and the recurring series that can reach it"""
+    one_off = {'user_id': user_id, 'start_time': {'$gte': window_start, '$lt': window_end},
+               'repeat': {'$nin': list(FREQUENCIES)}}
+    return one_off, series_query(user_id, window_start, window_end)
+
+def _cell_counts(one_off, cell_format):
+    return [
+        {'$match': one_off},
+        {'$group': {'_id': {'$dateToString': {'format': cell_format, 'date': '$start_time'}},
+                    'count': {'$sum': 1}}}
+    ]
+
+# What counting a series' occurrences needs
+SERIES_COUNT_FIELDS = {'start_time': 1, 'repeat': 1, 'rrule': 1}
+
+def _count_occurrences(counts, doc, window_start, window_end, cell_format):
+    for start in occurrence_starts(Event.from_doc(doc), window_start, window_end):
+        counts[start.strftime(cell_format)] += 1
+
+def count_occurrences(docs, window_start, window_end):
+    """Occurrences in the window of series documents read with SERIES_COUNT_FIELDS"""
+    return sum(1 for doc in docs for _ in occurrence_starts(Event.from_doc(doc), window_start, window_end))
+
+def _cell_query(one_off, cell, cell_format, window_start, window_end):
+    cell_start, cell_end = _cell_bounds(cell, cell_format)
+    return {**one_off, 'start_time': {'$gte': max(cell_start, window_start), '$lt': min(cell_end, window_end)}}
+
+def build_grid(docs, cell_pages, series_docs, series_counts, window_start, window_end, cell_format, cell_limit):
+    """(events, more) of a grid from the documents fetched for it.
+
+    `docs` are the window's one-off events when there are few enough to load
+    at once; otherwise they are None and `cell_pages` yields
+    (cell, count, first documents) for each busy cell. Likewise
+    `series_docs` are the first series that can reach the window and
+    `series_counts` counts the occurrences per cell of the others.
+    """
+    candidates = defaultdict(list)
+    totals = Counter(series_counts)
+    if cell_pages is None:
+        for doc in docs:
+            event = Event.from_doc(doc)
+            cell = event.start_time.strftime(cell_format)
+            totals[cell] += 1
+            if len(candidates[cell]) < cell_limit:
+                candidates[cell].append(event)
+    else:
+        for cell, count, page in cell_pages:
+            totals[cell] += count
+            candidates[cell].extend(Event.from_doc(doc) for doc in page)
+
+    for doc in series_docs:
+        event = Event.from_doc(doc)
+        kept = Counter()
+        for start in occurrence_starts(event, window_start, window_end):
+            cell = start.strftime(cell_format)
+            totals[cell] += 1
+            if kept[cell] < cell_limit:
+                kept[cell] += 1
+                candidates[cell].append(occurrence(event, start))
+
+    events, more = [], {}
+    # Cells only reached by the series left out have a count but no events
+    for cell, total in totals.items():
+        cell_events = sorted(candidates.get(cell, ()), key=lambda event: (event.start_time, event._id))
+        shown = cell_events[:cell_limit]
+        events.extend(shown)
+        if total > len(shown):
+            more[cell] = total - len(shown)
+    events.sort(key=lambda event: (event.start_time, event._id))
+    return events, more
+
+def load_grid(collection, user_id, window_start, window_end, cell_format, cell_limit, max_events, fields):
+    """Load the events a calendar grid shows: at most `cell_limit` per day or month cell.
+
+    Returns (events, more), where `more` maps a cell key to the number of its
+    events left out. One-off events are fetched in a single query when the
+    window holds at most `max_events` of them; busier windows are counted per
+    cell on the server and only the first `cell_limit` events of each cell
+    are fetched. The same goes for recurring series: up to `max_events` are
+    loaded, and the occurrences of any others are only counted per cell, as
+    are occurrences past a cell's limit. Memory per request stays bounded
+    either way.
+    """
+    one_off, series = _grid_queries(user_id, window_start, window_end)
+    docs = list(collection.find(one_off, fields).sort(KEYSET_SORT).limit(max_events + 1))
+    cell_pages = None
+    if len(docs) > max_events:
+        docs = None
+        cell_pages = ((row['_id'], row['count'],
+                       collection.find(_cell_query(one_off, row['_id'], cell_format, window_start, window_end),
+                                       fields).sort(KEYSET_SORT).limit(cell_limit))
+                      for row in collection.aggregate(_cell_counts(one_off, cell_format)))
+    series_docs = list(collection.find(series, fields).sort(KEYSET_SORT).limit(max_events))
+    series_counts = Counter()
+    if len(series_docs) == max_events:
+        for doc in collection.find(series, SERIES_COUNT_FIELDS).sort(KEYSET_SORT).skip(max_events):
+            _count_occurrences(series_counts, doc, window_start, window_end, cell_format)
+    return build_grid(docs, cell_pages, series_docs, series_counts, window_start, window_end, cell_format,
+                      cell_limit)
+
+async def fetch_grid(collection, user_id, window_start, window_end, cell_format, cell_limit, max_events, fields):
+    """The documents load_grid() reads, from an async collection with concurrent queries.
+
+    Returns (docs, cell_pages, series_docs, series_counts) for build_grid().
+    """
+    one_off, series = _grid_queries(user_id, window_start, window_end)
+    docs, series_docs = await asyncio.gather(
+        collection.find(one_off, fields).sort(KEYSET_SORT).limit(max_events + 1).to_list(),
+        collection.find(series, fields).sort(KEYSET_SORT).limit(max_events).to_list())
+    series_counts = Counter()
+    if len(series_docs) == max_events:
+        async for doc in collection.find(series, SERIES_COUNT_FIELDS).sort(KEYSET_SORT).skip(max_events):
+            _count_occurrences(series_counts, doc, window_start, window_end, cell_format)
+    if len(docs) <= max_events:
+        return docs, None, series_docs, series_counts
+
+    rows = await (await collection.aggregate(_cell_counts(one_off, cell_format))).to_list()
+    pages = await asyncio.gather(*(
+        collection.find(_cell_query(one_off, row['_id'], cell_format, window_start, window_end), fields)
+        .sort(KEYSET_SORT).limit(cell_limit).to_list()
+        for row in rows))
+    return None, [(row['_id'], row['count'], page) for row, page in zip(rows, pages)], series_docs, series_counts
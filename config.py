@@ -1,11 +1,58 @@
 import os
+from datetime import timedelta
 from dotenv import load_dotenv
 
 load_dotenv()
 
 class Config:
-    SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-key-timetable-2023'
+    # Signs the session cookie, the only credential of a logged-in user; required outside debug mode
+    SECRET_KEY = os.environ.get('SECRET_KEY')
+    # Logins last this many days
+    PERMANENT_SESSION_LIFETIME = timedelta(days=int(os.environ.get('SESSION_DAYS') or 30))
+    SESSION_COOKIE_SAMESITE = 'Lax'
+    # Usernames allowed to change the shared email settings
+    ADMIN_USERNAMES = [name.strip().lower() for name in (os.environ.get('ADMIN_USERNAMES') or '').split(',')
+                       if name.strip()]
     MONGO_URI = os.environ.get('MONGO_URI') or 'mongodb://localhost:27017/timetable_manager'
+    MONGO_ENSURE_INDEXES = (os.environ.get('MONGO_ENSURE_INDEXES') or 'true').lower() == 'true'
+    # Serve the calendar and analytics views through an asyncio MongoDB client (see async_data.py)
+    ASYNC_DATA = (os.environ.get('ASYNC_DATA') or 'false').lower() == 'true'
+    
+    # JSON API limits
+    API_PAGE_SIZE = int(os.environ.get('API_PAGE_SIZE') or 1000)
+    API_BULK_MAX_EVENTS = int(os.environ.get('API_BULK_MAX_EVENTS') or 50000)
+    ICS_IMPORT_BATCH_SIZE = int(os.environ.get('ICS_IMPORT_BATCH_SIZE') or 1000)
+    
+    # Longest recurrence an event's rrule may describe: COUNT is capped at
+    # RRULE_MAX_COUNT and UNTIL at RRULE_MAX_YEARS from the time it is saved
+    RRULE_MAX_COUNT = int(os.environ.get('RRULE_MAX_COUNT') or 1000)
+    RRULE_MAX_YEARS = int(os.environ.get('RRULE_MAX_YEARS') or 10)
+    
+    # Recurring events are checked for conflicts (and free slots searched) this far ahead
+    CONFLICT_HORIZON_DAYS = int(os.environ.get('CONFLICT_HORIZON_DAYS') or 90)
+    # Users whose expanded occurrences over that horizon are kept in memory between checks
+    CONFLICT_CACHE_USERS = int(os.environ.get('CONFLICT_CACHE_USERS') or 16)
+    
+    # Per-request bounds for the calendar views: events per daily page, events
+    # shown per grid cell before "N more", and one-off events loaded at once
+    DAY_PAGE_SIZE = int(os.environ.get('DAY_PAGE_SIZE') or 100)
+    WEEK_CELL_LIMIT = int(os.environ.get('WEEK_CELL_LIMIT') or 50)
+    MONTH_CELL_LIMIT = int(os.environ.get('MONTH_CELL_LIMIT') or 5)
+    YEAR_CELL_LIMIT = int(os.environ.get('YEAR_CELL_LIMIT') or 20)
+    VIEW_MAX_EVENTS = int(os.environ.get('VIEW_MAX_EVENTS') or 2000)
+    
+    # Rendered calendar pages: 'memory' (per process), 'mongo' (shared by all
+    # processes, use it when running several workers) or 'none'
+    VIEW_CACHE_BACKEND = os.environ.get('VIEW_CACHE_BACKEND') or 'memory'
+    VIEW_CACHE_MAX_BYTES = int(os.environ.get('VIEW_CACHE_MAX_BYTES') or 32 * 1024 * 1024)
+    VIEW_CACHE_TTL = int(os.environ.get('VIEW_CACHE_TTL') or 300)
+    
+    # Rendered analytics charts: in-memory LRU budget and optional on-disk store
+    CHART_CACHE_MAX_BYTES = int(os.environ.get('CHART_CACHE_MAX_BYTES') or 32 * 1024 * 1024)
+    CHART_CACHE_DIR = os.environ.get('CHART_CACHE_DIR')
+    # Render charts in this many warm worker processes (0 = render in the request thread)
+    CHART_RENDER_PROCESSES = int(os.environ.get('CHART_RENDER_PROCESSES') or 0)
+    CHART_RENDER_TIMEOUT = float(os.environ.get('CHART_RENDER_TIMEOUT') or 10)
     
     # Email configuration
     MAIL_SERVER = os.environ.get('MAIL_SERVER') or 'smtp.gmail.com'
@@ -13,4 +60,23 @@ class Config:
     MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS') or True
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
-    MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER')
\ No newline at end of file
+    MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER')
+    
+    # Background delivery queue (see mail_queue.py)
+    MAIL_QUEUE_BATCH_SIZE = int(os.environ.get('MAIL_QUEUE_BATCH_SIZE') or 50)
+    MAIL_QUEUE_MAX_ATTEMPTS = int(os.environ.get('MAIL_QUEUE_MAX_ATTEMPTS') or 5)
+    MAIL_QUEUE_RETRY_DELAY = int(os.environ.get('MAIL_QUEUE_RETRY_DELAY') or 30)
+    # Send event changes as one digest email per recipient every this many minutes (0 = one email per change)
+    MAIL_DIGEST_MINUTES = int(os.environ.get('MAIL_DIGEST_MINUTES') or 0)
+    MAIL_DIGEST_MAX_CHANGES = int(os.environ.get('MAIL_DIGEST_MAX_CHANGES') or 100)
+    
+    # Reminder emails ahead of upcoming events (see reminders.py)
+    REMINDERS_ENABLED = (os.environ.get('REMINDERS_ENABLED') or 'false').lower() == 'true'
+    REMINDER_LEAD_MINUTES = int(os.environ.get('REMINDER_LEAD_MINUTES') or 15)
+    
+    # Request metrics at /metrics (see instrumentation.py)
+    SLOW_QUERY_MS = int(os.environ.get('SLOW_QUERY_MS') or 100)
+    SERVER_TIMING = (os.environ.get('SERVER_TIMING') or 'false').lower() == 'true'
+    
+    # Longest window of the analytics trend report, in years
+    REPORT_MAX_YEARS = int(os.environ.get('REPORT_MAX_YEARS') or 5)
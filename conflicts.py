@@ -0,0 +1,197 @@
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from operator import attrgetter
+from threading import Lock
+from models import Event, GRID_FIELDS
+from recurrence import FREQUENCIES, is_recurring, occurrence, occurrence_starts, series_version
+
+def overlap_query(user_id, window_start, window_end):
+    """Mongo filter for events that can have an occurrence overlapping [window_start, window_end)"""
+    # One-off events are bounded by end_time > window_start on the user_end_start
+    # index, so past events never have to be scanned
+    return {
+        '$or': [
+            {'user_id': user_id, 'end_time': {'$gt': window_start}, 'start_time': {'$lt': window_end}},
+            {'user_id': user_id, 'repeat': {'$in': list(FREQUENCIES)}, 'start_time': {'$lt': window_end}}
+        ]
+    }
+
+def overlapping_occurrences(events, window_start, window_end):
+    """Yield the occurrences of events that overlap [window_start, window_end)"""
+    for event in events:
+        if not is_recurring(event):
+            if event.start_time < window_end and event.end_time > window_start:
+                yield event
+            continue
+
+        # An occurrence that started up to one duration before the window still overlaps it
+        duration = event.end_time - event.start_time
+        for start in occurrence_starts(event, window_start - duration, window_end):
+            if start + duration > window_start:
+                yield occurrence(event, start)
+
+class IntervalTree:
+    """Static interval tree over the [start_time, end_time) of event occurrences.
+
+    Occurrences are sorted by start and laid out as an implicit balanced
+    binary search tree (each range's middle element is its root). Every node
+    also stores the latest end in its subtree, so a query skips whole subtrees
+    that end before the range it asks about: O(log n + k) per query.
+    """
+
+    def __init__(self, occurrences):
+        self.items = sorted(occurrences, key=attrgetter('start_time'))
+        self.starts = [item.start_time for item in self.items]
+        self.ends = [item.end_time for item in self.items]
+        self.max_end = list(self.ends)
+        self._augment(0, len(self.items))
+        self._busy = None
+
+    def __len__(self):
+        return len(self.items)
+
+    def _augment(self, lo, hi):
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        latest = self.ends[mid]
+        for child in (self._augment(lo, mid), self._augment(mid + 1, hi)):
+            if child is not None and child > latest:
+                latest = child
+        self.max_end[mid] = latest
+        return latest
+
+    def overlapping(self, start, end):
+        """Occurrences overlapping [start, end), by start time"""
+        found = []
+        stack = [(0, len(self.items))]
+        while stack:
+            lo, hi = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if self.max_end[mid] <= start:
+                continue  # nothing in this subtree ends after start
+            stack.append((lo, mid))
+            if self.starts[mid] < end:
+                if self.ends[mid] > start:
+                    found.append(self.items[mid])
+                stack.append((mid + 1, hi))
+        found.sort(key=attrgetter('start_time'))
+        return found
+
+    def busy_blocks(self):
+        """Merged, disjoint (start, end) blocks of busy time, built on first use"""
+        if self._busy is None:
+            blocks = []
+            for start, end in zip(self.starts, self.ends):
+                if blocks and start <= blocks[-1][1]:
+                    if end > blocks[-1][1]:
+                        blocks[-1][1] = end
+                else:
+                    blocks.append([start, end])
+            self._busy = ([block[0] for block in blocks], [block[1] for block in blocks])
+        return self._busy
+
+    def free_slot(self, duration, after, before):
+        """Start of the earliest free [start, start + duration) within [after, before), or None"""
+        block_starts, block_ends = self.busy_blocks()
+        candidate = after
+        # Block ends are sorted too, so skip straight to the first block still running at `after`
+        for i in range(bisect_right(block_ends, after), len(block_starts)):
+            if block_starts[i] - candidate >= duration or candidate + duration > before:
+                break
+            candidate = max(candidate, block_ends[i])
+        return candidate if candidate + duration <= before else None
+
+class ConflictDetector:
+    """Finds a user's occurrences that overlap an event, and free slots in their calendar.
+
+    Each check runs one indexed query for the events that can overlap a
+    window, expands recurring series into it and indexes the occurrences in
+    an IntervalTree. Recurring events are checked over the next
+    `horizon_days`, since they never end.
+
+    Expanding and indexing a busy calendar over the whole horizon takes far
+    longer than the query, so the trees of windows longer than a day are
+    kept for the last `cache_size` users. Such a tree covers the horizon
+    from the start of the window's day and is reused while the query returns
+    the same events in the same versions, so a change made by any process
+    rebuilds it.
+    """
+
+    def __init__(self, mongo, horizon_days=90, cache_size=16):
+        self.mongo = mongo
+        self.horizon = timedelta(days=horizon_days)
+        self.cache_size = cache_size
+        self._trees = OrderedDict()  # user_id -> (window_start, window_end, versions, tree)
+        self._lock = Lock()
+
+    def _build(self, events, window_start, window_end):
+        return IntervalTree(overlapping_occurrences(events, window_start, window_end))
+
+    def tree(self, user_id, window_start, window_end):
+        """IntervalTree of the user's occurrences overlapping [window_start, window_end), or more"""
+        day = window_start.replace(hour=0, minute=0, second=0, microsecond=0)
+        cover_end = day + self.horizon + timedelta(days=2)
+        if window_end - window_start <= timedelta(days=1) or window_end > cover_end or not self.cache_size:
+            docs = self.mongo.db.events.find(overlap_query(user_id, window_start, window_end), GRID_FIELDS)
+            return self._build((Event.from_doc(doc) for doc in docs), window_start, window_end)
+
+        docs = self.mongo.db.events.find(overlap_query(user_id, day, cover_end), GRID_FIELDS)
+        events = [Event.from_doc(doc) for doc in docs]
+        versions = frozenset((event._id, series_version(event)) for event in events)
+        with self._lock:
+            cached = self._trees.get(user_id)
+            if cached is not None and cached[:3] == (day, cover_end, versions):
+                self._trees.move_to_end(user_id)
+                return cached[3]
+
+        tree = self._build(events, day, cover_end)
+        with self._lock:
+            self._trees[user_id] = (day, cover_end, versions, tree)
+            self._trees.move_to_end(user_id)
+            while len(self._trees) > self.cache_size:
+                self._trees.popitem(last=False)
+        return tree
+
+    def invalidate(self, user_id):
+        """Drop a user's cached tree; it would only be rebuilt on its next use otherwise"""
+        with self._lock:
+            self._trees.pop(user_id, None)
+
+    def conflicts(self, event, now=None, limit=50):
+        """Other occurrences that overlap any occurrence of `event`, by start time (at most `limit`)"""
+        duration = event.end_time - event.start_time
+        if is_recurring(event):
+            window_start = max(event.start_time, now or datetime.now())
+            window_end = window_start + self.horizon
+            starts = list(occurrence_starts(event, window_start, window_end))
+        else:
+            starts = [event.start_time]
+        if not starts:
+            return []
+
+        tree = self.tree(event.user_id, starts[0], starts[-1] + duration)
+        found, seen = [], set()
+        for start in starts:
+            for other in tree.overlapping(start, start + duration):
+                key = (other._id, other.start_time)
+                # The event's own saved occurrences are in the tree when it is edited
+                if other._id != event._id and key not in seen:
+                    seen.add(key)
+                    found.append(other)
+            if len(found) >= limit:
+                break
+        found.sort(key=attrgetter('start_time'))
+        return found[:limit]
+
+    def next_free_slot(self, user_id, duration, after=None, within=None):
+        """Start of the user's first free slot of length `duration` after `after`, or None.
+
+        Only the next `within` (default: the horizon) is searched.
+        """
+        after = after or datetime.now()
+        before = after + (within or self.horizon)
+        return self.tree(user_id, after, before).free_slot(duration, after, before)
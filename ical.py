@@ -0,0 +1,262 @@
+import re
+from datetime import datetime, timedelta, timezone
+from dateutil import tz
+from pymongo.errors import BulkWriteError
+from models import Event, EVENT_TYPES, parse_rrule
+
+PRODID = '-//TimeFlow Scheduler//EN'
+
+def escape_text(value):
+    return (value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+def fold(line):
+    """Fold a content line to 75 octets per physical line, as RFC 5545 requires"""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line + '\r\n'
+
+    parts = []
+    limit = 75
+    while encoded:
+        cut = min(limit, len(encoded))
+        # Never split inside a multi-byte UTF-8 sequence
+        while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode('utf-8'))
+        encoded = encoded[cut:]
+        limit = 74  # continuation lines start with a space
+    return '\r\n '.join(parts) + '\r\n'
+
+def format_datetime(value):
+    # Stored times are naive local times, which iCalendar calls "floating"
+    return value.strftime('%Y%m%dT%H%M%S')
+
+def vevent(doc, dtstamp):
+    """Serialize one event document as a VEVENT component"""
+    lines = [
+        'BEGIN:VEVENT',
+        f"UID:{doc['_id']}@timeflow",
+        f'DTSTAMP:{dtstamp}',
+        f"DTSTART:{format_datetime(doc['start_time'])}",
+        f"DTEND:{format_datetime(doc['end_time'])}",
+        f"SUMMARY:{escape_text(doc.get('title') or '')}",
+    ]
+    if doc.get('description'):
+        lines.append(f"DESCRIPTION:{escape_text(doc['description'])}")
+    if doc.get('event_type'):
+        lines.append(f"CATEGORIES:{escape_text(doc['event_type'].upper())}")
+    if doc.get('rrule'):
+        lines.append(f"RRULE:{doc['rrule']}")
+    elif doc.get('repeat'):
+        lines.append(f"RRULE:FREQ={doc['repeat'].upper()}")
+    lines.append('END:VEVENT')
+    return ''.join(fold(line) for line in lines)
+
+def iter_ics(docs):
+    """Yield an iCalendar file chunk by chunk, one VEVENT per event document"""
+    dtstamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    yield f'BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:{PRODID}\r\nCALSCALE:GREGORIAN\r\n'
+    for doc in docs:
+        yield vevent(doc, dtstamp)
+    yield 'END:VCALENDAR\r\n'
+
+# --- Import ---
+
+_UNESCAPE = re.compile(r'\\([\\;,nN])')
+_DURATION = re.compile(r'([-+])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$')
+
+def unescape_text(value):
+    return _UNESCAPE.sub(lambda m: '\n' if m.group(1) in 'nN' else m.group(1), value)
+
+def unfold(lines):
+    """Yield logical content lines, joining folded continuation lines"""
+    current = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t'):
+            if current is not None:
+                current += line[1:]
+            continue
+        if current:
+            yield current
+        current = line
+    if current:
+        yield current
+
+def parse_line(line):
+    """Split a content line into (NAME, {PARAM: value}, value)"""
+    if '"' in line:
+        # Quoted parameter values may contain ':' and ';'
+        quoted = False
+        for colon, char in enumerate(line):
+            if char == '"':
+                quoted = not quoted
+            elif char == ':' and not quoted:
+                break
+        else:
+            raise ValueError(f"malformed content line: {line[:40]}")
+    else:
+        colon = line.find(':')
+        if colon < 0:
+            raise ValueError(f"malformed content line: {line[:40]}")
+
+    name, *params = line[:colon].split(';')
+    return name.upper(), dict(_split_param(param) for param in params), line[colon + 1:]
+
+def _split_param(param):
+    key, _, value = param.partition('=')
+    return key.upper(), value.strip('"')
+
+def iter_vevents(lines):
+    """Lazily yield the properties of each VEVENT as {NAME: (params, value)}.
+
+    Only the first occurrence of a property is kept, and nested components
+    such as VALARM are skipped, so memory use is one event at a time.
+    """
+    props = None
+    nested = 0
+    for line in unfold(lines):
+        upper = line.upper()
+        if upper == 'BEGIN:VEVENT':
+            props, nested = {}, 0
+        elif props is None:
+            continue
+        elif upper == 'END:VEVENT':
+            yield props
+            props = None
+        elif upper.startswith('BEGIN:'):
+            nested += 1
+        elif upper.startswith('END:'):
+            nested -= 1
+        elif not nested:
+            try:
+                name, params, value = parse_line(line)
+            except ValueError:
+                continue
+            props.setdefault(name, (params, value))
+
+def parse_datetime(params, value):
+    """Parse a DATE or DATE-TIME value into the naive local time the app stores"""
+    if params.get('VALUE') == 'DATE' or len(value) == 8:
+        return datetime(int(value[0:4]), int(value[4:6]), int(value[6:8]))
+
+    try:
+        parsed = datetime(int(value[0:4]), int(value[4:6]), int(value[6:8]),
+                          int(value[9:11]), int(value[11:13]), int(value[13:15]))
+    except (ValueError, IndexError):
+        raise ValueError(f"invalid date-time {value!r}")
+
+    zone = None
+    if value.endswith('Z'):
+        zone = timezone.utc
+    elif 'TZID' in params:
+        zone = tz.gettz(params['TZID'])  # unknown zones are treated as floating time
+    if zone is not None:
+        parsed = parsed.replace(tzinfo=zone).astimezone().replace(tzinfo=None)
+    return parsed
+
+def parse_duration(value):
+    match = _DURATION.match(value)
+    if not match:
+        raise ValueError(f"invalid duration {value!r}")
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    duration = timedelta(weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+                         minutes=int(minutes or 0), seconds=int(seconds or 0))
+    return -duration if sign == '-' else duration
+
+def event_from_vevent(props, user_id):
+    """Map VEVENT properties onto an Event; returns (event, warning or None)"""
+    if 'DTSTART' not in props:
+        raise ValueError("missing DTSTART")
+    start_params, start_value = props['DTSTART']
+    start_time = parse_datetime(start_params, start_value)
+
+    if 'DTEND' in props:
+        end_time = parse_datetime(*props['DTEND'])
+    elif 'DURATION' in props:
+        end_time = start_time + parse_duration(props['DURATION'][1])
+    elif start_params.get('VALUE') == 'DATE' or len(start_value) == 8:
+        end_time = start_time + timedelta(days=1)  # an all-day event lasts the whole day
+    else:
+        end_time = start_time
+    if end_time < start_time:
+        raise ValueError("DTEND is before DTSTART")
+
+    # The first category that names one of our event types wins
+    event_type = 'other'
+    if 'CATEGORIES' in props:
+        for category in props['CATEGORIES'][1].split(','):
+            category = unescape_text(category).strip().lower()
+            if category in EVENT_TYPES:
+                event_type = category
+                break
+
+    repeat, rule, warning = None, None, None
+    if 'RRULE' in props:
+        try:
+            repeat, rule = parse_rrule(props['RRULE'][1], start_time)
+        except ValueError as e:
+            warning = f"{e}; imported as a single event"
+    if repeat and ('EXDATE' in props or 'RDATE' in props):
+        warning = "EXDATE/RDATE are not supported and were ignored"
+
+    event = Event(
+        title=unescape_text(props['SUMMARY'][1]) if 'SUMMARY' in props else '(No title)',
+        description=unescape_text(props['DESCRIPTION'][1]) if 'DESCRIPTION' in props else '',
+        start_time=start_time,
+        end_time=end_time,
+        event_type=event_type,
+        repeat=repeat or '',
+        user_id=user_id,
+        rrule=rule
+    )
+    return event, warning
+
+def import_ics(lines, user_id, collection, rollups=None, batch_size=1000, max_messages=100):
+    """Stream VEVENTs from `lines` into `collection` in unordered batches of `batch_size`.
+
+    Only one batch is held in memory at a time. Returns a summary with the
+    number of imported events and the first `max_messages` errors and
+    warnings, each tagged with the (1-based) position of its VEVENT.
+    """
+    summary = {'imported': 0, 'errors': [], 'warnings': []}
+
+    def report(kind, position, props, message):
+        if len(summary[kind]) < max_messages:
+            entry = {'event': position, kind[:-1]: message}
+            if 'UID' in props:
+                entry['uid'] = props['UID'][1]
+            summary[kind].append(entry)
+
+    def flush(batch):
+        events = [event for _, event in batch]
+        failed = set()
+        try:
+            collection.insert_many([event.to_dict() for event in events], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details['writeErrors']:
+                failed.add(error['index'])
+                position, _ = batch[error['index']]
+                report('errors', position, {}, error['errmsg'])
+        inserted = [event for i, event in enumerate(events) if i not in failed]
+        if rollups is not None:
+            rollups.add_many(inserted)
+        summary['imported'] += len(inserted)
+
+    batch = []
+    for position, props in enumerate(iter_vevents(lines), 1):
+        try:
+            event, warning = event_from_vevent(props, user_id)
+        except ValueError as e:
+            report('errors', position, props, str(e))
+            continue
+        if warning:
+            report('warnings', position, props, warning)
+        batch.append((position, event))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+    return summary
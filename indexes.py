@@ -0,0 +1,198 @@
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, HASHED, IndexModel
+from analytics.time_analytics import TimeAnalytics
+from calendar_grid import series_query
+from conflicts import overlap_query
+from pagination import KEYSET_SORT
+from recurrence import FREQUENCIES
+from reminders import reminder_window_query
+
+# Every events query leads with user_id, then narrows by event_type and/or a start_time range
+INDEXES = {
+    # Accounts; _id is the user_id stored on everything the user owns
+    'users': [
+        IndexModel([('username', ASCENDING)], name='username', unique=True),
+    ],
+    'events': [
+        # _id breaks ties in keyset pagination on (start_time, _id)
+        IndexModel([('user_id', ASCENDING), ('start_time', ASCENDING), ('_id', ASCENDING)],
+                   name='user_start_id'),
+        IndexModel([('user_id', ASCENDING), ('event_type', ASCENDING), ('start_time', ASCENDING)],
+                   name='user_type_start'),
+        IndexModel([('user_id', ASCENDING), ('repeat', ASCENDING), ('start_time', ASCENDING)],
+                   name='user_repeat_start'),
+        # Overlap checks: end_time > window start skips the user's past events
+        IndexModel([('user_id', ASCENDING), ('end_time', ASCENDING), ('start_time', ASCENDING)],
+                   name='user_end_start'),
+        # Cross-user scan by the reminder scheduler for events due in its window
+        IndexModel([('next_occurrence_at', ASCENDING)], name='next_occurrence'),
+    ],
+    # One document per user, hour bucket and event type (bucket None = all-time totals)
+    'event_rollups': [
+        IndexModel([('user_id', ASCENDING), ('bucket', ASCENDING), ('event_type', ASCENDING)],
+                   name='user_bucket_type', unique=True),
+    ],
+    # Claimed reminders; the _id is the (event, occurrence) key
+    'reminder_claims': [
+        IndexModel([('claimed_at', ASCENDING)], name='claimed_ttl', expireAfterSeconds=7 * 24 * 3600),
+    ],
+    # Cached calendar pages (MongoBackend); expires_at None = kept until replaced
+    'view_cache': [
+        IndexModel([('expires_at', ASCENDING)], name='expires_ttl', expireAfterSeconds=0),
+    ],
+    'mail_queue': [
+        IndexModel([('status', ASCENDING), ('next_attempt_at', ASCENDING)], name='status_due'),
+        # Delivered mail is kept for a week for troubleshooting
+        IndexModel([('sent_at', ASCENDING)], name='sent_ttl', expireAfterSeconds=7 * 24 * 3600),
+    ],
+    # At most one open digest per recipient; concurrent first changes cannot open two
+    'mail_digests': [
+        IndexModel([('recipient', ASCENDING)], name='open_recipient', unique=True,
+                   partialFilterExpression={'status': 'open'}),
+        IndexModel([('status', ASCENDING), ('due_at', ASCENDING)], name='status_due'),
+    ],
+}
+
+# Per-user collections and their shard key. Every document carries user_id
+# and every unique index starts with it, so they can be sharded on a hashed
+# user_id (see shard_collections()); the queues and claims stay unsharded.
+SHARD_KEYS = {
+    'events': {'user_id': HASHED},
+    'event_rollups': {'user_id': HASHED},
+    'view_cache': {'user_id': HASHED},
+}
+
+# Query shapes the app issues, checked with explain() by check_query_plans().
+# Each entry maps a name to (collection, filter factory, sort).
+QUERY_SHAPES = {}
+
+# Shapes that read every user's documents on purpose (background jobs)
+CROSS_USER_SHAPES = set()
+
+# Any user id will do for explain()
+EXPLAIN_USER = 'explain-user'
+
+def register_query_shape(name, collection, make_filter, sort=None, cross_user=False):
+    """Register a query shape that must be served by an index"""
+    QUERY_SHAPES[name] = (collection, make_filter, sort)
+    if cross_user:
+        CROSS_USER_SHAPES.add(name)
+
+def _last_month():
+    now = datetime.now()
+    return {'$gte': now - timedelta(days=30), '$lte': now}
+
+register_query_shape('upcoming_events', 'events',
+                     lambda: {'user_id': EXPLAIN_USER, 'start_time': {'$gte': datetime.now()}},
+                     sort=[('start_time', ASCENDING)])
+register_query_shape('calendar_one_off', 'events',
+                     lambda: {'user_id': EXPLAIN_USER,
+                              'start_time': {'$gte': datetime.now(), '$lt': datetime.now() + timedelta(days=7)},
+                              'repeat': {'$nin': list(FREQUENCIES)}},
+                     sort=KEYSET_SORT)
+register_query_shape('calendar_series', 'events',
+                     lambda: series_query(EXPLAIN_USER, datetime.now(), datetime.now() + timedelta(days=7)),
+                     sort=KEYSET_SORT)
+register_query_shape('api_page', 'events',
+                     lambda: {'user_id': EXPLAIN_USER, 'start_time': {'$gte': datetime.now()}},
+                     sort=KEYSET_SORT)
+register_query_shape('overlap_window', 'events',
+                     lambda: overlap_query(EXPLAIN_USER, datetime.now(), datetime.now() + timedelta(hours=1)))
+register_query_shape('time_distribution', 'events',
+                     lambda: {'user_id': EXPLAIN_USER, 'start_time': _last_month()})
+register_query_shape('productive_events', 'events',
+                     lambda: {'user_id': EXPLAIN_USER, 'start_time': _last_month(),
+                              'event_type': {'$in': ['work', 'health', 'learning']}})
+register_query_shape('category_events', 'events',
+                     lambda: {'user_id': EXPLAIN_USER, 'event_type': 'work'})
+register_query_shape('reminder_window', 'events',
+                     lambda: reminder_window_query(datetime.now(), datetime.now() + timedelta(hours=1)),
+                     cross_user=True)
+register_query_shape('due_mail', 'mail_queue',
+                     lambda: {'status': 'pending', 'next_attempt_at': {'$lte': datetime.now()}},
+                     sort=[('next_attempt_at', ASCENDING)])
+register_query_shape('due_digests', 'mail_digests',
+                     lambda: {'status': 'open', 'due_at': {'$lte': datetime.now()}},
+                     sort=[('due_at', ASCENDING)])
+register_query_shape('trend_report', 'events',
+                     lambda: {'user_id': EXPLAIN_USER, 'end_time': {'$gt': datetime.now() - timedelta(days=365)},
+                              'start_time': {'$lt': datetime.now()}})
+register_query_shape('rollup_rebuild', 'events', lambda: {},
+                     sort=[('user_id', ASCENDING), ('start_time', ASCENDING)], cross_user=True)
+register_query_shape('user_rollup_rebuild', 'events', lambda: {'user_id': EXPLAIN_USER},
+                     sort=[('user_id', ASCENDING), ('start_time', ASCENDING)])
+register_query_shape('login', 'users', lambda: {'username': 'explain-user'})
+register_query_shape('rollup_window', 'event_rollups',
+                     lambda: {'user_id': EXPLAIN_USER, 'bucket': _last_month()})
+register_query_shape('dashboard_rollups', 'event_rollups',
+                     lambda: {'user_id': EXPLAIN_USER,
+                              **TimeAnalytics.since_match(datetime.now() - timedelta(days=30))})
+
+def ensure_indexes(db):
+    """Create the registered indexes (a no-op for ones that exist) and verify their key specs"""
+    for collection, models in INDEXES.items():
+        db[collection].create_indexes(models)
+
+    problems = []
+    for collection, models in INDEXES.items():
+        existing = db[collection].index_information()
+        for model in models:
+            spec = model.document
+            info = existing.get(spec['name'])
+            if info is None:
+                problems.append(f"{collection}.{spec['name']}: missing")
+            elif list(info['key']) != list(spec['key'].items()):
+                problems.append(f"{collection}.{spec['name']}: key is {info['key']}, "
+                                f"expected {list(spec['key'].items())}")
+    if problems:
+        raise RuntimeError("Index verification failed:\n  " + "\n  ".join(problems))
+
+def _plan_stages(plan):
+    """Yield every stage name in an explain() plan tree"""
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _plan_stages(item)
+
+def check_query_plans(db):
+    """Explain every registered query shape and raise if any winning plan is a COLLSCAN"""
+    scans = []
+    for name, (collection, make_filter, sort) in QUERY_SHAPES.items():
+        cursor = db[collection].find(make_filter())
+        if sort:
+            cursor = cursor.sort(sort)
+        winning_plan = cursor.explain()['queryPlanner']['winningPlan']
+        if 'COLLSCAN' in set(_plan_stages(winning_plan)):
+            scans.append(name)
+    if scans:
+        raise RuntimeError("Query shapes fall back to COLLSCAN: " + ", ".join(sorted(scans)))
+
+def _pins_user(query):
+    """Whether a filter matches a single user_id, directly or in every $or branch"""
+    if isinstance(query.get('user_id'), str):
+        return True
+    return bool(query.get('$or')) and all(_pins_user(branch) for branch in query['$or'])
+
+def check_shard_targeting():
+    """Raise if a registered query on a per-user collection does not pin a single user_id.
+
+    With the collections sharded on user_id, such a query would be sent to
+    every shard; only the shapes registered as cross_user may do that.
+    """
+    untargeted = [name for name, (collection, make_filter, _) in QUERY_SHAPES.items()
+                  if collection in SHARD_KEYS and name not in CROSS_USER_SHAPES
+                  and not _pins_user(make_filter())]
+    if untargeted:
+        raise RuntimeError("Query shapes not targeted at one user: " + ", ".join(sorted(untargeted)))
+
+def shard_collections(db):
+    """Shard the per-user collections on a hashed user_id; needs a connection through mongos"""
+    admin = db.client.admin
+    admin.command('enableSharding', db.name)
+    for collection, key in SHARD_KEYS.items():
+        db[collection].create_index(list(key.items()), name='user_hashed')
+        admin.command('shardCollection', f'{db.name}.{collection}', key=key)
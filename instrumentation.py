@@ -0,0 +1,245 @@
+import json
+import logging
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+from flask import before_render_template, g, has_request_context, request, template_rendered
+from pymongo import monitoring
+
+slow_query_logger = logging.getLogger('timetable.slow_queries')
+
+# Route label of work done outside a request (mail queue, reminders, CLI)
+BACKGROUND = '-'
+
+REQUEST_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+COMMAND_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = defaultdict(float)
+        self._lock = Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] += amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(f'{self.name}{_labels(self.labelnames, labels)} {value:g}' for labels, value in items)
+        return lines
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=REQUEST_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [count per bucket..., count above the last bucket, sum]
+        self._values = {}
+        self._lock = Lock()
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((labels, list(series)) for labels, series in self._values.items())
+        bounds = [f'le="{bound:g}"' for bound in self.buckets] + ['le="+Inf"']
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(bounds, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, bound)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {series[-1]:g}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+REQUEST_SECONDS = Histogram('timetable_request_seconds', 'Time to build a response, by route.',
+                            ('route', 'method', 'status'))
+STAGE_SECONDS = Histogram('timetable_stage_seconds',
+                          'Time spent per stage (mongo, grid, expand, template, chart, smtp, ...) by route; '
+                          'stages exclude the Mongo time inside them.', ('route', 'stage'))
+MONGO_COMMANDS = Counter('timetable_mongo_commands_total', 'MongoDB commands issued, by route and command.',
+                         ('route', 'command'))
+MONGO_COMMAND_SECONDS = Histogram('timetable_mongo_command_seconds', 'MongoDB command latency, by command.',
+                                  ('command',), COMMAND_BUCKETS)
+MONGO_COMMANDS_PER_REQUEST = Histogram('timetable_request_mongo_commands', 'MongoDB commands per request.',
+                                       ('route',), COUNT_BUCKETS)
+SLOW_QUERIES = Counter('timetable_slow_queries_total', 'MongoDB commands slower than SLOW_QUERY_MS.',
+                       ('route', 'command'))
+
+METRICS = [REQUEST_SECONDS, STAGE_SECONDS, MONGO_COMMANDS, MONGO_COMMAND_SECONDS, MONGO_COMMANDS_PER_REQUEST,
+           SLOW_QUERIES]
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+class RequestTimings:
+    __slots__ = ('route', 'start', 'stages', 'mongo_seconds', 'mongo_commands', 'template_starts')
+
+    def __init__(self, route):
+        self.route = route
+        self.start = perf_counter()
+        self.stages = defaultdict(float)
+        self.mongo_seconds = 0.0
+        self.mongo_commands = 0
+        self.template_starts = []
+
+def _timings():
+    if has_request_context():
+        return g.get('_timings')
+    return None
+
+def _route():
+    if has_request_context():
+        rule = request.url_rule
+        return rule.rule if rule is not None else 'unmatched'
+    return BACKGROUND
+
+@contextmanager
+def stage(name):
+    """Time a block as stage `name` of the current request (or of background work outside one)"""
+    timings = _timings()
+    mongo_before = timings.mongo_seconds if timings is not None else 0.0
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = perf_counter() - start
+        if timings is not None:
+            # Mongo time is a stage of its own, so it is not counted twice
+            timings.stages[name] += max(0.0, elapsed - (timings.mongo_seconds - mongo_before))
+        else:
+            STAGE_SECONDS.observe((BACKGROUND, name), elapsed)
+
+def query_shape(value):
+    """A query with every literal replaced by a placeholder, so similar queries log alike"""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        # $and/$or branches keep their shapes; value lists such as $in collapse to one placeholder
+        if any(isinstance(item, dict) for item in value):
+            return [query_shape(item) for item in value]
+        return ['?']
+    return '?'
+
+def command_shape(command_name, command):
+    """(collection, filter shape) of a command for the slow-query log"""
+    collection = command.get(command_name)
+    if command_name in ('find', 'count', 'distinct'):
+        query = command.get('filter', command.get('query'))
+    elif command_name == 'findAndModify':
+        query = command.get('query')
+    elif command_name == 'aggregate':
+        query = [step for step in command.get('pipeline', []) if '$match' in step or '$group' in step]
+    elif command_name in ('update', 'delete'):
+        statements = command.get('updates') or command.get('deletes') or [{}]
+        query = statements[0].get('q')
+    else:
+        query = None
+    return collection, query_shape(query) if query is not None else None
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Counts and times every MongoDB command per route and logs slow ones with their filter shape"""
+
+    def __init__(self, slow_query_ms=100):
+        self.slow_seconds = slow_query_ms / 1000 if slow_query_ms else None
+        # Commands in flight, kept only so a slow one can be logged with its filter
+        self._pending = {}
+
+    def started(self, event):
+        if self.slow_seconds is not None:
+            self._pending[(event.connection_id, event.request_id)] = event.command
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+    def _finish(self, event):
+        seconds = event.duration_micros / 1e6
+        command = self._pending.pop((event.connection_id, event.request_id), None)
+        timings = _timings()
+        if timings is not None:
+            route = timings.route
+            timings.mongo_seconds += seconds
+            timings.mongo_commands += 1
+        else:
+            route = _route()
+        MONGO_COMMANDS.inc((route, event.command_name))
+        MONGO_COMMAND_SECONDS.observe((event.command_name,), seconds)
+
+        if self.slow_seconds is not None and seconds >= self.slow_seconds and command is not None:
+            SLOW_QUERIES.inc((route, event.command_name))
+            collection, shape = command_shape(event.command_name, command)
+            slow_query_logger.warning("Slow %s on %s (%.1f ms, route %s): %s", event.command_name, collection,
+                                      seconds * 1000, route, json.dumps(shape, default=str))
+
+def _start_request():
+    g._timings = RequestTimings(_route())
+
+def _template_started(sender, template, context, **extra):
+    timings = _timings()
+    if timings is not None:
+        timings.template_starts.append((perf_counter(), timings.mongo_seconds))
+
+def _template_finished(sender, template, context, **extra):
+    timings = _timings()
+    if timings is not None and timings.template_starts:
+        start, mongo_before = timings.template_starts.pop()
+        elapsed = perf_counter() - start - (timings.mongo_seconds - mongo_before)
+        timings.stages['template'] += max(0.0, elapsed)
+
+def init_app(app, server_timing=False):
+    """Time every request of `app` and its stages; with server_timing, also report them in a Server-Timing header"""
+
+    def finish_request(response):
+        timings = g.pop('_timings', None)
+        if timings is None:
+            return response
+        total = perf_counter() - timings.start
+        route = timings.route
+        REQUEST_SECONDS.observe((route, request.method, str(response.status_code)), total)
+        MONGO_COMMANDS_PER_REQUEST.observe((route,), timings.mongo_commands)
+        timings.stages['mongo'] = timings.mongo_seconds
+        for name, seconds in timings.stages.items():
+            STAGE_SECONDS.observe((route, name), seconds)
+        if server_timing:
+            response.headers['Server-Timing'] = ', '.join(
+                [f'{name};dur={seconds * 1000:.1f}' for name, seconds in timings.stages.items()]
+                + [f'total;dur={total * 1000:.1f}'])
+        return response
+
+    app.before_request(_start_request)
+    app.after_request(finish_request)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
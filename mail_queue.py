@@ -0,0 +1,160 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+from flask_mail import Message
+from pymongo import ReturnDocument
+from instrumentation import stage
+
+logger = logging.getLogger(__name__)
+
+class MailQueue:
+    """Outgoing mail persisted in MongoDB and delivered by a background worker thread.
+
+    Requests only insert a document, so a slow mail server never stalls them.
+    The worker claims due messages in batches and sends each batch over a
+    single SMTP connection. Failed sends are retried with exponential backoff
+    until max_attempts is reached. Claims carry a lease, so messages held by a
+    crashed worker are picked up again, and several app processes can drain
+    the same queue.
+    """
+
+    def __init__(self, app, mail, mongo, batch_size=50, max_attempts=5, base_delay=30,
+                 poll_interval=5, lease=300):
+        self.app = app
+        self.mail = mail
+        self.mongo = mongo
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.poll_interval = poll_interval
+        self.lease = lease
+        # Called before each batch is claimed, e.g. DigestQueue.flush to queue due digests
+        self.before_batch = []
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def collection(self):
+        return self.mongo.db.mail_queue
+
+    def enqueue(self, subject, recipients, html):
+        self.enqueue_many([(subject, recipients, html)])
+
+    def enqueue_many(self, messages):
+        """Queue (subject, recipients, html) tuples with a single insert"""
+        now = datetime.now()
+        docs = [{
+            'subject': subject,
+            'recipients': recipients,
+            'html': html,
+            'status': 'pending',
+            'attempts': 0,
+            'next_attempt_at': now,
+            'created_at': now
+        } for subject, recipients, html in messages]
+        if not docs:
+            return
+        self.collection.insert_many(docs)
+        self.start()
+        self._wakeup.set()
+
+    def start(self):
+        """Start the delivery thread if it is not already running"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name='mail-queue', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                processed = self.process_batch()
+            except Exception:
+                logger.exception("Mail queue batch failed")
+                processed = 0
+            if not processed:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def _claim(self):
+        """Atomically claim up to batch_size due messages"""
+        now = datetime.now()
+        claimed = []
+        while len(claimed) < self.batch_size:
+            doc = self.collection.find_one_and_update(
+                {'$or': [
+                    {'status': 'pending', 'next_attempt_at': {'$lte': now}},
+                    {'status': 'sending', 'lease_expires_at': {'$lt': now}}
+                ]},
+                {'$set': {'status': 'sending', 'lease_expires_at': now + timedelta(seconds=self.lease)}},
+                sort=[('next_attempt_at', 1)],
+                return_document=ReturnDocument.AFTER
+            )
+            if doc is None:
+                break
+            claimed.append(doc)
+        return claimed
+
+    def _failed(self, doc, error):
+        attempts = doc['attempts'] + 1
+        update = {'attempts': attempts, 'last_error': str(error)}
+        if attempts >= self.max_attempts:
+            update['status'] = 'failed'
+            logger.error("Giving up on mail %s after %d attempts: %s", doc['_id'], attempts, error)
+        else:
+            update['status'] = 'pending'
+            update['next_attempt_at'] = datetime.now() + timedelta(seconds=self.base_delay * 2 ** (attempts - 1))
+        self.collection.update_one({'_id': doc['_id']}, {'$set': update, '$unset': {'lease_expires_at': ''}})
+
+    def process_batch(self):
+        """Deliver one batch of due messages over a single SMTP connection; returns the number claimed"""
+        for hook in self.before_batch:
+            try:
+                hook()
+            except Exception:
+                logger.exception("Mail queue hook %r failed", hook)
+        docs = self._claim()
+        if not docs:
+            return 0
+
+        remaining = list(reversed(docs))
+        with self.app.app_context():
+            try:
+                with self.mail.connect() as connection:
+                    while remaining:
+                        doc = remaining.pop()
+                        try:
+                            with stage('smtp'):
+                                connection.send(Message(subject=doc['subject'], recipients=doc['recipients'],
+                                                        html=doc['html']))
+                        except Exception as e:
+                            self._failed(doc, e)
+                            continue
+                        self.collection.update_one({'_id': doc['_id']}, {
+                            '$set': {'status': 'sent', 'sent_at': datetime.now()},
+                            '$unset': {'lease_expires_at': '', 'html': ''}
+                        })
+            except Exception as e:
+                # Connecting failed: the rest of the batch goes back on the queue
+                logger.warning("Mail server unavailable: %s", e)
+                for doc in remaining:
+                    self._failed(doc, e)
+        return len(docs)
+
+    def drain(self):
+        """Process everything currently due in the calling thread; returns the number of messages processed"""
+        total = 0
+        while True:
+            processed = self.process_batch()
+            if not processed:
+                return total
+            total += processed
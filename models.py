@@ -1,6 +1,10 @@
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from itertools import islice
 import json
 from bson import ObjectId
+from dateutil.rrule import rrulestr
+from config import Config
 
 class JSONEncoder(json.JSONEncoder):
     def default(self, o):
@@ -10,9 +14,155 @@ class JSONEncoder(json.JSONEncoder):
             return o.isoformat()
         return json.JSONEncoder.default(self, o)
 
+EVENT_TYPES = ('work', 'personal', 'health', 'other')
+REPEAT_CHOICES = ('daily', 'weekly', 'monthly', 'yearly')
+
+def naive_local(value):
+    """A datetime as the naive local time every stored event uses; ones with a UTC offset are converted"""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone().replace(tzinfo=None)
+
+def _parse_datetime(value, field):
+    if isinstance(value, datetime):
+        return naive_local(value)
+    try:
+        return naive_local(datetime.fromisoformat(value))
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be an ISO 8601 datetime")
+
+# Parts that would make a rule repeat more than once a day
+SUB_DAILY_PARTS = ('BYHOUR', 'BYMINUTE', 'BYSECOND')
+
+# Parts that can leave a rule without any date, e.g. BYMONTH=2;BYMONTHDAY=30 (so can BYDAY=5FR)
+SELECTIVE_PARTS = ('BYMONTH', 'BYMONTHDAY', 'BYYEARDAY', 'BYWEEKNO', 'BYSETPOS', 'BYEASTER')
+
+def _parse_until(value):
+    """An RRULE UNTIL as a naive local time"""
+    # Stored times are naive local times, so a UTC UNTIL is converted to match
+    for fmt in ('%Y%m%dT%H%M%SZ', '%Y%m%dT%H%M%S', '%Y%m%d'):
+        try:
+            until = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        return naive_local(until.replace(tzinfo=timezone.utc)) if value.endswith('Z') else until
+    raise ValueError("rrule UNTIL is not a valid date-time")
+
+def parse_rrule(value, dtstart):
+    """Split an RFC 5545 RRULE into (repeat, rule); rule is None when FREQ alone describes it.
+
+    Rules repeat at most daily, and COUNT and UNTIL are capped at
+    RRULE_MAX_COUNT and RRULE_MAX_YEARS from now (see config.py), so
+    iterating a whole series stays cheap.
+    """
+    if not isinstance(value, str):
+        raise ValueError("rrule must be a string")
+    value = value.strip()
+    if value.upper().startswith('RRULE:'):
+        value = value[6:]
+    
+    parts = {}
+    for part in value.split(';'):
+        name, _, part_value = part.partition('=')
+        parts[name.strip().upper()] = part_value.strip().upper()
+    
+    repeat = parts.get('FREQ', '').lower()
+    if repeat not in REPEAT_CHOICES:
+        raise ValueError(f"rrule FREQ must be one of {', '.join(REPEAT_CHOICES).upper()}")
+    if any(name in parts for name in SUB_DAILY_PARTS):
+        raise ValueError("rrule BYHOUR, BYMINUTE and BYSECOND are not supported; events repeat at most daily")
+    
+    if parts.get('COUNT', '').isdigit():
+        parts['COUNT'] = str(min(int(parts['COUNT']), Config.RRULE_MAX_COUNT))
+    if 'UNTIL' in parts:
+        latest = datetime.now().replace(microsecond=0) + timedelta(days=365 * Config.RRULE_MAX_YEARS)
+        parts['UNTIL'] = min(_parse_until(parts['UNTIL']), latest).strftime('%Y%m%dT%H%M%S')
+    
+    if set(parts) == {'FREQ'}:
+        return repeat, None
+    rule = ';'.join(f'{name}={part_value}' for name, part_value in parts.items())
+    if not _valid_rule(rule):
+        raise ValueError("rrule is not a valid recurrence rule")
+    # A rule that never matches would be searched to the year 9999 by every view showing it;
+    # without these parts, dtstart or the weekdays of its first period always match
+    selective = any(name in parts for name in SELECTIVE_PARTS) or any(c.isdigit() for c in parts.get('BYDAY', ''))
+    if selective and not _comes_within(rule, dtstart, Config.RRULE_MAX_YEARS):
+        raise ValueError(f"rrule has no date in the {Config.RRULE_MAX_YEARS} years from the event's start")
+    return repeat, rule
+
+# Weekdays and leap years repeat every 28 years (between the century years that are not leap years)
+CALENDAR_CYCLE_YEARS = 28
+
+@lru_cache(maxsize=1024)
+def _endless_rule(rule):
+    """The parsed rule without its COUNT and UNTIL; replace() gives it a dtstart"""
+    return rrulestr(';'.join(part for part in rule.split(';') if part.partition('=')[0] not in ('COUNT', 'UNTIL')),
+                    dtstart=datetime(2000, 1, 1))
+
+@lru_cache(maxsize=1024)
+def _comes_within(rule, dtstart, years):
+    """Whether a rule has an occurrence in the `years` after dtstart.
+
+    dateutil looks for the next date of a rule that never matches (e.g.
+    February 30th) up to the year 9999. So the rule, without its COUNT and
+    UNTIL, is asked from a dtstart moved by whole 28-year cycles to just
+    before then, which bounds the search to about `years` + 28 years.
+    """
+    cycles = (9999 - years - dtstart.year) // CALENDAR_CYCLE_YEARS
+    try:
+        shifted = dtstart.replace(year=dtstart.year + max(cycles, 0) * CALENDAR_CYCLE_YEARS)
+    except ValueError:
+        shifted = dtstart  # Feb 29 landing on a century year
+    first = next(iter(_endless_rule(rule).replace(dtstart=shifted)), None)
+    return first is not None and first - shifted <= timedelta(days=366 * years)
+
+@lru_cache(maxsize=1024)
+def _valid_rule(rule):
+    # Imports repeat the same few rules many times, so parsing is cached
+    try:
+        rrulestr(rule, dtstart=datetime(2000, 1, 1))
+    except (ValueError, TypeError):
+        return False
+    return True
+
+# Most occurrences series_end() iterates; COUNT never goes beyond it
+SERIES_END_MAX_OCCURRENCES = Config.RRULE_MAX_COUNT
+
+@lru_cache(maxsize=1024)
+def series_end(start_time, repeat, rule):
+    """Start of a series' last occurrence, or None if it does not repeat or never ends.
+
+    Stored with each event, so views can skip series that ended before their
+    window without expanding them. Series with more than
+    SERIES_END_MAX_OCCURRENCES occurrences are not walked: their UNTIL is an
+    upper bound of their last start, and without one (a COUNT saved before
+    it was capped) they count as never ending.
+    """
+    if not repeat or not rule:
+        return None
+    parts = dict(part.partition('=')[::2] for part in rule.split(';'))
+    if 'COUNT' not in parts and 'UNTIL' not in parts:
+        return None
+    occurrences = list(islice(rrulestr(rule, dtstart=start_time), SERIES_END_MAX_OCCURRENCES + 1))
+    if len(occurrences) <= SERIES_END_MAX_OCCURRENCES:
+        return occurrences[-1] if occurrences else start_time
+    if 'UNTIL' in parts:
+        return _parse_until(parts['UNTIL'])
+    return None
+
+# Fields read by the calendar grids; recurring series also need repeat/rrule
+# and both times to be expanded. _id is always returned by MongoDB.
+GRID_FIELDS = {'title': 1, 'start_time': 1, 'end_time': 1, 'event_type': 1, 'repeat': 1, 'rrule': 1}
+# Fields of views that show an event's details (lists, emails)
+DETAIL_FIELDS = {**GRID_FIELDS, 'description': 1, 'user_id': 1}
+
 class Event:
+    # Slots keep instances small; month and year views build thousands of them
+    __slots__ = ('title', 'description', 'start_time', 'end_time', 'event_type',
+                 'repeat', 'user_id', '_id', 'rrule')
+    
     def __init__(self, title, description, start_time, end_time, 
-                 event_type, repeat=None, user_id=None, _id=None):
+                 event_type, repeat=None, user_id=None, _id=None, rrule=None):
         self.title = title
         self.description = description
         self.start_time = start_time
@@ -21,6 +171,7 @@ class Event:
         self.repeat = repeat  # 'daily', 'weekly', 'monthly', 'yearly', None
         self.user_id = user_id
         self._id = _id or ObjectId()
+        self.rrule = rrule  # full RFC 5545 rule (e.g. imported from .ics) when repeat alone can't express it
     
     def to_dict(self):
         return {
@@ -31,7 +182,11 @@ class Event:
             'event_type': self.event_type,
             'repeat': self.repeat,
             'user_id': self.user_id,
-            '_id': self._id
+            '_id': self._id,
+            'rrule': self.rrule,
+            'series_end': series_end(self.start_time, self.repeat, self.rrule),
+            # The reminder scheduler moves it to the next occurrence as it sends reminders
+            'next_occurrence_at': self.start_time
         }
     
     @staticmethod
@@ -49,5 +204,64 @@ class Event:
             event_type=data.get('event_type'),
             repeat=data.get('repeat'),
             user_id=data.get('user_id'),
-            _id=_id
+            _id=_id,
+            rrule=data.get('rrule')
+        )
+    
+    @staticmethod
+    def from_doc(doc):
+        """Fast constructor for documents read from MongoDB, which always carry an ObjectId.
+        
+        Fields left out by a projection are None.
+        """
+        event = Event.__new__(Event)
+        get = doc.get
+        event.title = get('title')
+        event.description = get('description')
+        event.start_time = get('start_time')
+        event.end_time = get('end_time')
+        event.event_type = get('event_type')
+        event.repeat = get('repeat')
+        event.user_id = get('user_id')
+        event._id = doc['_id']
+        event.rrule = get('rrule')
+        return event
+    
+    @staticmethod
+    def from_json(data, user_id, _id=None):
+        """Build an Event from an API payload, raising ValueError if it is invalid"""
+        if not isinstance(data, dict):
+            raise ValueError("event must be a JSON object")
+        if not data.get('title'):
+            raise ValueError("title is required")
+        if not isinstance(data['title'], str):
+            raise ValueError("title must be a string")
+        if not isinstance(data.get('description') or '', str):
+            raise ValueError("description must be a string")
+        
+        start_time = _parse_datetime(data.get('start_time'), 'start_time')
+        end_time = _parse_datetime(data.get('end_time'), 'end_time')
+        if end_time < start_time:
+            raise ValueError("end_time must not be before start_time")
+        
+        event_type = data.get('event_type') or 'other'
+        if event_type not in EVENT_TYPES:
+            raise ValueError(f"event_type must be one of {', '.join(EVENT_TYPES)}")
+        repeat = data.get('repeat') or ''
+        if repeat and repeat not in REPEAT_CHOICES:
+            raise ValueError(f"repeat must be one of {', '.join(REPEAT_CHOICES)}")
+        rule = None
+        if data.get('rrule'):
+            repeat, rule = parse_rrule(data['rrule'], start_time)
+        
+        return Event(
+            title=data['title'],
+            description=data.get('description') or '',
+            start_time=start_time,
+            end_time=end_time,
+            event_type=event_type,
+            repeat=repeat,
+            user_id=user_id,
+            _id=_id,
+            rrule=rule
         )
\ No newline at end of file
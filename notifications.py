@@ -0,0 +1,173 @@
+import logging
+import re
+from datetime import datetime, timedelta
+from flask import render_template
+from markupsafe import escape
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+# Every field email_template.html shows, in the form event_fields() returns them
+EVENT_FIELDS = ('title', 'event_type', 'event_type_label', 'description', 'date', 'time_range', 'repeat')
+
+# Stand-in for a field while a variant is rendered; cannot occur in the template itself
+_MARKER = '\x00{}\x00'
+_MARKERS = re.compile('\x00(\\w+)\x00')
+
+def event_fields(event):
+    """The event fields of a notification email, as plain strings"""
+    return {
+        'title': event.title or '',
+        'event_type': event.event_type or '',
+        'event_type_label': (event.event_type or '').capitalize(),
+        'description': event.description or '',
+        'date': event.start_time.strftime('%A, %B %d, %Y'),
+        'time_range': f"{event.start_time.strftime('%I:%M %p')} - {event.end_time.strftime('%I:%M %p')}",
+        'repeat': event.repeat or 'Does not repeat',
+    }
+
+class EmailTemplate:
+    """A notification template rendered once per variant, with only the event fields filled in per email.
+
+    Apart from the event fields the markup only depends on the action and
+    on whether there is a description. Each such variant goes through Jinja
+    once, with markers in place of the fields, and is kept split around
+    them; an email is then a join of those chunks and the escaped fields.
+    """
+
+    def __init__(self, app, name='email_template.html'):
+        self.app = app
+        self.name = name
+        self._template = None
+        self._variants = {}
+
+    def _compile(self, template, action, has_description):
+        fields = {field: _MARKER.format(field) for field in EVENT_FIELDS}
+        if not has_description:
+            fields['description'] = ''
+        # Even items are markup, odd ones field names
+        return _MARKERS.split(template.render(action=action, **fields))
+
+    def render(self, event, action):
+        # The same template object until Jinja reloads a changed file (debug mode)
+        template = self.app.jinja_env.get_template(self.name)
+        if template is not self._template:
+            self._template, self._variants = template, {}
+        key = (action, bool(event.description))
+        parts = self._variants.get(key)
+        if parts is None:
+            parts = self._variants[key] = self._compile(template, *key)
+
+        fields = event_fields(event)
+        html = list(parts)
+        for i in range(1, len(html), 2):
+            html[i] = escape(fields[html[i]])
+        return ''.join(html)
+
+def coalesce(changes):
+    """One change per event, in order of first change, with the net action of the whole window.
+
+    An event created and then edited shows as created; one created and then
+    deleted is left out.
+    """
+    merged = {}
+    for change in changes:
+        key = change['event_id']
+        previous = merged.get(key)
+        if previous is not None and previous['action'] == 'created':
+            if change['action'] == 'deleted':
+                del merged[key]
+                continue
+            change = {**change, 'action': 'created'}
+        merged[key] = change
+    return list(merged.values())
+
+class DigestQueue:
+    """Event notifications coalesced into one email per recipient and time window.
+
+    The first change for a recipient opens a digest in the `mail_digests`
+    collection, due `window_minutes` later; further changes are pushed onto
+    it until then (only the last `max_changes` are kept, the rest are
+    counted). The mail queue flushes due digests before each batch: each is
+    claimed with a lease, rendered once and queued as a single email.
+    """
+
+    def __init__(self, app, mongo, mail_queue, window_minutes=15, max_changes=100, lease=300):
+        self.app = app
+        self.mongo = mongo
+        self.mail_queue = mail_queue
+        self.window = timedelta(minutes=window_minutes)
+        self.max_changes = max_changes
+        self.lease = lease
+
+    @property
+    def collection(self):
+        return self.mongo.db.mail_digests
+
+    def add(self, recipients, event, action):
+        """Record an event change for each recipient's open digest"""
+        now = datetime.now()
+        change = {
+            'event_id': event._id,
+            'action': action,
+            'title': event.title,
+            'event_type': event.event_type,
+            'start_time': event.start_time,
+            'end_time': event.end_time,
+            'repeat': event.repeat,
+            'changed_at': now,
+        }
+        update = {
+            '$push': {'changes': {'$each': [change], '$slice': -self.max_changes}},
+            '$inc': {'total': 1},
+            '$setOnInsert': {'created_at': now, 'due_at': now + self.window},
+        }
+        for recipient in recipients:
+            query = {'recipient': recipient, 'status': 'open'}
+            try:
+                self.collection.update_one(query, update, upsert=True)
+            except DuplicateKeyError:
+                # Another process opened this recipient's digest first
+                self.collection.update_one(query, update)
+        # Make sure a worker is running to flush the digest once it is due
+        self.mail_queue.start()
+
+    def _claim(self, now, limit):
+        claimed = []
+        while len(claimed) < limit:
+            doc = self.collection.find_one_and_update(
+                {'$or': [
+                    {'status': 'open', 'due_at': {'$lte': now}},
+                    {'status': 'sending', 'lease_expires_at': {'$lt': now}}
+                ]},
+                {'$set': {'status': 'sending', 'lease_expires_at': now + timedelta(seconds=self.lease)}},
+                sort=[('due_at', 1)],
+                return_document=ReturnDocument.AFTER
+            )
+            if doc is None:
+                break
+            claimed.append(doc)
+        return claimed
+
+    def build_message(self, doc):
+        """(subject, recipients, html) of a digest, or None if its changes cancel out"""
+        changes = coalesce(doc['changes'])
+        omitted = doc['total'] - len(doc['changes'])
+        if not changes and not omitted:
+            return None
+        count = len(changes) + omitted
+        subject = f"Schedule digest: {count} change{'s' if count != 1 else ''}"
+        html = render_template('email_digest.html', changes=changes, omitted=omitted, since=doc['created_at'])
+        return subject, [doc['recipient']], html
+
+    def flush(self, now=None):
+        """Queue one email per due digest (up to a mail batch); returns the number of digests flushed"""
+        docs = self._claim(now or datetime.now(), self.mail_queue.batch_size)
+        if not docs:
+            return 0
+        with self.app.app_context():
+            messages = [self.build_message(doc) for doc in docs]
+        self.mail_queue.enqueue_many([message for message in messages if message is not None])
+        self.collection.delete_many({'_id': {'$in': [doc['_id'] for doc in docs]}})
+        return len(docs)
@@ -0,0 +1,40 @@
+from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+
+# Everything paginated is ordered by start time, with _id breaking ties
+KEYSET_SORT = [('start_time', 1), ('_id', 1)]
+
+def encode_cursor(start_time, _id):
+    """Opaque cursor pointing just after the event (or occurrence) at (start_time, _id)"""
+    return f'{start_time.isoformat()}_{_id}'
+
+def decode_cursor(cursor):
+    """Return (start_time, _id) from a cursor, raising ValueError if it is malformed"""
+    start, _, _id = cursor.rpartition('_')
+    try:
+        return datetime.fromisoformat(start), ObjectId(_id)
+    except (ValueError, InvalidId, TypeError):
+        raise ValueError("invalid cursor")
+
+def after_cursor(query, cursor):
+    """Restrict a start_time-bounded Mongo filter to documents after the cursor.
+
+    Raising the lower start_time bound keeps the index scan tight; the $or
+    only has to break ties between events starting at the same time.
+    """
+    start_time, _id = cursor
+    bounds = dict(query.get('start_time') or {})
+    if '$gte' not in bounds or bounds['$gte'] < start_time:
+        bounds['$gte'] = start_time
+    return {**query, 'start_time': bounds,
+            '$or': [{'start_time': {'$gt': start_time}}, {'start_time': start_time, '_id': {'$gt': _id}}]}
+
+def keyset_page(items, limit, cursor=None):
+    """Split items sorted by (start_time, _id) into (page, next cursor or None)"""
+    if cursor is not None:
+        items = [item for item in items if (item.start_time, item._id) > cursor]
+    page = items[:limit]
+    if len(items) > limit:
+        return page, encode_cursor(page[-1].start_time, page[-1]._id)
+    return page, None
@@ -0,0 +1,191 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from operator import attrgetter
+from threading import Lock
+from dateutil import rrule
+from models import Event
+
+FREQUENCIES = {
+    'daily': rrule.DAILY,
+    'weekly': rrule.WEEKLY,
+    'monthly': rrule.MONTHLY,
+    'yearly': rrule.YEARLY,
+}
+
+def is_recurring(event):
+    return event.repeat in FREQUENCIES
+
+def series_version(event):
+    """Version of a series - changes whenever an edit touches any field its occurrences carry.
+
+    Views load different projections of an event; fields a projection leaves
+    out are None, which also keeps their cached occurrences apart.
+    """
+    return (event.start_time, event.end_time, event.repeat, event.rrule,
+            event.title, event.description, event.event_type, event.user_id)
+
+# Series whose occurrences are a fixed time apart; they are generated by
+# adding the step, which is several times faster than iterating an rrule
+STEPS = {
+    'daily': timedelta(days=1),
+    'weekly': timedelta(days=7),
+}
+
+# Parts of a rule that replace the day dateutil would otherwise take from dtstart
+DAY_PARTS = ('BYWEEKNO', 'BYYEARDAY', 'BYMONTHDAY', 'BYDAY', 'BYEASTER')
+
+def _parse_parts(rule):
+    return dict(part.split('=', 1) for part in rule.split(';'))
+
+def _months_between(start, end):
+    return (end.year - start.year) * 12 + end.month - start.month
+
+def _full_rule_from(event, window_start):
+    """Build an imported RFC 5545 rule, fast-forwarded to the window where that keeps its occurrences.
+
+    Whole INTERVAL periods can be skipped without changing which dates a rule
+    produces. Daily and weekly rules skip them from dtstart; monthly and
+    yearly ones restart at the first of the period before the window, with
+    the day (and month) dateutil would take from the real dtstart pinned in
+    the rule. COUNT and BYSETPOS depend on the series' history, so those
+    rules are iterated from their real dtstart.
+    """
+    dtstart = event.start_time
+    rule = event.rrule
+    parts = _parse_parts(rule)
+    if window_start <= dtstart or 'COUNT' in parts or 'BYSETPOS' in parts:
+        return rrule.rrulestr(rule, dtstart=dtstart)
+
+    interval = int(parts.get('INTERVAL', 1))
+    if parts['FREQ'] in ('DAILY', 'WEEKLY'):
+        step = timedelta(days=(1 if parts['FREQ'] == 'DAILY' else 7) * interval)
+        dtstart += (window_start - dtstart) // step * step
+        return rrule.rrulestr(rule, dtstart=dtstart)
+
+    months = interval * (1 if parts['FREQ'] == 'MONTHLY' else 12)
+    skipped = (_months_between(dtstart, window_start) // months - 1) * months
+    if skipped <= 0:
+        return rrule.rrulestr(rule, dtstart=dtstart)
+    if not any(part in parts for part in DAY_PARTS):
+        rule += f';BYMONTHDAY={dtstart.day}'
+        if parts['FREQ'] == 'YEARLY' and 'BYMONTH' not in parts:
+            rule += f';BYMONTH={dtstart.month}'
+    month = dtstart.month - 1 + skipped
+    anchor = dtstart.replace(year=dtstart.year + month // 12, month=month % 12 + 1, day=1)
+    if parts['FREQ'] == 'YEARLY':
+        anchor = anchor.replace(month=1)
+    return rrule.rrulestr(rule, dtstart=anchor)
+
+def _rule_from(event, window_start):
+    """Build the series rrule with dtstart fast-forwarded to the window.
+
+    Iterating an rrule always starts at dtstart, so a series created years ago
+    would otherwise walk its whole history before reaching the window.
+    """
+    if event.rrule:
+        return _full_rule_from(event, window_start)
+
+    dtstart = event.start_time
+    freq = FREQUENCIES[event.repeat]
+    if window_start <= dtstart:
+        return rrule.rrule(freq, dtstart=dtstart)
+
+    # Monthly/yearly series keep their original day (e.g. the 31st or Feb 29),
+    # so anchor on the 1st of the window's month/year and pin the day explicitly
+    if event.repeat == 'monthly':
+        anchor = dtstart.replace(year=window_start.year, month=window_start.month, day=1)
+        return rrule.rrule(freq, dtstart=anchor, bymonthday=dtstart.day)
+
+    anchor = dtstart.replace(year=window_start.year, month=1, day=1)
+    return rrule.rrule(freq, dtstart=anchor, bymonth=dtstart.month, bymonthday=dtstart.day)
+
+def _stepped_starts(dtstart, step, window_start, window_end):
+    start = dtstart
+    if window_start > start:
+        # Skip straight to the first step at or after window_start
+        start += -((start - window_start) // step) * step
+    while start < window_end:
+        yield start
+        start += step
+
+def occurrence_starts(event, window_start, window_end):
+    """Lazily yield the start times of an event's occurrences in [window_start, window_end)"""
+    if not is_recurring(event):
+        if window_start <= event.start_time < window_end:
+            yield event.start_time
+        return
+
+    if not event.rrule and event.repeat in STEPS:
+        yield from _stepped_starts(event.start_time, STEPS[event.repeat], window_start, window_end)
+        return
+
+    for start in _rule_from(event, window_start):
+        if start >= window_end:
+            return
+        if start >= window_start:
+            yield start
+
+def next_start(event, since):
+    """Start of the event's first occurrence at or after `since`, or None if there is none"""
+    return next(occurrence_starts(event, since, datetime.max), None)
+
+def occurrence(event, start):
+    """Return the occurrence of a series starting at `start`"""
+    if start == event.start_time:
+        return event
+    return Event(event.title, event.description, start,
+                 start + (event.end_time - event.start_time),
+                 event.event_type, event.repeat, event.user_id, event._id, event.rrule)
+
+class RecurrenceCache:
+    """LRU cache of expanded series keyed by event id, series version and window"""
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def occurrences(self, event, window_start, window_end):
+        """Occurrences of a series in the window; cached entries are shared, so callers must not mutate them"""
+        key = (event._id, series_version(event), window_start, window_end)
+        with self._lock:
+            expanded = self._entries.get(key)
+            if expanded is not None:
+                self._entries.move_to_end(key)
+                return expanded
+
+        expanded = tuple(occurrence(event, start)
+                         for start in occurrence_starts(event, window_start, window_end))
+        with self._lock:
+            self._entries[key] = expanded
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return expanded
+
+    def invalidate(self, event_id):
+        """Drop every cached window of a series (stale versions would only age out otherwise)"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == event_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+def expand_events(events, window_start, window_end, cache=None):
+    """Expand events into their occurrences inside [window_start, window_end), sorted by start time"""
+    occurrences = []
+    for event in events:
+        if not is_recurring(event):
+            if window_start <= event.start_time < window_end:
+                occurrences.append(event)
+            continue
+
+        if cache is not None:
+            occurrences.extend(cache.occurrences(event, window_start, window_end))
+        else:
+            occurrences.extend(occurrence(event, start)
+                               for start in occurrence_starts(event, window_start, window_end))
+
+    occurrences.sort(key=attrgetter('start_time'))
+    return occurrences
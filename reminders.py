@@ -0,0 +1,167 @@
+import heapq
+import itertools
+import logging
+import threading
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from models import Event, DETAIL_FIELDS
+from recurrence import expand_events, next_start
+
+logger = logging.getLogger(__name__)
+
+# Mongo error code for a duplicate key, i.e. another worker claimed the reminder first
+DUPLICATE_KEY = 11000
+
+# What a refill reads: the event, and where its next occurrence was
+REMINDER_FIELDS = {**DETAIL_FIELDS, 'next_occurrence_at': 1}
+
+# Stored datetimes have millisecond precision
+TICK = timedelta(milliseconds=1)
+
+def reminder_window_query(window_start, window_end):
+    """Events of any user whose next occurrence not yet reminded of starts before window_end.
+
+    Every event stores next_occurrence_at (its start_time when saved); the
+    scheduler moves it to the following occurrence when it claims a
+    reminder, and to the first one from `now` on when it finds it behind. So
+    a refill only reads the events due in its window plus the few saved or
+    left behind since the last one, however many series never end. Nothing
+    before window_start is filtered out: what is left there is moved on by
+    the refill that reads it.
+    """
+    return {'next_occurrence_at': {'$lt': window_end}}
+
+class ReminderScheduler:
+    """Sends a reminder `lead` minutes before every event occurrence.
+
+    Every `refill_interval` seconds the scheduler loads the occurrences
+    starting within the next `lead + horizon` minutes with one indexed range
+    query on next_occurrence_at (see reminder_window_query; recurring series
+    are expanded by the recurrence engine) and keeps them in a min-heap
+    ordered by fire time, so between refills it only sleeps until the next
+    reminder is due. Each reminder is claimed by inserting its
+    (event, occurrence) key into `reminder_claims`; the unique _id makes the
+    claim atomic, so any number of workers can run without double sends.
+    """
+
+    def __init__(self, app, mongo, mail_queue, build_message, lead_minutes=15, horizon_minutes=60,
+                 refill_interval=60):
+        self.app = app
+        self.mongo = mongo
+        self.mail_queue = mail_queue
+        self.build_message = build_message
+        self.lead = timedelta(minutes=lead_minutes)
+        self.horizon = timedelta(minutes=horizon_minutes)
+        self.refill_interval = timedelta(seconds=refill_interval)
+        self._heap = []
+        self._counter = itertools.count()
+        self._claimed = {}
+        self._next_refill = datetime.min
+        self._stopping = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def claim_key(event, occurrence_start):
+        return f'{event._id}:{occurrence_start.isoformat()}'
+
+    def refill(self, now):
+        """Rebuild the heap from the occurrences starting in [now, now + lead + horizon)"""
+        window_end = now + self.lead + self.horizon
+        docs = list(self.mongo.db.events.find(reminder_window_query(now, window_end), REMINDER_FIELDS))
+        events = [Event.from_doc(doc) for doc in docs]
+        # Not cached: the window moves with `now`, so an expansion is never asked for twice
+        occurrences = expand_events(events, now, window_end)
+        series = {event._id: event for event in events}
+
+        heap = [(occurrence.start_time - self.lead, next(self._counter), occurrence, series[occurrence._id])
+                for occurrence in occurrences
+                if self.claim_key(occurrence, occurrence.start_time) not in self._claimed]
+        heapq.heapify(heap)
+        self._heap = heap
+
+        # Occurrences that have started can no longer come back
+        self._claimed = {key: start for key, start in self._claimed.items() if start >= now}
+        self._next_refill = now + self.refill_interval
+
+        # Events saved with a past start, or whose occurrences went by unclaimed, move
+        # to their first occurrence from now on so later refills no longer read them
+        self._advance([(event, doc['next_occurrence_at'], next_start(event, now))
+                       for event, doc in zip(events, docs) if doc['next_occurrence_at'] < now])
+
+    def _advance(self, moves):
+        """Set next_occurrence_at of each (event, from, to), unless another worker moved it further"""
+        updates = [UpdateOne({'_id': event._id, 'user_id': event.user_id, 'next_occurrence_at': {'$lte': since}},
+                             {'$set': {'next_occurrence_at': start}})
+                   for event, since, start in moves]
+        if updates:
+            self.mongo.db.events.bulk_write(updates, ordered=False)
+
+    def _pop_due(self, now):
+        """(occurrence, series event) of every reminder whose fire time has passed"""
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due.append(heapq.heappop(self._heap)[2:])
+        return due
+
+    def _claim(self, due):
+        """Claim reminders in one bulk insert; return the occurrences this worker won"""
+        now = datetime.now()
+        occurrences = [occurrence for occurrence, _ in due]
+        keys = [self.claim_key(occurrence, occurrence.start_time) for occurrence in occurrences]
+        lost = set()
+        try:
+            self.mongo.db.reminder_claims.insert_many(
+                [{'_id': key, 'claimed_at': now} for key in keys], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details['writeErrors']:
+                if error['code'] != DUPLICATE_KEY:
+                    raise
+                lost.add(error['index'])
+        self._claimed.update((key, occurrence.start_time) for key, occurrence in zip(keys, occurrences))
+        # Claimed either way, so the event's next reminder is its following occurrence
+        self._advance([(event, occurrence.start_time, next_start(event, occurrence.start_time + TICK))
+                       for occurrence, event in due])
+        return [occurrence for i, occurrence in enumerate(occurrences) if i not in lost]
+
+    def dispatch_due(self, now=None):
+        """Claim and queue every reminder whose fire time has passed; returns the number queued"""
+        now = now or datetime.now()
+        if now >= self._next_refill:
+            self.refill(now)
+
+        due = self._pop_due(now)
+        if not due:
+            return 0
+
+        won = self._claim(due)
+        with self.app.app_context():
+            # build_message returns None for occurrences nobody should be reminded of
+            messages = (self.build_message(occurrence, 'reminder') for occurrence in won)
+            self.mail_queue.enqueue_many([message for message in messages if message is not None])
+        return len(won)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.dispatch_due()
+            except Exception:
+                logger.exception("Reminder dispatch failed")
+                self._next_refill = datetime.now() + self.refill_interval
+
+            now = datetime.now()
+            wake_at = self._next_refill
+            if self._heap:
+                wake_at = min(wake_at, self._heap[0][0])
+            self._stopping.wait(max((wake_at - now).total_seconds(), 0.1))
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='reminders', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -0,0 +1,43 @@
+import os
+import sys
+
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from auth import safe_next
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.add_url_rule('/', 'index', lambda: '')
+    with app.test_request_context():
+        yield app
+
+@pytest.mark.parametrize('target', [
+    '/weekly?date=2025-03-01',
+    '/event/abc/edit',
+    '/',
+])
+def test_keeps_local_paths(app, target):
+    assert safe_next(target) == target
+
+@pytest.mark.parametrize('target', [
+    '//evil.com',
+    '/\\evil.com',
+    '\\\\evil.com',
+    '/\t/evil.com',
+    '/\n/evil.com',
+    '/\r\n/evil.com',
+    '\t//evil.com',
+    ' //evil.com',
+    '/\x00/evil.com',
+    'https://evil.com',
+    'javascript:alert(1)',
+    'evil.com',
+    '',
+    None,
+])
+def test_rejects_other_sites(app, target):
+    assert safe_next(target) == '/'
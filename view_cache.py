@@ -0,0 +1,189 @@
+import hashlib
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from threading import Lock
+from recurrence import is_recurring
+
+# Calendar views and the period each one shows
+VIEWS = ('day', 'week', 'month', 'year')
+
+def bucket_start(view, moment):
+    """First day of the `view` period containing `moment`"""
+    day = datetime(moment.year, moment.month, moment.day)
+    if view == 'day':
+        return day
+    if view == 'week':
+        return day - timedelta(days=day.weekday())
+    if view == 'month':
+        return day.replace(day=1)
+    return day.replace(month=1, day=1)
+
+def _new_token():
+    return uuid.uuid4().hex
+
+class MemoryBackend:
+    """In-process LRU of cache entries, bounded by the size of their bodies"""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = Lock()
+
+    @staticmethod
+    def _cost(value):
+        return len(value.get('body') or '') + 100
+
+    def _expired(self, item):
+        return item[1] is not None and item[1] <= time.monotonic()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            if self._expired(item):
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return item[0]
+
+    def _drop(self, key):
+        value, _ = self._entries.pop(key)
+        self._size -= self._cost(value)
+
+    def _put(self, key, value, ttl):
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (value, None if ttl is None else time.monotonic() + ttl)
+        self._size += self._cost(value)
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            self._drop(next(iter(self._entries)))
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._put(key, value, ttl)
+
+    def set_if(self, key, token, value, ttl=None):
+        """Store value only if the key still holds `token`; returns whether it did"""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None or self._expired(item) or item[0]['token'] != token:
+                return False
+            self._put(key, value, ttl)
+            return True
+
+class MongoBackend:
+    """Cache entries in the `view_cache` collection, shared by every app process.
+
+    Expired entries are removed by the collection's TTL index. Every key
+    starts with a user id, which is also stored as `user_id`, so lookups
+    stay on one shard when the collection is sharded by user.
+    """
+
+    def __init__(self, mongo):
+        self.mongo = mongo
+
+    @property
+    def collection(self):
+        return self.mongo.db.view_cache
+
+    @staticmethod
+    def _filter(key):
+        return {'_id': key, 'user_id': key.partition(':')[0]}
+
+    @staticmethod
+    def _expires_at(ttl):
+        return None if ttl is None else datetime.now() + timedelta(seconds=ttl)
+
+    def get(self, key):
+        doc = self.collection.find_one(self._filter(key))
+        if doc is None or (doc['expires_at'] is not None and doc['expires_at'] <= datetime.now()):
+            return None
+        return doc['value']
+
+    def set(self, key, value, ttl=None):
+        query = self._filter(key)
+        self.collection.replace_one(query, {'user_id': query['user_id'], 'value': value,
+                                            'expires_at': self._expires_at(ttl)}, upsert=True)
+
+    def set_if(self, key, token, value, ttl=None):
+        result = self.collection.update_one(
+            {**self._filter(key), 'value.token': token},
+            {'$set': {'value': value, 'expires_at': self._expires_at(ttl)}})
+        return result.modified_count == 1
+
+class ViewCache:
+    """Rendered calendar pages per user, view and period, with write-through invalidation.
+
+    Every (user, view, period) has a slot holding a version token and, once
+    rendered, the page. A write replaces the token of each slot its events
+    fall in, and a page is only stored if its slot's token is unchanged since
+    the lookup, so a render that raced with a write can never be cached.
+    Recurring events can show up in any later period, so writes to them (or
+    to too many slots at once) rotate the user's generation token instead,
+    which is part of every slot key.
+    """
+
+    def __init__(self, backend, ttl=300, max_invalidations=256):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_invalidations = max_invalidations
+
+    def _generation(self, user_id, create=True):
+        key = f'{user_id}:generation'
+        value = self.backend.get(key)
+        if value is None:
+            if not create:
+                return None
+            # A missing generation (never set, or evicted) starts a new one, so
+            # entries cached under an older one can never resurface
+            value = {'token': _new_token()}
+            self.backend.set(key, value)
+        return value['token']
+
+    @staticmethod
+    def _slot(user_id, generation, view, start):
+        return f'{user_id}:{generation}:{view}:{start:%Y-%m-%d}'
+
+    def lookup(self, user_id, view, moment):
+        """Return (slot, token, entry); entry is the cached {'etag', 'body'} or None"""
+        slot = self._slot(user_id, self._generation(user_id), view, bucket_start(view, moment))
+        value = self.backend.get(slot)
+        if value is None:
+            value = {'token': _new_token()}
+            self.backend.set(slot, value, self.ttl)
+        if 'body' in value:
+            return slot, value['token'], value
+        return slot, value['token'], None
+
+    def store(self, slot, token, body):
+        """Cache a page rendered after lookup() returned `token`; returns its ETag"""
+        etag = hashlib.sha256(body.encode('utf-8')).hexdigest()[:32]
+        self.backend.set_if(slot, token, {'token': token, 'etag': etag, 'body': body}, self.ttl)
+        return etag
+
+    def invalidate_user(self, user_id):
+        self.backend.set(f'{user_id}:generation', {'token': _new_token()})
+
+    def invalidate(self, user_id, events):
+        """Invalidate every page the given events (before or after a write) appear on"""
+        generation = self._generation(user_id, create=False)
+        if generation is None:
+            return  # nothing cached for this user
+
+        slots = set()
+        for event in events:
+            if is_recurring(event):
+                self.invalidate_user(user_id)
+                return
+            slots.update(self._slot(user_id, generation, view, bucket_start(view, event.start_time))
+                         for view in VIEWS)
+            if len(slots) > self.max_invalidations:
+                self.invalidate_user(user_id)
+                return
+
+        for slot in slots:
+            self.backend.set(slot, {'token': _new_token()}, self.ttl)